@@ -2,9 +2,10 @@ import pandas as pd
 import argparse
 import json
 import os
-from openpyxl import Workbook
 from openpyxl.styles import PatternFill, Font, Alignment, Border, Side
-from openpyxl.utils import get_column_letter
+
+from modules.excel_utils import ColumnWidthTracker, cell_style
+from modules.xlsx_writer import SheetWriter
 
 # Configuration loader for rules
 def load_config(config_path: str) -> dict:
@@ -57,7 +58,46 @@ df_template = pd.DataFrame(template_data)
 
 import csv
 import re
+import queue
+import pickle
+import hashlib
+import logging
+import logging.handlers
 import pandas as pd
+from array import array
+from collections import Counter
+from contextlib import contextmanager
+
+# Module logger; per-row diagnostics are DEBUG, per-form summaries are INFO
+logger = logging.getLogger("study_specific_forms")
+
+
+@contextmanager
+def queued_logging():
+    """
+    Route this module's log records through a QueueHandler for the duration of
+    the block. Records are handed to the root logger's handlers by a
+    QueueListener thread, so formatting and stream/file I/O stay out of the
+    extraction loops. Does nothing if the root logger has no handlers.
+    """
+    root_handlers = logging.getLogger().handlers
+    if not root_handlers or any(isinstance(h, logging.handlers.QueueHandler) for h in logger.handlers):
+        yield
+        return
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    listener = logging.handlers.QueueListener(log_queue, *root_handlers, respect_handler_level=True)
+    propagate = logger.propagate
+    logger.addHandler(queue_handler)
+    logger.propagate = False
+    listener.start()
+    try:
+        yield
+    finally:
+        listener.stop()
+        logger.removeHandler(queue_handler)
+        logger.propagate = propagate
 
 
 def get_text(node):
@@ -481,11 +521,17 @@ def has_option_child(node):
     return False
 
 
-def extract_items_from_form(form_node):
+def extract_items_from_form(form_node, skipped=None):
     """
     Extracts item data, handling rows with TH (question) + TD (options),
     and persistently tracking the Item Group across table breaks.
+
+    Parameters:
+    - form_node: The form node from extract_forms_cleaned()
+    - skipped: Optional Counter, incremented per reason for every skipped table/row
     """
+    if skipped is None:
+        skipped = Counter()
     items_data = []
     table_nodes = find_nodes_by_name_pattern(form_node, r'^Table')
 
@@ -495,7 +541,8 @@ def extract_items_from_form(form_node):
     for table in table_nodes:
         # 🔥 NEW: Skip metadata tables
         if is_metadata_table(table):
-            print(f"⚠️  Skipping metadata table: {table.get('name', '')}")
+            skipped["metadata table"] += 1
+            logger.debug("Skipping metadata table: %s", table.get('name', ''))
             continue
         tr_nodes = find_nodes_by_name_pattern(table, r'^TR')
 
@@ -526,6 +573,7 @@ def extract_items_from_form(form_node):
                     # Check if ALL P nodes are ParagraphSpan (skip category headers)
                     all_paragraph_spans = all(node.get("name", "").startswith("ParagraphSpan") for node in p_nodes)
                     if all_paragraph_spans:
+                        skipped["category header"] += 1
                         continue
 
                     # Extract text from ALL P nodes
@@ -536,18 +584,22 @@ def extract_items_from_form(form_node):
 
                     # 🔥 ADD THIS LINE HERE - RIGHT AFTER EXTRACTING question_text
                 if not question_text or not question_text.strip() or question_text.strip() in ["*", "**", "***"]:
+                    skipped["empty label"] += 1
                     continue
 
                 # 🔥 CRITICAL FIX 1: Check if the question text is an instruction
                 if is_instruction(question_text):
-                    print(f"    ⚠️  Skipping instruction row (3-col): '{question_text}'")
+                    skipped["instruction"] += 1
+                    logger.debug("Skipping instruction row (3-col): '%s'", question_text)
                     continue
 
 
                 # 🔥 NEW: Check if option_cell contains valid option content
                 # Skip rows where the option cell has metadata like "C, CO"
                 if not is_valid_option_content(option_cell):
-                    print(f"    ⚠️  Skipping false positive: '{get_text(option_cell)}' (metadata/annotation)")
+                    skipped["false positive"] += 1
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug("Skipping false positive: '%s' (metadata/annotation)", get_text(option_cell))
                     continue
 
                 # # 🔥 ENHANCED: Combine TH text with question text if TH contains "*" or meaningful prefix
@@ -590,6 +642,7 @@ def extract_items_from_form(form_node):
                         if p_nodes:
                             all_paragraph_spans = all(node.get("name", "").startswith("ParagraphSpan") for node in p_nodes)
                             if all_paragraph_spans:
+                                skipped["category header"] += 1
                                 continue
 
                             p_texts = [get_text(p_node) for p_node in p_nodes if get_text(p_node)]
@@ -599,10 +652,12 @@ def extract_items_from_form(form_node):
 
                         # 🔥 NEW: Skip if item_name_text is ONLY asterisks
                         if not item_name_text or item_name_text.strip() in ["*", "**", "***"]:
+                            skipped["empty label"] += 1
                             continue
                      # 🔥 CRITICAL FIX 2: ADD THIS INSTRUCTION CHECK!
                     if is_instruction(item_name_text):
-                        print(f"    ⚠️  Skipping instruction row (2-col): '{item_name_text}'")
+                        skipped["instruction"] += 1
+                        logger.debug("Skipping instruction row (2-col): '%s'", item_name_text)
                         continue
 
 
@@ -620,6 +675,8 @@ def extract_items_from_form(form_node):
         if item_key not in seen_names:
             seen_names.add(item_key)
             unique_items.append(item)
+        else:
+            skipped["duplicate"] += 1
     return unique_items
 
 
@@ -959,220 +1016,466 @@ def assign_item_order(items):
     return items
 
 
+# ==============================================================================
+# COLUMNAR ITEM TABLE
+# ==============================================================================
+
+# Grouped output headers (Row 2 groups, Row 3 subheaders) and colors (light pastels)
+STUDY_FORMS_GROUPS = [
+    {
+        "name": "Source",
+        "subheaders": [
+            "New or Copied from Study",
+        ],
+        "color": "E7E6E6",  # light gray
+    },
+    {
+        "name": "Form",
+        "subheaders": [
+            "Form Label",
+            "Form Name (provided by SDTM Programmer, if SDTM linked form)",
+        ],
+        "color": "C6EFCE",  # light green
+    },
+    {
+        "name": "Item Group",
+        "subheaders": [
+            "Item Group (if only one on form, recommend same as Form Label)",
+            "Item group Repeating",
+            "Repeat Maximum, if known, else default =50",
+            "Display format of repeating item group (Grid, read only, form)",
+            "Default Data in repeating item group",
+        ],
+        "color": "B3E5FC",  # light blue
+    },
+    {
+        "name": "Item",
+        "subheaders": [
+            "Item Order",
+            "Item Label",
+            "Item Name (provided by SDTM Programmer, if SDTM linked item)",
+        ],
+        "color": "FFD7A8",  # light orange
+    },
+    {
+        "name": "Progressive Display",
+        "subheaders": [
+            "Progressively displayed?",
+            "Controlling item (item triggering it, if yes, describe item below)",
+            "Controlling item value",
+        ],
+        "color": "B3E5FC",  # light blue
+    },
+    {
+        "name": "Data Type",
+        "subheaders": [
+            "Data type",
+            "If text or number, Field Length",
+            "If number, Precision (decimal places)",
+        ],
+        "color": "FFF9C4",  # pale yellow
+    },
+    {
+        "name": "Codelist",
+        "subheaders": [
+            "Codelist – Choice Labels (if binary, can use Goodlist Table)",
+            "Codelist Name (provided by SDTM Programmer)",
+            "Choice Code (provided by SDTM Programmer)",
+            "Codelist Control Type",
+        ],
+        "color": "E2F0D9",  # light green variant
+    },
+    {
+        "name": "System Queries",
+        "subheaders": [
+            "If number, Range: Min Value / Max Value",
+            "Date: Query Future Date",
+            "Required",
+            "If Required, Open Query when intentionally left blank (form/item)",
+        ],
+        "color": "F8CBAD",  # light orange variant
+    },
+    {
+        "name": "Notes",
+        "subheaders": [
+            "Notes",
+        ],
+        "color": "E6B8AF",  # light brownish
+    },
+]
+
+# Output columns in Row 3 order; every item row is stored in this order
+ORDERED_SUBHEADERS = [sub for group in STUDY_FORMS_GROUPS for sub in group["subheaders"]]
+
+# Columns held as typed integer arrays; all other columns hold strings
+INTEGER_COLUMNS = {
+    "Repeat Maximum, if known, else default =50",
+    "Item Order",
+}
+
+
+class ItemTable:
+    """
+    Columnar store for the Study Specific Forms item rows.
+
+    Keeps one array per output column in ORDERED_SUBHEADERS order: integer
+    columns use array('q'), the rest are plain lists of strings. Rows can be
+    streamed back as tuples for the Excel writer, or the whole table handed
+    over column-wise (to_dict / to_frame) for post-processing and export.
+    """
+
+    def __init__(self, columns=None):
+        self.columns = list(columns) if columns is not None else list(ORDERED_SUBHEADERS)
+        self._arrays = [array('q') if name in INTEGER_COLUMNS else [] for name in self.columns]
+
+    def __len__(self):
+        return len(self._arrays[0]) if self._arrays else 0
+
+    def append_row(self, values):
+        """Append one row given as a sequence in column order."""
+        if len(values) != len(self._arrays):
+            raise ValueError(f"Expected {len(self._arrays)} values, got {len(values)}")
+        for column, value in zip(self._arrays, values):
+            column.append(value)
+
+    def column(self, name):
+        """Return the array backing a column."""
+        return self._arrays[self.columns.index(name)]
+
+    def rows(self):
+        """Iterate rows as tuples in column order."""
+        return zip(*self._arrays)
+
+    def to_dict(self):
+        """Return {column name: list of values}."""
+        return {name: list(values) for name, values in zip(self.columns, self._arrays)}
+
+    def to_frame(self):
+        """Return the table as a pandas DataFrame."""
+        return pd.DataFrame(self.to_dict(), columns=self.columns)
+
+    def to_arrow(self):
+        """Return the EXPORT_COLUMNS subset as a pyarrow Table with snake_case field names."""
+        try:
+            import pyarrow as pa
+        except ImportError as e:
+            raise ImportError("pyarrow is required for columnar item table export (pip install pyarrow)") from e
+
+        arrays, fields = [], []
+        for column_name, field_name in EXPORT_COLUMNS:
+            values = self.column(column_name)
+            field_type = pa.int64() if column_name in INTEGER_COLUMNS else pa.string()
+            arrays.append(pa.array(values, type=field_type))
+            fields.append(pa.field(field_name, field_type))
+        return pa.Table.from_arrays(arrays, schema=pa.schema(fields))
+
+
+# Item table columns written to columnar exports, with their exported field names
+EXPORT_COLUMNS = [
+    ("Form Label", "form_label"),
+    ("Form Name (provided by SDTM Programmer, if SDTM linked form)", "form_name"),
+    ("Item Group (if only one on form, recommend same as Form Label)", "item_group"),
+    ("Item group Repeating", "item_group_repeating"),
+    ("Repeat Maximum, if known, else default =50", "repeat_maximum"),
+    ("Item Order", "item_order"),
+    ("Item Label", "item_label"),
+    ("Data type", "data_type"),
+    ("If text or number, Field Length", "field_length"),
+    ("If number, Precision (decimal places)", "precision"),
+    ("Codelist – Choice Labels (if binary, can use Goodlist Table)", "codelist_choice_labels"),
+    ("Codelist Control Type", "codelist_control_type"),
+    ("If number, Range: Min Value / Max Value", "number_range"),
+    ("Date: Query Future Date", "query_future_date"),
+    ("Required", "required"),
+    ("If Required, Open Query when intentionally left blank (form/item)", "open_query_when_blank"),
+]
+
+
+def write_item_table(item_table, output_path):
+    """
+    Write the item table as a columnar file, chosen by extension:
+    .parquet/.pq for Parquet, .arrow/.ipc/.feather for the Arrow IPC file format.
+    Requires pyarrow.
+    """
+    ext = os.path.splitext(output_path)[1].lower()
+    if ext not in (".parquet", ".pq", ".arrow", ".ipc", ".feather"):
+        raise ValueError(f"Unsupported item table format '{ext}' (use .parquet or .arrow)")
+
+    table = item_table.to_arrow()
+    if ext in (".parquet", ".pq"):
+        import pyarrow.parquet as pq
+        pq.write_table(table, output_path)
+    else:
+        import pyarrow as pa
+        with pa.OSFile(output_path, "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+    return output_path
+
+
+def build_item_row(form, item, item_group_counts, repeating_groups):
+    """
+    Build the output row for one item as a tuple in ORDERED_SUBHEADERS order.
+
+    Parameters:
+    - form: Form dictionary from extract_forms_cleaned()
+    - item: Item dictionary from extract_items_from_form() (with 'Item_Order')
+    - item_group_counts / repeating_groups: Result of analyze_item_groups_per_form()
+    """
+    option_node = item.get("Option_TD_Node")
+    item_name = item['Item Name']
+
+    # Extract Item Group and set to 'NaN' if empty
+    item_group_value = item.get("Item Group", "")
+    if item_group_value == "":
+        item_group_value = 'NaN'
+
+    # Determine if this item group is repeating
+    item_group_repeating_flag = get_item_group_repeating_flag(item_group_value, repeating_groups)
+
+    # Calculate repeat maximum based on repeating status
+    repeat_maximum = get_repeat_maximum(item_group_value, item_group_repeating_flag, item_group_counts)
+
+    # 🔥 Get sequential item order (1, 2, 3...)
+    item_order = item.get('Item_Order', 1)
+
+    # Get codelist content first, then determine data type
+    codelist_content = get_all_lbody_values(option_node)
+    data_type = determine_data_type(option_node, codelist_content)
+
+    # Field Length for Text or Label types; Precision and number range for Label only
+    field_length = calculate_field_length(codelist_content) if data_type in ["Text", "Label"] else ""
+    precision = calculate_precision(codelist_content) if data_type == "Label" else ""
+    number_range = extract_number_range(codelist_content) if data_type == "Label" else ""
+
+    # Check if field is required (based on * in item name)
+    is_required = check_required_field(item_name)
+
+    return (
+        # Source
+        "",
+        # Form
+        form['Form Label'],
+        form['Form Name'],
+        # Item Group
+        item_group_value,
+        item_group_repeating_flag,
+        repeat_maximum,
+        "",
+        "",
+        # Item
+        item_order,
+        item_name,
+        "",
+        # Progressive Display
+        "",
+        "",
+        "",
+        # Data Type
+        data_type,
+        field_length,
+        precision,
+        # Codelist
+        codelist_content,
+        "",
+        "",
+        "Radio Button-Vertical" if data_type == "Codelist" else "",
+        # System Queries
+        number_range,
+        check_query_future_date(data_type),
+        is_required,
+        "Form,Item" if is_required == "Y" else "",
+        # Notes
+        "",
+    )
+
+
+def build_form_rows(form, skipped=None):
+    """
+    Extract the items of one form and return its output rows (tuples in
+    ORDERED_SUBHEADERS order). Skipped tables/rows are counted into `skipped`.
+    """
+    if skipped is None:
+        skipped = Counter()
+    items = extract_items_from_form(form['Form_Node'], skipped)
+
+    if not items:
+        items.append({"Item Name": "", "Option_TD_Node": None, "Item Group": ""})
+
+    # 🔥 UPDATED: Assign sequential item order (1, 2, 3...) based on Item Label sequence
+    items = assign_item_order(items)
+
+    # Analyze item groups for this form to determine repeating status
+    item_group_counts, repeating_groups = analyze_item_groups_per_form(items)
+
+    logger.info(
+        "Form '%s': %d items, %d item groups (%d repeating); skipped: %s",
+        form['Form Name'], len(items), len(item_group_counts), len(repeating_groups),
+        _format_counts(skipped),
+    )
+    if repeating_groups:
+        logger.debug("Form '%s': repeating groups %s", form['Form Name'], sorted(repeating_groups))
+
+    return [build_item_row(form, item, item_group_counts, repeating_groups) for item in items]
+
+
+# ==============================================================================
+# FORM-LEVEL CACHE FOR INCREMENTAL REGENERATION
+# ==============================================================================
+
+# Bump when extraction logic changes so that older caches are discarded
+FORM_CACHE_VERSION = 1
+
+
+def config_fingerprint(config):
+    """Hash the rules config together with the cache version."""
+    payload = json.dumps(config, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(f"{FORM_CACHE_VERSION}:{payload}".encode("utf-8")).hexdigest()
+
+
+def form_fingerprint(form, config_digest):
+    """
+    Hash everything a form's output rows depend on: the rules config, the
+    form label and name, and the form node's whole subtree.
+    """
+    h = hashlib.sha256()
+    h.update(config_digest.encode("utf-8"))
+    h.update(form['Form Label'].encode("utf-8"))
+    h.update(b"\0")
+    h.update(form['Form Name'].encode("utf-8"))
+    h.update(b"\0")
+    h.update(json.dumps(form['Form_Node'], sort_keys=True, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+    return h.hexdigest()
+
+
+def load_form_cache(cache_path):
+    """Load {fingerprint: rows} from a cache file; returns {} if missing or unreadable."""
+    if not cache_path or not os.path.exists(cache_path):
+        return {}
+    try:
+        with open(cache_path, "rb") as f:
+            cached = pickle.load(f)
+    except Exception as e:
+        logger.warning("Ignoring unreadable forms cache %s: %s", cache_path, e)
+        return {}
+    if not isinstance(cached, dict) or cached.get("version") != FORM_CACHE_VERSION:
+        return {}
+    return cached.get("forms", {})
+
+
+def save_form_cache(cache_path, forms):
+    """Write {fingerprint: rows} to the cache file (atomically replaced)."""
+    cache_dir = os.path.dirname(cache_path)
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = cache_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump({"version": FORM_CACHE_VERSION, "forms": forms}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, cache_path)
+
+
 # ==============================================================================
 # UPDATED MAIN PROCESSING FUNCTION WITH SIMPLE ITEM ORDER
 # ==============================================================================
 
-def process_clinical_forms(json_file_path, template_csv_path=None, output_csv_path="Study_Specific_Form.xlsx", config_path: str = "./config/config_study_specific_forms.json"):
-    """Main function to process JSON and create the item-based Excel with repeating logic and item order."""
+def build_item_table(data, config_path: str = "./config/config_study_specific_forms.json", cache_path=None, progress=None):
+    """
+    Build the study forms item table from a parsed eCRF document.
+    If cache_path is given, rows of forms whose fingerprint is unchanged since the last
+    run are reused from that cache and only changed forms are re-extracted.
+    If progress is given, it is called as progress(forms_done, forms_total) after each form.
+    """
     global CONFIG
     CONFIG = load_config(config_path)
+
+    with queued_logging():
+        extracted_forms = extract_forms_cleaned(data)
+        logger.info("Found %d forms to process", len(extracted_forms))
+
+        cached_forms = load_form_cache(cache_path) if cache_path else {}
+        config_digest = config_fingerprint(CONFIG) if cache_path else None
+        current_forms = {}
+
+        item_table = ItemTable()
+        total_skipped = Counter()
+        reused = 0
+
+        # Forms are assembled in document order whether reused or recomputed
+        for form_index, form in enumerate(extracted_forms, start=1):
+            fingerprint = form_fingerprint(form, config_digest) if cache_path else None
+            rows = cached_forms.get(fingerprint) if cache_path else None
+            if rows is not None:
+                reused += 1
+                logger.debug("Form '%s': reused %d cached rows", form['Form Name'], len(rows))
+            else:
+                skipped = Counter()
+                rows = build_form_rows(form, skipped)
+                total_skipped.update(skipped)
+            if cache_path:
+                current_forms[fingerprint] = rows
+
+            for row in rows:
+                item_table.append_row(row)
+            if progress:
+                progress(form_index, len(extracted_forms))
+
+        if cache_path:
+            logger.info("Forms cache: reused %d of %d forms", reused, len(extracted_forms))
+            save_form_cache(cache_path, current_forms)
+
+        logger.info("Built item table with %d item rows; skipped: %s",
+                    len(item_table), _format_counts(total_skipped))
+    return item_table
+
+
+def process_clinical_forms(json_file_path, template_csv_path=None, output_csv_path="Study_Specific_Form.xlsx", config_path: str = "./config/config_study_specific_forms.json", item_table_path=None, cache_path=None, xlsx_backend="openpyxl", ptd_formatting=False):
+    """
+    Main function to process JSON and create the item-based Excel with repeating logic and item order.
+    If item_table_path is given, the item table is also written there as Parquet or Arrow IPC.
+    If cache_path is given, rows of forms whose fingerprint is unchanged since the last
+    run are reused from that cache and only changed forms are re-extracted.
+    xlsx_backend selects the Excel writer ("openpyxl" or "streaming"); ptd_formatting
+    writes the sheet with the combined PTD workbook's formatting.
+    """
     # Build template that mirrors the original script (with Unnamed columns)
     template_df = df_template.copy()
-    print("✅ Template CSV loaded successfully")
-
-    with open(json_file_path, "r", encoding="utf-8") as file:
-        data = json.load(file)
-    print("✅ JSON data loaded successfully")
-
-    extracted_forms = extract_forms_cleaned(data)
-    print(f"✅ Found {len(extracted_forms)} forms to process")
-
-    all_item_rows = []
-    print("\n🔄 Processing forms with item group repeating logic and sequential item order...")
-
-    for form in extracted_forms:
-        items = extract_items_from_form(form['Form_Node'])
-        print(f"  > Form '{form['Form Name']}': Found {len(items)} unique items.")
-
-        if not items:
-            items.append({"Item Name": "", "Option_TD_Node": None, "Item Group": ""})
-
-        # 🔥 UPDATED: Assign sequential item order (1, 2, 3...) based on Item Label sequence
-        items = assign_item_order(items)
-
-        # Analyze item groups for this form to determine repeating status
-        item_group_counts, repeating_groups = analyze_item_groups_per_form(items)
-
-        print(f"    📊 Item Group Analysis:")
-        print(f"       - Total unique item groups: {len(item_group_counts)}")
-        print(f"       - Repeating item groups: {len(repeating_groups)}")
-        if repeating_groups:
-            print(f"       - Repeating groups: {repeating_groups}")
-        print(f"    📋 Item Order assigned: {items[0].get('Item_Order', 'N/A')} to {items[-1].get('Item_Order', 'N/A')}")
-
-        for item in items:
-            item_row = {}
-            option_node = item.get("Option_TD_Node")
-            item_name = item['Item Name']
-
-            # Extract Item Group and set to 'NaN' if empty
-            item_group_value = item.get("Item Group", "")
-            if item_group_value == "":
-                item_group_value = 'NaN'
-
-            # Determine if this item group is repeating
-            item_group_repeating_flag = get_item_group_repeating_flag(
-                item_group_value,
-                repeating_groups
-            )
-
-            # Calculate repeat maximum based on repeating status
-            repeat_maximum = get_repeat_maximum(
-                item_group_value,
-                item_group_repeating_flag,
-                item_group_counts
-            )
-
-            # 🔥 Get sequential item order (1, 2, 3...)
-            item_order = item.get('Item_Order', 1)
-
-            # Fill in the columns
-            item_row['CTDM Optional, if blank CDP to propose'] = form['Form Label']
-            item_row['Input needed from SDTM'] = form['Form Name']
-            item_row['CDAI input needed'] = item_group_value
-
-            # Fill legacy Unnamed columns exactly like the original implementation
-            item_row['Unnamed: 4'] = item_group_repeating_flag
-            item_row['Unnamed: 5'] = repeat_maximum
-            item_row['Unnamed: 8'] = item_order
-            item_row['Unnamed: 9'] = item_name
-            item_row['Unnamed: 10'] = ""
-
-            # Get codelist content first
-            codelist_content = get_all_lbody_values(option_node)
-            item_row['Unnamed: 19'] = codelist_content
-
-            # Determine data type
-            data_type = determine_data_type(option_node, codelist_content)
-            item_row['Unnamed: 16'] = data_type
-            item_row['Unnamed: 22'] = "Radio Button-Vertical" if data_type == "Codelist" else ""
-
-            # Calculate Field Length for Text or Label types
-            if data_type in ["Text", "Label"]:
-                field_length = calculate_field_length(codelist_content)
-                item_row['Unnamed: 17'] = field_length
-            else:
-                item_row['Unnamed: 17'] = ""
 
-            # Calculate Precision for Label type only
-            if data_type == "Label":
-                precision = calculate_precision(codelist_content)
-                item_row['Unnamed: 18'] = precision
-            else:
-                item_row['Unnamed: 18'] = ""
+    with queued_logging():
+        with open(json_file_path, "r", encoding="utf-8") as file:
+            data = json.load(file)
+        logger.debug("JSON data loaded from %s", json_file_path)
 
-            # Extract number range for Label type
-            if data_type == "Label":
-                number_range = extract_number_range(codelist_content)
-                item_row['Unnamed: 23'] = number_range
-            else:
-                item_row['Unnamed: 23'] = ""
+        item_table = build_item_table(data, config_path=config_path, cache_path=cache_path)
 
-            # Check if future dates should trigger query
-            query_future_date = check_query_future_date(data_type)
-            item_row['Unnamed: 24'] = query_future_date
+        write_study_forms_workbook(item_table, output_csv_path, backend=xlsx_backend,
+                                   ptd_formatting=ptd_formatting)
+        logger.info("Created Study Specific Forms Excel: %s with %d item rows",
+                    output_csv_path, len(item_table))
+        if item_table_path:
+            write_item_table(item_table, item_table_path)
+            logger.info("Item table written to %s", item_table_path)
 
-            # Check if field is required (based on * in item name)
-            is_required = check_required_field(item_name)
-            item_row['Unnamed: 25'] = is_required
 
-            # Set "Form,Item" if required, otherwise blank
-            if is_required == "Y":
-                item_row['Unnamed: 26'] = "Form,Item"
-            else:
-                item_row['Unnamed: 26'] = ""
-
-            all_item_rows.append(item_row)
-
-    # =========================
-    # Build formatted Excel per CTDM 4-row header spec
-    # =========================
-
-    # Define grouped headers and colors (light pastels)
-    groups = [
-        {
-            "name": "Source",
-            "subheaders": [
-                "New or Copied from Study",
-            ],
-            "color": "E7E6E6",  # light gray
-        },
-        {
-            "name": "Form",
-            "subheaders": [
-                "Form Label",
-                "Form Name (provided by SDTM Programmer, if SDTM linked form)",
-            ],
-            "color": "C6EFCE",  # light green
-        },
-        {
-            "name": "Item Group",
-            "subheaders": [
-                "Item Group (if only one on form, recommend same as Form Label)",
-                "Item group Repeating",
-                "Repeat Maximum, if known, else default =50",
-                "Display format of repeating item group (Grid, read only, form)",
-                "Default Data in repeating item group",
-            ],
-            "color": "B3E5FC",  # light blue
-        },
-        {
-            "name": "Item",
-            "subheaders": [
-                "Item Order",
-                "Item Label",
-                "Item Name (provided by SDTM Programmer, if SDTM linked item)",
-            ],
-            "color": "FFD7A8",  # light orange
-        },
-        {
-            "name": "Progressive Display",
-            "subheaders": [
-                "Progressively displayed?",
-                "Controlling item (item triggering it, if yes, describe item below)",
-                "Controlling item value",
-            ],
-            "color": "B3E5FC",  # light blue
-        },
-        {
-            "name": "Data Type",
-            "subheaders": [
-                "Data type",
-                "If text or number, Field Length",
-                "If number, Precision (decimal places)",
-            ],
-            "color": "FFF9C4",  # pale yellow
-        },
-        {
-            "name": "Codelist",
-            "subheaders": [
-                "Codelist – Choice Labels (if binary, can use Goodlist Table)",
-                "Codelist Name (provided by SDTM Programmer)",
-                "Choice Code (provided by SDTM Programmer)",
-                "Codelist Control Type",
-            ],
-            "color": "E2F0D9",  # light green variant
-        },
-        {
-            "name": "System Queries",
-            "subheaders": [
-                "If number, Range: Min Value / Max Value",
-                "Date: Query Future Date",
-                "Required",
-                "If Required, Open Query when intentionally left blank (form/item)",
-            ],
-            "color": "F8CBAD",  # light orange variant
-        },
-        {
-            "name": "Notes",
-            "subheaders": [
-                "Notes",
-            ],
-            "color": "E6B8AF",  # light brownish
-        },
-    ]
+# Item rows written between write_study_forms_workbook progress reports
+PROGRESS_EVERY_ITEMS = 500
+
+
+def _format_counts(counts):
+    """Render a Counter as 'reason=n, ...' (or 'none') for log summaries."""
+    if not counts:
+        return "none"
+    return ", ".join(f"{reason}={n}" for reason, n in sorted(counts.items()))
+
 
+def write_study_forms_workbook(item_table, output_path, backend="openpyxl", ptd_formatting=False, progress=None):
+    """
+    Write the item table to an Excel workbook using the CTDM 4-row header spec.
+    backend selects the xlsx writer: "openpyxl" (in memory) or "streaming" (constant memory).
+    ptd_formatting applies the combined PTD workbook's look (bold headers, bordered
+    header row 1, centred wrapped data cells, wider columns) while writing.
+    If progress is given, it is called as progress(items_written, items_total) every
+    PROGRESS_EVERY_ITEMS rows and once all rows are written.
+    """
     # Map each group to top CTDM meta category (Row 1)
     ctdm_meta_by_group = {
         "Source": "CTDM to fill in",
@@ -1186,12 +1489,7 @@ def process_clinical_forms(json_file_path, template_csv_path=None, output_csv_pa
         "Notes": "CTDM to fill in",
     }
 
-    # Create workbook/sheet
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Study Specific Forms"
-
-    # Styles
+    # Style templates
     header_font = Font(bold=True, size=10)
     subheader_font = Font(bold=True, size=9)
     ctdm_fill = PatternFill(start_color="F5F5F5", end_color="F5F5F5", fill_type="solid")
@@ -1201,144 +1499,83 @@ def process_clinical_forms(json_file_path, template_csv_path=None, output_csv_pa
         left=Side(style='thin'), right=Side(style='thin'),
         top=Side(style='thin'), bottom=Side(style='thin')
     )
+    data_alignment = left_top
+    width_limits = dict(min_width=12, max_width=60, padding=2)
+    if ptd_formatting:
+        header_font = subheader_font = Font(bold=True)
+        data_alignment = Alignment(wrap_text=True, vertical="center")
+        width_limits = dict(min_width=10, max_width=80, padding=3)
+    styles = [
+        cell_style("ssf_ctdm", font=header_font, alignment=center, fill=ctdm_fill, border=thin_border),
+        cell_style("ssf_data", alignment=data_alignment, border=thin_border),
+    ]
+    if ptd_formatting:
+        styles.append(cell_style("ssf_border", font=header_font, alignment=center, border=thin_border))
+    else:
+        styles.append(cell_style("ssf_border", border=thin_border))
+    for g_idx, group in enumerate(STUDY_FORMS_GROUPS):
+        group_fill = PatternFill(start_color=group["color"], end_color=group["color"], fill_type="solid")
+        styles += [
+            cell_style(f"ssf_group_{g_idx}", font=header_font, alignment=center, fill=group_fill, border=thin_border),
+            cell_style(f"ssf_group_span_{g_idx}", fill=group_fill, border=thin_border),
+            cell_style(f"ssf_subheader_{g_idx}", font=subheader_font, alignment=center, fill=group_fill, border=thin_border),
+        ]
+
+    # Create workbook/sheet
+    writer = SheetWriter("Study Specific Forms", styles, backend=backend)
 
     # Compute total columns
-    total_cols = sum(len(g["subheaders"]) for g in groups)
+    total_cols = sum(len(g["subheaders"]) for g in STUDY_FORMS_GROUPS)
 
-    # Row 1: CTDM meta labels ONCE in A1:D1; E+ blank
+    # Row 1: CTDM meta labels ONCE in A1:D1; E+ blank (border only)
     ctdm_titles = [
         "CTDM to fill in",
         "CTDM Optional, if blank CDP to propose",
         "Input needed from SDTM",
         "CDAI input needed",
     ]
-    for idx, title in enumerate(ctdm_titles, start=1):
-        cell = ws.cell(row=1, column=idx, value=title)
-        cell.font = header_font
-        cell.alignment = center
-        cell.fill = ctdm_fill
-    # Ensure E+ remain blank (no styling assigned)
+    row1 = [(title, "ssf_ctdm") for title in ctdm_titles]
+    row1 += [(None, "ssf_border")] * (total_cols - len(row1))
 
     # Row 2: Group names with merged cells spanning subheaders
-    col_start = 1
-    for group in groups:
-        width = len(group["subheaders"])
-        start_col = col_start
-        end_col = col_start + width - 1
-        ws.merge_cells(start_row=2, start_column=start_col, end_row=2, end_column=end_col)
-        group_fill = PatternFill(start_color=group["color"], end_color=group["color"], fill_type="solid")
-        # Set value and style on the merged top-left cell
-        c = ws.cell(row=2, column=start_col, value=group["name"])
-        c.font = header_font
-        c.alignment = center
-        c.fill = group_fill
-        # Apply fill to the whole merged span to ensure consistent background
-        for i in range(start_col, end_col + 1):
-            ws.cell(row=2, column=i).fill = group_fill
-        col_start += width
-
     # Row 3: Subheaders (individual cells)
+    row2, row3 = [], []
     col_start = 1
-    for group in groups:
+    for g_idx, group in enumerate(STUDY_FORMS_GROUPS):
         width = len(group["subheaders"])
-        group_fill = PatternFill(start_color=group["color"], end_color=group["color"], fill_type="solid")
-        for i, sub in enumerate(group["subheaders"]):
-            c = ws.cell(row=3, column=col_start + i, value=sub)
-            c.font = subheader_font
-            c.alignment = center
-            c.fill = group_fill
+        writer.merge(2, col_start, 2, col_start + width - 1)
+        row2.append((group["name"], f"ssf_group_{g_idx}"))
+        row2 += [(None, f"ssf_group_span_{g_idx}")] * (width - 1)
+        row3 += [(sub, f"ssf_subheader_{g_idx}") for sub in group["subheaders"]]
         col_start += width
 
-    ws.row_dimensions[1].height = 18
-    ws.row_dimensions[2].height = 22
-    ws.row_dimensions[3].height = 28
-
-    # Data rows start at row 4
-    start_data_row = 4
-
-    # Helper: safe getter
-    def gv(d, key, default=""):
-        return d.get(key, default)
-
-    # Assemble rows in the exact subheader order
-    ordered_subheaders = []
-    for g in groups:
-        ordered_subheaders.extend(g["subheaders"])
-
-    # Write each item row
-    for r_idx, row_dict in enumerate(all_item_rows, start=start_data_row):
-        # Map existing keys to new layout values
-        values_by_subheader = {
-            # Source
-            "New or Copied from Study": "",
-            # Form
-            "Form Label": gv(row_dict, "CTDM Optional, if blank CDP to propose"),
-            "Form Name (provided by SDTM Programmer, if SDTM linked form)": gv(row_dict, "Input needed from SDTM"),
-            # Item Group
-            "Item Group (if only one on form, recommend same as Form Label)": gv(row_dict, "CDAI input needed"),
-            "Item group Repeating": gv(row_dict, "Unnamed: 4"),
-            "Repeat Maximum, if known, else default =50": gv(row_dict, "Unnamed: 5"),
-            "Display format of repeating item group (Grid, read only, form)": gv(row_dict, "Unnamed: 6"),
-            "Default Data in repeating item group": gv(row_dict, "Unnamed: 7"),
-            # Item
-            "Item Order": gv(row_dict, "Unnamed: 8"),
-            "Item Label": gv(row_dict, "Unnamed: 9"),
-            "Item Name (provided by SDTM Programmer, if SDTM linked item)": gv(row_dict, "Unnamed: 10"),
-            # Progressive Display
-            "Progressively displayed?": gv(row_dict, "Unnamed: 12"),
-            "Controlling item (item triggering it, if yes, describe item below)": gv(row_dict, "Unnamed: 13"),
-            "Controlling item value": gv(row_dict, "Unnamed: 14"),
-            # Data Type
-            "Data type": gv(row_dict, "Unnamed: 16"),
-            "If text or number, Field Length": gv(row_dict, "Unnamed: 17"),
-            "If number, Precision (decimal places)": gv(row_dict, "Unnamed: 18"),
-            # Codelist
-            "Codelist – Choice Labels (if binary, can use Goodlist Table)": gv(row_dict, "Unnamed: 19"),
-            "Codelist Name (provided by SDTM Programmer)": gv(row_dict, "Unnamed: 20"),
-            "Choice Code (provided by SDTM Programmer)": gv(row_dict, "Unnamed: 21"),
-            "Codelist Control Type": gv(row_dict, "Unnamed: 22"),
-            # System Queries
-            "If number, Range: Min Value / Max Value": gv(row_dict, "Unnamed: 23"),
-            "Date: Query Future Date": gv(row_dict, "Unnamed: 24"),
-            "Required": gv(row_dict, "Unnamed: 25"),
-            "If Required, Open Query when intentionally left blank (form/item)": gv(row_dict, "Unnamed: 26"),
-            # Notes
-            "Notes": gv(row_dict, "Unnamed: 27"),
-        }
-
-        for c_idx, header in enumerate(ordered_subheaders, start=1):
-            cell = ws.cell(row=r_idx, column=c_idx, value=values_by_subheader.get(header, ""))
-            cell.alignment = left_top
-            cell.border = thin_border
-
-    # Apply borders to header rows and auto column widths
-    for r in range(1, ws.max_row + 1):
-        for c in range(1, total_cols + 1):
-            cell = ws.cell(row=r, column=c)
-            # Add borders if not already set for headers
-            if r <= 3:
-                cell.border = thin_border
-
-    # Auto width approximation
-    for col in range(1, total_cols + 1):
-        max_len = 0
-        col_letter = get_column_letter(col)
-        for row in range(1, ws.max_row + 1):
-            val = ws.cell(row=row, column=col).value
-            if val is None:
-                continue
-            try:
-                length = len(str(val))
-                if length > max_len:
-                    max_len = length
-            except Exception:
-                pass
-        ws.column_dimensions[col_letter].width = max(12, min(60, max_len + 2))
+    # Column widths: header labels plus each item-table column (already in subheader order)
+    widths = ColumnWidthTracker()
+    for row in (row1, row2, row3):
+        for c_idx, (value, _) in enumerate(row, start=1):
+            if value is not None:
+                widths.observe(c_idx, value)
+    for c_idx, name in enumerate(item_table.columns, start=1):
+        widths.observe_column(c_idx, item_table.column(name))
+
+    writer.set_widths(widths, max_column=total_cols, **width_limits)
+    writer.set_row_height(1, 18)
+    writer.set_row_height(2, 22)
+    writer.set_row_height(3, 28)
+
+    writer.append(row1)
+    writer.append(row2)
+    writer.append(row3)
+
+    # Data rows start at row 4, streamed straight from the columnar table
+    total_items = len(item_table)
+    for written, values in enumerate(item_table.rows(), start=1):
+        writer.append([(value, "ssf_data") for value in values])
+        if progress and (written % PROGRESS_EVERY_ITEMS == 0 or written == total_items):
+            progress(written, total_items)
 
     # Save
-    wb.save(output_csv_path)
-    print(f"\n✅ SUCCESS! Created Study Specific Forms Excel: {output_csv_path} with {len(all_item_rows)} item rows.")
-    print("✅ Header layout: 4 fixed CTDM rows with grouped headers applied.")
+    writer.save(output_path)
 
 
 if __name__ == "__main__":
@@ -1353,6 +1590,8 @@ if __name__ == "__main__":
     template_file = "template.xlsx"
     output_file = "Study_Specific_Form.xlsx"
 
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
     try:
         print("=" * 80)
         print("CLINICAL FORMS PROCESSING - WITH SEQUENTIAL ITEM ORDER (1, 2, 3...)")
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Output-equivalence harness for the optimised PTD output paths.
+
+compare checks two workbooks with modules.workbook_compare. modes generates
+one PTD through the reference path (openpyxl writer, template copy) and one
+per optimised mode, and compares each against the reference at the level the
+mode promises:
+
+    fast         --fast            values and merges (plain forms formatting by design)
+    splice       --splice          full styles
+    streaming    --xlsx-backend streaming   full styles
+    forms_cache  --forms-cache, warm second run   full styles
+
+The study is a synthetic one (benchmarks/synthetic.py) unless --ecrf and
+--protocol are given. The exit status is 1 when any comparison finds a
+difference.
+
+Usage:
+    python benchmarks/check_equivalence.py compare reference.xlsx candidate.xlsx --level merges
+    python benchmarks/check_equivalence.py modes --scale medium
+    python benchmarks/check_equivalence.py modes --ecrf ecrf.json --protocol protocol.json --template template.xlsx
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+from typing import Any, Dict, List, Optional, Tuple
+
+PACKAGE_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PACKAGE_ROOT)
+
+from modules.pipeline import generate_ptd  # noqa: E402
+from modules.workbook_compare import (DEFAULT_MAX_DIFFS, DEFAULT_SHEETS, LEVELS,  # noqa: E402
+                                      compare_workbooks, format_differences)
+
+from run_benchmarks import SCALES, make_template, parse_list  # noqa: E402
+from synthetic import write_study  # noqa: E402
+
+# Mode -> (PTDResult.write_xlsx options, comparison level it must pass)
+MODES: Dict[str, Tuple[Dict[str, Any], str]] = {
+    "fast": ({"fast": True}, "merges"),
+    "splice": ({"splice": True}, "styles"),
+    "streaming": ({"backend": "streaming"}, "styles"),
+    "forms_cache": ({}, "styles"),
+}
+
+
+def write_mode_outputs(protocol: str, ecrf: str, template: Optional[str], out_dir: str,
+                       modes: List[str]) -> Dict[str, str]:
+    """
+    Write the reference PTD and one PTD per mode into out_dir.
+
+    Returns:
+        Output paths keyed by "reference" and mode name
+    """
+    result = generate_ptd(protocol, ecrf, template=template)
+    outputs = {"reference": result.write_xlsx(os.path.join(out_dir, "reference.xlsx"))}
+    for mode in modes:
+        path = os.path.join(out_dir, f"{mode}.xlsx")
+        if mode == "forms_cache":
+            # The second run reuses every form from the cache written by the first
+            cache = os.path.join(out_dir, "forms_cache.pkl")
+            generate_ptd(protocol, ecrf, template=template, forms_cache=cache)
+            outputs[mode] = generate_ptd(protocol, ecrf, template=template, forms_cache=cache).write_xlsx(path)
+        else:
+            outputs[mode] = result.write_xlsx(path, **MODES[mode][0])
+    return outputs
+
+
+def check_modes(protocol: str, ecrf: str, template: Optional[str], modes: List[str], out_dir: str,
+                level: Optional[str] = None, max_diffs: int = DEFAULT_MAX_DIFFS) -> Dict[str, Dict[str, Any]]:
+    """
+    Compare each mode's PTD against the reference path's.
+
+    Args:
+        protocol: Protocol JSON path
+        ecrf: eCRF JSON path
+        template: PTD template (default: a new two-sheet workbook)
+        modes: Mode names from MODES
+        out_dir: Directory for the generated workbooks
+        level: Comparison level for every mode (default: each mode's own level)
+        max_diffs: Differences to report per mode
+
+    Returns:
+        compare_workbooks results keyed by mode
+    """
+    outputs = write_mode_outputs(protocol, ecrf, template, out_dir, modes)
+    return {mode: compare_workbooks(outputs["reference"], outputs[mode], level=level or MODES[mode][1],
+                                    max_diffs=max_diffs)
+            for mode in modes}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Check that optimised output paths produce the reference PTD")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    compare = commands.add_parser("compare", help="Compare two workbooks")
+    compare.add_argument("reference", help="Workbook from the reference path")
+    compare.add_argument("candidate", help="Workbook to check")
+
+    modes = commands.add_parser("modes", help="Generate a PTD per optimised mode and compare each to the reference")
+    modes.add_argument("--ecrf", help="eCRF JSON (default: a synthetic study)")
+    modes.add_argument("--protocol", help="Protocol JSON (default: a synthetic study)")
+    modes.add_argument("--template", help="PTD template (default: a generated one)")
+    modes.add_argument("--scale", choices=list(SCALES), default="small", help="Synthetic study scale (default: small)")
+    modes.add_argument("--seed", type=int, default=0, help="Synthetic study seed (default: 0)")
+    modes.add_argument("--modes", type=lambda value: parse_list(value, list(MODES), "mode"), default=list(MODES),
+                       help=f"Comma-separated modes (default: {','.join(MODES)})")
+    modes.add_argument("--keep-dir", help="Keep the generated workbooks in this directory")
+
+    for command in (compare, modes):
+        command.add_argument("--level", choices=LEVELS, default=None,
+                             help="Strictness (compare default: values; modes default: each mode's own level)")
+        command.add_argument("--max-diffs", type=int, default=DEFAULT_MAX_DIFFS,
+                             help=f"Differences to report (default: {DEFAULT_MAX_DIFFS})")
+        command.add_argument("--sheet", action="append", dest="sheets",
+                             help=f"Sheet to compare; repeatable (default: {', '.join(DEFAULT_SHEETS)})")
+    args = parser.parse_args()
+
+    if args.command == "compare":
+        result = compare_workbooks(args.reference, args.candidate, tuple(args.sheets or DEFAULT_SHEETS),
+                                   args.level or "values", args.max_diffs)
+        print(format_differences(result))
+        print("✅ Workbooks are equivalent" if result["equal"] else f"❌ Workbooks differ ({result['level']})")
+        return 0 if result["equal"] else 1
+
+    if bool(args.ecrf) != bool(args.protocol):
+        parser.error("--ecrf and --protocol must be given together")
+    if args.sheets:
+        parser.error("--sheet is only supported by compare")
+    out_dir = args.keep_dir or tempfile.mkdtemp(prefix="ptd_equivalence_")
+    os.makedirs(out_dir, exist_ok=True)
+    try:
+        ecrf, protocol, template = args.ecrf, args.protocol, args.template
+        if not ecrf:
+            ecrf, protocol = write_study(os.path.join(out_dir, "study"), seed=args.seed, **SCALES[args.scale])
+            template = template or make_template(os.path.join(out_dir, "template.xlsx"))
+        results = check_modes(protocol, ecrf, template, args.modes, out_dir, args.level, args.max_diffs)
+    finally:
+        if not args.keep_dir:
+            shutil.rmtree(out_dir, ignore_errors=True)
+
+    different = [mode for mode, result in results.items() if not result["equal"]]
+    for mode, result in results.items():
+        print(f"{'✅' if result['equal'] else '❌'} {mode} ({result['level']})")
+        if not result["equal"]:
+            print(format_differences(result))
+    if different:
+        print(f"❌ {len(different)} mode(s) differ from the reference path: {', '.join(different)}")
+        return 1
+    print("✅ Every mode produces the reference PTD")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,453 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for the PTD pipeline stages.
+
+Each benchmark times one pipeline stage's run function (modules.pipeline.
+PIPELINE_STAGES) on synthetic studies (benchmarks/synthetic.py) at small,
+medium and huge scale, chaining the in-memory stage values as generate_ptd()
+does, then one way of writing the PTD (PTDResult.write_xlsx):
+
+    load_protocol               protocol JSON -> SoA table model
+    load_ecrf                   eCRF JSON -> document
+    extract_forms               eCRF -> forms table                        (extract_forms stage)
+    parse_soa                   SoA model -> schedule table                (parse_soa)
+    merge_common_matrix         forms + schedule -> ordered SoA matrix     (common_matrix)
+    group_events                SoA model -> visits with groups            (event_grouping)
+    build_schedule_layout       visits + matrix -> schedule grid layout    (schedule_layout)
+    process_clinical_forms      eCRF -> study forms item table             (study_forms)
+    replace_sheets_in_template  write_xlsx(): both sheets copied into the template
+    write_xlsx_fast             write_xlsx(fast=True)
+    write_xlsx_splice           write_xlsx(splice=True)
+    write_xlsx_streaming        write_xlsx(backend="streaming")
+
+Wall time is the best of --repeat runs; peak memory is measured with
+tracemalloc in one extra run, so tracing does not distort the timings.
+
+Usage:
+    python benchmarks/run_benchmarks.py run --scales small,medium --out results.json
+    python benchmarks/run_benchmarks.py compare baseline.json results.json
+    python benchmarks/run_benchmarks.py check [--results results.json] [--update-baseline]
+
+check is the regression gate: results (by default, a fresh run of the
+baseline's benchmarks) are compared against benchmarks/baseline.json within
+the per-stage tolerances in benchmarks/tolerances.json, and the exit status
+is 1 when any stage's time or peak memory regressed beyond them. Timings only
+compare on one machine, so the baseline is not committed: the machine that
+runs the gate records its own with check --update-baseline.
+"""
+
+import argparse
+import gc
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+PACKAGE_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PACKAGE_ROOT)
+
+from openpyxl import Workbook  # noqa: E402
+
+from modules.pipeline import (DEFAULT_CONFIG_DIR, FORMS_SHEET_NAME, PIPELINE_STAGES,  # noqa: E402
+                              SCHEDULE_SHEET_NAME, PTDResult, load_pipeline_configs, pipeline_sources)
+
+from synthetic import write_study  # noqa: E402
+
+RESULTS_VERSION = 1
+
+# Synthetic study parameters per scale (see synthetic.generate_study)
+SCALES = {
+    "small": {"forms": 20, "items": 10, "visits": 12, "procedures": 40},
+    "medium": {"forms": 120, "items": 20, "visits": 25, "procedures": 160},
+    "huge": {"forms": 500, "items": 30, "visits": 40, "procedures": 600},
+}
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+BASELINE_FILE = os.path.join(BENCHMARKS_DIR, "baseline.json")
+TOLERANCES_FILE = os.path.join(BENCHMARKS_DIR, "tolerances.json")
+
+# Used for limits missing from the tolerances file
+DEFAULT_TOLERANCE = {"seconds_pct": 35.0, "min_seconds": 0.05, "peak_mb_pct": 15.0, "min_peak_mb": 1.0}
+
+# Benchmark -> pipeline stage whose run function it times, in PIPELINE_STAGES order
+STAGE_BENCHMARKS = {
+    "load_protocol": "load_protocol",
+    "load_ecrf": "load_ecrf",
+    "extract_forms": "extract_forms",
+    "parse_soa": "parse_soa",
+    "merge_common_matrix": "common_matrix",
+    "group_events": "event_grouping",
+    "build_schedule_layout": "schedule_layout",
+    "process_clinical_forms": "study_forms",
+}
+# Benchmark -> PTDResult.write_xlsx options
+WRITE_BENCHMARKS = {
+    "replace_sheets_in_template": {},
+    "write_xlsx_fast": {"fast": True},
+    "write_xlsx_splice": {"splice": True},
+    "write_xlsx_streaming": {"backend": "streaming"},
+}
+BENCHMARKS = list(STAGE_BENCHMARKS) + list(WRITE_BENCHMARKS)
+
+
+def make_template(path: str) -> str:
+    """A PTD template: both target sheets between two sheets the replacement must keep."""
+    wb = Workbook()
+    wb.active.title = "Cover"
+    wb.active["A1"] = "Protocol Transfer Document"
+    wb.create_sheet(SCHEDULE_SHEET_NAME)
+    wb.create_sheet(FORMS_SHEET_NAME)
+    notes = wb.create_sheet("Notes")
+    for row in range(1, 51):
+        notes.append([f"Note {row}", "Reviewed", row])
+    wb.save(path)
+    return path
+
+
+def stage_calls(study: Dict[str, str], work_dir: str,
+                configs: Dict[str, Any]) -> Dict[str, Callable[[], Any]]:
+    """
+    Zero-argument calls of each benchmark. Stage calls store their value for
+    the stages after them; write calls write the PTD into work_dir.
+    """
+    stages = {stage.name: stage for stage in PIPELINE_STAGES}
+    values = pipeline_sources(study["protocol"], study["ecrf"], configs)
+
+    def run_stage(name: str) -> Any:
+        stage = stages[name]
+        values[name] = stage.run(*(values[key] for key in stage.inputs))
+        return values[name]
+
+    def write(options: Dict[str, Any]) -> str:
+        result = PTDResult.from_stage_values(values, {}, study["template"], configs)
+        return result.write_xlsx(os.path.join(work_dir, "ptd.xlsx"), **options)
+
+    calls: Dict[str, Callable[[], Any]] = {}
+    for benchmark, stage_name in STAGE_BENCHMARKS.items():
+        calls[benchmark] = lambda stage_name=stage_name: run_stage(stage_name)
+    for benchmark, options in WRITE_BENCHMARKS.items():
+        calls[benchmark] = lambda options=options: write(options)
+    return calls
+
+
+def measure(call: Callable[[], Any], repeat: int = 3, memory: bool = True) -> Dict[str, Any]:
+    """
+    Time call (best of repeat runs) and, with memory, trace its peak Python allocation in one more run.
+
+    Returns:
+        Dict with "seconds" (best), "runs" (all timings) and "peak_mb"
+    """
+    runs = []
+    for _ in range(repeat):
+        gc.collect()
+        started = time.perf_counter()
+        call()
+        runs.append(round(time.perf_counter() - started, 4))
+    result: Dict[str, Any] = {"seconds": min(runs), "runs": runs, "peak_mb": None}
+    if memory:
+        gc.collect()
+        tracemalloc.start()
+        try:
+            call()
+            result["peak_mb"] = round(tracemalloc.get_traced_memory()[1] / (1024 * 1024), 2)
+        finally:
+            tracemalloc.stop()
+    return result
+
+
+def run_scale(scale: str, params: Dict[str, Any], benchmarks: List[str], repeat: int = 3,
+              memory: bool = True, seed: int = 0, configs: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Benchmark the selected stages on one synthetic study.
+
+    Args:
+        scale: Scale name, for reporting
+        params: Synthetic study parameters (see synthetic.generate_study)
+        benchmarks: Benchmarks to measure, in BENCHMARKS order; the stages they depend on
+                    are still run once to produce their inputs
+        repeat: Timed runs per benchmark
+        memory: Also measure peak memory
+        seed: Synthetic study seed
+        configs: Stage configs (default: the package's config/)
+
+    Returns:
+        Per-benchmark results keyed by benchmark name
+    """
+    configs = configs or load_pipeline_configs(DEFAULT_CONFIG_DIR)
+    work_dir = tempfile.mkdtemp(prefix=f"ptd_bench_{scale}_")
+    try:
+        ecrf, protocol = write_study(os.path.join(work_dir, "study"), seed=seed, **params)
+        study = {"ecrf": ecrf, "protocol": protocol, "template": make_template(os.path.join(work_dir, "template.xlsx"))}
+        calls = stage_calls(study, work_dir, configs)
+        last = max(BENCHMARKS.index(name) for name in benchmarks)
+        results = {}
+        for name in BENCHMARKS[:last + 1]:
+            if name in benchmarks:
+                results[name] = measure(calls[name], repeat, memory)
+                peak = f", peak {results[name]['peak_mb']:.1f} MB" if memory else ""
+                print(f"  {scale:<7} {name:<27} {results[name]['seconds']:9.3f}s{peak}", flush=True)
+            elif name in STAGE_BENCHMARKS:
+                calls[name]()
+        return results
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def git_commit() -> Optional[str]:
+    """Current commit of the package checkout, if it is a git checkout."""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=PACKAGE_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(scales: List[str], benchmarks: List[str], repeat: int = 3, memory: bool = True,
+                   seed: int = 0) -> Dict[str, Any]:
+    """Run the benchmarks at each scale; returns the results document written by run."""
+    results = {
+        "version": RESULTS_VERSION,
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "repeat": repeat,
+        "seed": seed,
+        "scales": {scale: SCALES[scale] for scale in scales},
+        "results": {},
+    }
+    configs = load_pipeline_configs(DEFAULT_CONFIG_DIR)
+    for scale in scales:
+        results["results"][scale] = run_scale(scale, SCALES[scale], benchmarks, repeat, memory, seed, configs)
+    return results
+
+
+def load_results(path: str) -> Dict[str, Any]:
+    with open(path, "r", encoding="utf-8") as f:
+        results = json.load(f)
+    if results.get("version") != RESULTS_VERSION:
+        raise ValueError(f"{path} is not a version {RESULTS_VERSION} benchmark results file")
+    return results
+
+
+def _change(old: Optional[float], new: Optional[float]) -> Optional[float]:
+    """Relative change from old to new, in percent."""
+    if old is None or new is None or old == 0:
+        return None
+    return round((new - old) / old * 100, 1)
+
+
+def compare_results(old: Dict[str, Any], new: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Pair up the benchmarks present in both results files.
+
+    Returns:
+        One row per (scale, benchmark) with old/new seconds and peak_mb and their changes in percent
+    """
+    rows = []
+    for scale, benchmarks in new["results"].items():
+        for name, current in benchmarks.items():
+            previous = old["results"].get(scale, {}).get(name)
+            if previous is None:
+                continue
+            rows.append({
+                "scale": scale,
+                "benchmark": name,
+                "old_seconds": previous["seconds"],
+                "new_seconds": current["seconds"],
+                "seconds_change": _change(previous["seconds"], current["seconds"]),
+                "old_peak_mb": previous.get("peak_mb"),
+                "new_peak_mb": current.get("peak_mb"),
+                "peak_mb_change": _change(previous.get("peak_mb"), current.get("peak_mb")),
+            })
+    return rows
+
+
+def load_tolerances(path: str) -> Dict[str, Any]:
+    """Regression tolerances: "default" limits, overridden per benchmark under "benchmarks"."""
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def tolerance_for(tolerances: Dict[str, Any], benchmark: str) -> Dict[str, float]:
+    return {**DEFAULT_TOLERANCE, **tolerances.get("default", {}), **tolerances.get("benchmarks", {}).get(benchmark, {})}
+
+
+def _regressed(old: Optional[float], new: Optional[float], max_pct: float, min_delta: float) -> bool:
+    """new is worse than old by more than max_pct percent and by more than min_delta."""
+    if old is None or new is None:
+        return False
+    return new > old * (1 + max_pct / 100) and new - old > min_delta
+
+
+def check_regressions(baseline: Dict[str, Any], current: Dict[str, Any],
+                      tolerances: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Compare current results against the baseline within each benchmark's tolerances.
+
+    A metric regresses when it grows by more than its percentage tolerance and
+    by more than its absolute floor (min_seconds / min_peak_mb), so jitter on
+    stages taking milliseconds does not fail the gate. Baseline benchmarks
+    missing from the current results count as failures.
+
+    Returns:
+        compare_results rows, plus baseline-only rows, each with a "status"
+        (ok, improved, regressed or missing) and the regressed "metrics"
+    """
+    rows = compare_results(baseline, current)
+    for row in rows:
+        limits = tolerance_for(tolerances, row["benchmark"])
+        row["metrics"] = [metric for metric, old, new, pct, floor in (
+            ("time", row["old_seconds"], row["new_seconds"], limits["seconds_pct"], limits["min_seconds"]),
+            ("peak", row["old_peak_mb"], row["new_peak_mb"], limits["peak_mb_pct"], limits["min_peak_mb"]),
+        ) if _regressed(old, new, pct, floor)]
+        if row["metrics"]:
+            row["status"] = "regressed"
+        elif _regressed(row["new_seconds"], row["old_seconds"], limits["seconds_pct"], limits["min_seconds"]):
+            row["status"] = "improved"
+        else:
+            row["status"] = "ok"
+
+    for scale, benchmarks in baseline["results"].items():
+        for name, previous in benchmarks.items():
+            if name not in current["results"].get(scale, {}):
+                rows.append({"scale": scale, "benchmark": name, "old_seconds": previous["seconds"],
+                             "new_seconds": None, "seconds_change": None, "old_peak_mb": previous.get("peak_mb"),
+                             "new_peak_mb": None, "peak_mb_change": None, "status": "missing", "metrics": []})
+    return rows
+
+
+def _format_value(value: Optional[float], unit: str) -> str:
+    return "-" if value is None else f"{value:.3f}{unit}" if unit == "s" else f"{value:.1f}{unit}"
+
+
+def _format_change(change: Optional[float]) -> str:
+    return "-" if change is None else f"{change:+.1f}%"
+
+
+def _format_status(row: Dict[str, Any]) -> str:
+    if row["status"] == "regressed":
+        return "REGRESSED (" + ", ".join(row["metrics"]) + ")"
+    return row["status"].upper() if row["status"] == "missing" else row["status"]
+
+
+def format_comparison(rows: List[Dict[str, Any]]) -> str:
+    """Readable table of compare_results rows, with a status column for check_regressions rows."""
+    header = ("scale", "benchmark", "old time", "new time", "change", "old peak", "new peak", "change")
+    lines = [(row["scale"], row["benchmark"],
+              _format_value(row["old_seconds"], "s"), _format_value(row["new_seconds"], "s"),
+              _format_change(row["seconds_change"]),
+              _format_value(row["old_peak_mb"], " MB"), _format_value(row["new_peak_mb"], " MB"),
+              _format_change(row["peak_mb_change"])) for row in rows]
+    if any("status" in row for row in rows):
+        header += ("status",)
+        lines = [line + (_format_status(row),) for line, row in zip(lines, rows)]
+    widths = [max(len(str(line[column])) for line in [header] + lines) for column in range(len(header))]
+
+    def render(line: Tuple[str, ...]) -> str:
+        return "  ".join(cell.ljust(width) if column < 2 or column > 7 else cell.rjust(width)
+                         for column, (cell, width) in enumerate(zip(line, widths)))
+
+    return "\n".join(line.rstrip() for line in [render(header), render(tuple("-" * width for width in widths))]
+                     + [render(line) for line in lines])
+
+
+def parse_list(value: str, choices: List[str], what: str) -> List[str]:
+    names = [name.strip() for name in value.split(",") if name.strip()]
+    unknown = [name for name in names if name not in choices]
+    if unknown:
+        raise argparse.ArgumentTypeError(f"Unknown {what}: {', '.join(unknown)} (choose from {', '.join(choices)})")
+    return names
+
+
+def check_main(args: argparse.Namespace) -> int:
+    """The check command: exit status 1 when any benchmark regressed or is missing, 2 without a baseline."""
+    if not args.update_baseline and not os.path.exists(args.baseline):
+        print(f"Error: no baseline at {args.baseline}; record one on this machine with "
+              f"'run_benchmarks.py check --update-baseline'", file=sys.stderr)
+        return 2
+    if args.results:
+        current = load_results(args.results)
+    elif args.update_baseline and not os.path.exists(args.baseline):
+        current = run_benchmarks(list(SCALES)[:2], BENCHMARKS)
+    else:
+        # Same scales, benchmarks and study seed as the baseline
+        baseline = load_results(args.baseline)
+        benchmarks = [name for name in BENCHMARKS if any(name in results for results in baseline["results"].values())]
+        current = run_benchmarks(list(baseline["scales"]), benchmarks, baseline["repeat"],
+                                 any(entry.get("peak_mb") is not None
+                                     for results in baseline["results"].values() for entry in results.values()),
+                                 baseline["seed"])
+
+    if args.update_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(current, f, indent=2)
+        print(f"✅ Baseline written to: {args.baseline}")
+        return 0
+
+    baseline = load_results(args.baseline)
+    if baseline.get("platform") != current.get("platform"):
+        print(f"⚠️  Baseline was measured on {baseline.get('platform')}, these results on "
+              f"{current.get('platform')}; timings may not be comparable")
+    rows = check_regressions(baseline, current, load_tolerances(args.tolerances))
+    print(format_comparison(rows))
+    failed = [row for row in rows if row["status"] in ("regressed", "missing")]
+    if failed:
+        print(f"❌ {len(failed)} benchmark(s) regressed beyond tolerance or are missing")
+        return 1
+    print("✅ No regressions beyond tolerance")
+    return 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the PTD pipeline stages on synthetic studies")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="Run the benchmarks and write a results file")
+    run.add_argument("--scales", type=lambda value: parse_list(value, list(SCALES), "scale"),
+                     default=["small", "medium"],
+                     help=f"Comma-separated scales (default: small,medium; available: {', '.join(SCALES)})")
+    run.add_argument("--benchmarks", type=lambda value: parse_list(value, BENCHMARKS, "benchmark"),
+                     default=BENCHMARKS, help="Comma-separated benchmarks to measure (default: all)")
+    run.add_argument("--repeat", type=int, default=3, help="Timed runs per benchmark; the best counts (default: 3)")
+    run.add_argument("--no-memory", action="store_true", help="Skip the peak memory measurement")
+    run.add_argument("--seed", type=int, default=0, help="Synthetic study seed (default: 0)")
+    run.add_argument("--out", default="benchmark_results.json",
+                     help="Results file (default: benchmark_results.json)")
+
+    compare = commands.add_parser("compare", help="Compare two results files")
+    compare.add_argument("old", help="Earlier results file")
+    compare.add_argument("new", help="Later results file")
+    check = commands.add_parser("check", help="Fail when results regress against the stored baseline")
+    check.add_argument("--baseline", default=BASELINE_FILE, help="Baseline results file (default: benchmarks/baseline.json)")
+    check.add_argument("--tolerances", default=TOLERANCES_FILE,
+                       help="Tolerances file (default: benchmarks/tolerances.json)")
+    check.add_argument("--results", help="Results file to check (default: run the baseline's benchmarks now)")
+    check.add_argument("--update-baseline", action="store_true",
+                       help="Write the results as the new baseline instead of checking them")
+    args = parser.parse_args()
+
+    if args.command == "compare":
+        print(format_comparison(compare_results(load_results(args.old), load_results(args.new))))
+        return 0
+    if args.command == "check":
+        return check_main(args)
+
+    if args.repeat < 1:
+        parser.error("--repeat must be at least 1")
+    results = run_benchmarks(args.scales, args.benchmarks, args.repeat, not args.no_memory, args.seed)
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"✅ Benchmark results written to: {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
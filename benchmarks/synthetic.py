@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+Synthetic eCRF / protocol generator for scale testing.
+
+Writes a study as hierarchical JSON in the node schema the pipeline reads
+({"name", "text", "children"} with H1/H2/Table/TR/TH/TD/P/L/LI/LBody/
+ExtraCharSpan/Sub nodes), so the whole pipeline can be exercised at any size
+without confidential study documents. The same parameters and seed always
+produce byte-identical files.
+
+The eCRF has one H1 section per form, holding the form name paragraph, its
+visit list and an item table mixing every option layout the forms engine
+handles (radio lists, ExtraCharSpan option runs, Sub item labels, numeric
+ranges, dates, free text, 3-column rows, repeating groups). The protocol has
+the extension week sentence and a schedule of activities whose procedures
+reuse the form labels, so the common matrix matches them to forms.
+
+Noise adds what real exports contain: metadata header tables, instruction
+rows, design-note paragraphs and schedule tables split across pages.
+
+Usage:
+    python benchmarks/synthetic.py --forms 200 --items 25 --visits 30 --procedures 120 --seed 7 --out-dir ./synthetic
+"""
+
+import argparse
+import json
+import os
+import random
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+Node = Dict[str, Any]
+
+FORM_TOPICS = [
+    "Demography", "Vital Signs", "Adverse Events", "Concomitant Medication", "Physical Examination",
+    "Laboratory Assessments", "Eligibility Criteria", "Randomisation", "Body Measurements", "ECG",
+    "Medical History", "Informed Consent", "Drug Accountability", "Hypoglycaemic Episodes",
+    "Pregnancy Test", "Eye Examination", "Patient Reported Outcomes", "Injection Site Reactions",
+]
+ITEM_SUBJECTS = [
+    "date of assessment", "result", "clinical significance", "reason not done", "start date",
+    "end date", "dose", "frequency", "route", "severity", "outcome", "body weight", "height",
+    "systolic blood pressure", "diastolic blood pressure", "pulse", "comment",
+]
+OTHER_PROCEDURES = [
+    "Concomitant illness", "Blood sampling", "Urine sampling", "Dispensing visit", "Training",
+    "Hand out diary", "Collect diary", "Antibody sampling", "Fundus photography", "Dietary counselling",
+]
+# Every item option layout handled by Final_study_specific_form.py
+ITEM_KINDS = ("radio", "extracharspan", "sub", "numeric", "date", "text", "three_column")
+
+
+def node(name: str, text: str = "", children: Optional[List[Node]] = None) -> Node:
+    """One document node; children are only written when present, as in the real exports."""
+    result: Node = {"name": name, "text": text}
+    if children:
+        result["children"] = children
+    return result
+
+
+def nest(content: List[Node], depth: int, name: str = "Sect") -> List[Node]:
+    """Wrap content in depth levels of structural container nodes."""
+    for _ in range(depth):
+        content = [node(name, "", content)]
+    return content
+
+
+def form_code(label: str, index: int) -> str:
+    """Bracketed form code, e.g. [VITAL_SIGN12]: upper case, at least 3 characters."""
+    return "[" + label.upper().replace(" ", "_")[:10] + str(index) + "]"
+
+
+def form_label(index: int) -> str:
+    topic = FORM_TOPICS[index % len(FORM_TOPICS)]
+    return topic if index < len(FORM_TOPICS) else f"{topic} {index // len(FORM_TOPICS) + 1}"
+
+
+def visit_names(visits: int) -> List[str]:
+    """V1..V(n-1) and a follow-up phone visit P(n), matching the default event group config."""
+    return [f"V{number}" for number in range(1, visits)] + [f"P{visits}"]
+
+
+def study_weeks(visits: int) -> List[int]:
+    """Screening at week -2, randomisation at week 0, then treatment visits and a follow-up."""
+    weeks = [-2, 0]
+    while len(weeks) < visits - 1:
+        weeks.append(weeks[-1] + (2 if len(weeks) < 6 else 4))
+    return (weeks + [weeks[-1] + 4])[:visits]
+
+
+def item_row(kind: str, question: str, rng: random.Random) -> Node:
+    """One item row of a form table in the given option layout."""
+    if kind == "radio":
+        options = rng.sample(["Yes", "No", "Not applicable", "Unknown", "Normal", "Abnormal"], rng.randint(2, 4))
+        option_cell = node("TD", "", [node("L", "", [
+            node("LI", "", [node("LBody", "", [node("ExtraCharSpan", "¡"), node("P", option)])])
+            for option in options
+        ])])
+    elif kind == "extracharspan":
+        options = rng.sample(["Mild", "Moderate", "Severe", "Recovered", "Ongoing", "Fatal"], 3)
+        option_cell = node("TD", "", [node("P", "", [
+            node("ExtraCharSpan", "", [node("ExtraCharSpan", f"¡ {option}") for option in options])
+        ])])
+    elif kind == "sub":
+        # Item label in a Sub node, followed by an annotation the engine must ignore
+        return node("TR", "", [
+            node("TH", "", [node("P", "", [node("Sub", question), node("Sub", "[hidden]")])]),
+            node("TD", "", [node("P", "", [node("Sub", rng.choice(["mmol/L", "mg/dL", "%"]))])]),
+        ])
+    elif kind == "numeric":
+        low, high = sorted(rng.sample(range(0, 400), 2))
+        option_cell = node("TD", "", [node("P", f"|{low} < N{rng.randint(2, 5)}.{rng.randint(0, 2)} ≤ {high}| "
+                                                  f"{rng.choice(['kg', 'cm', 'mmHg', 'beats/min'])}")])
+    elif kind == "date":
+        option_cell = node("TD", "", [node("P", rng.choice(["Req/Req/Req(1900-2099)", "UNK/UNK/Req(1900-2099)"]))])
+    elif kind == "text":
+        option_cell = node("TD", "", [node("P", rng.choice(["Free text field", "Text value", "Specify"]))])
+    else:
+        # TH (required marker) | TD (question) | TD (options)
+        return node("TR", "", [
+            node("TH", "", [node("P", "*")]),
+            node("TD", "", [node("P", question)]),
+            node("TD", "", [node("P", rng.choice(["Yes", "No", "Free text field"]))]),
+        ])
+    marker = "*" if rng.random() < 0.5 else ""
+    return node("TR", "", [node("TH", "", [node("P", marker + question)]), option_cell])
+
+
+def metadata_table(rng: random.Random) -> Node:
+    """Page header table the forms engine must skip (company, trial ID, version, page)."""
+    return node("Table", "", [
+        node("TR", "", [node("TD", "", [node("P", "Novo Nordisk A/S")]),
+                        node("TD", "", [node("P", f"Trial ID: NN{rng.randint(1000, 9999)}-{rng.randint(1000, 9999)}")])]),
+        node("TR", "", [node("TD", "", [node("P", f"Version: {rng.randint(1, 9)}.0")]),
+                        node("TD", "", [node("P", f"Page: {rng.randint(1, 40)} of 40")])]),
+    ])
+
+
+def make_form(index: int, items: int, visits: List[str], depth: int, noise: float,
+              rng: random.Random) -> Node:
+    """One eCRF form section: H1 > (containers) > H2 label > form name paragraph > tables."""
+    label = form_label(index)
+    repeating = rng.random() < 0.3
+    name = f"{form_code(label, index)} - {'Repeating' if repeating else 'Non-repeating'} form"
+    form_visits = ", ".join(sorted(rng.sample(visits, min(len(visits), rng.randint(1, 4))),
+                                   key=lambda visit: int(visit[1:])))
+
+    group_names = [f"{label} group {number}" for number in range(1, max(2, items // 6) + 1)]
+    rows = []
+    for item_index in range(items):
+        if item_index % 6 == 0:
+            # Item group header row (TH only)
+            rows.append(node("TR", "", [node("TH", "", [node("P", group_names[(item_index // 6) % len(group_names)])])]))
+        subject = ITEM_SUBJECTS[(index + item_index) % len(ITEM_SUBJECTS)]
+        question = f"{label} {subject} {item_index + 1}"
+        rows.append(item_row(ITEM_KINDS[(index + item_index) % len(ITEM_KINDS)], question, rng))
+        if rng.random() < noise:
+            rows.append(node("TR", "", [node("TH", "", [node("P", "Please enter the data as collected on the source.")]),
+                                        node("TD", "", [node("P", "Yes")])]))
+
+    content = [node("P", f"Visits: {form_visits}"), node("Table", "", rows)]
+    if rng.random() < noise:
+        content.insert(0, metadata_table(rng))
+    if rng.random() < noise:
+        content.append(node("P", "Design Notes:", [node("P", "Oracle item design notes: none")]))
+    form = node("P", name, content)
+    return node("H1", label, nest([node("H2", f"{label} form", [form])], depth))
+
+
+def make_ecrf(forms: int, items: int, visits: int, depth: int = 0, noise: float = 0.1,
+              rng: Optional[random.Random] = None) -> Node:
+    """Build the eCRF document."""
+    rng = rng or random.Random(0)
+    names = visit_names(visits)
+    return node("Document", "", [make_form(index, items, names, depth, noise, rng) for index in range(forms)])
+
+
+def make_protocol(forms: int, visits: int, procedures: int, depth: int = 0, noise: float = 0.1,
+                  rng: Optional[random.Random] = None) -> Node:
+    """
+    Build the protocol document: a study rationale with the extension week and
+    the schedule of activities flowchart.
+    """
+    rng = rng or random.Random(0)
+    names = visit_names(visits)
+    weeks = study_weeks(visits)
+    extension_week = weeks[max(2, (len(weeks) * 3) // 4)] if len(weeks) > 2 else weeks[-1]
+
+    # Procedures reuse the form labels first, so forms find their schedule rows
+    labels = [form_label(index) for index in range(forms)]
+    extra = [f"{OTHER_PROCEDURES[index % len(OTHER_PROCEDURES)]} {index // len(OTHER_PROCEDURES) + 1}"
+             for index in range(max(0, procedures - len(labels)))]
+    procedure_names = (labels + extra)[:procedures]
+
+    def row(cells: List[str]) -> Node:
+        return node("TR", "", [node("TD", "", [node("P", cell)]) for cell in cells])
+
+    header = [
+        row(["Procedure"] + ["Visit"] * visits),
+        row(["Visit short name"] + names),
+        row(["Study week"] + [str(week) for week in weeks]),
+    ]
+    body = [row([name] + ["X" if rng.random() < 0.4 else "" for _ in names]) for name in procedure_names]
+
+    # Page breaks split the flowchart into continuation tables without headers
+    pages = [header + body]
+    if rng.random() < noise * 5 and len(body) > 20:
+        cut = rng.randint(10, len(body) - 10)
+        pages = [header + body[:cut], body[cut:]]
+    flowchart = [node("Table", "", page) for page in pages]
+    flowchart[-1]["children"].append(row(["Objectives"] + [""] * visits))
+
+    sections = [
+        node("H1", "Study rationale", nest([
+            node("P", f"The trial consists of a main period followed by an extension. "
+                      f"The extension starts after {extension_week} weeks on treatment."),
+        ], depth)),
+        node("H1", "Flowchart", nest(flowchart, depth)),
+    ]
+    if rng.random() < noise * 5:
+        sections.append(node("H1", "Objectives", [node("P", "Primary"), node("P", "To compare the effect of treatment.")]))
+    return node("Document", "", sections)
+
+
+def generate_study(forms: int = 50, items: int = 12, visits: int = 20, procedures: int = 60, depth: int = 0,
+                   noise: float = 0.1, seed: int = 0) -> Tuple[Node, Node]:
+    """
+    Generate a synthetic study.
+
+    Args:
+        forms: Number of eCRF forms
+        items: Items per form
+        visits: Number of visits in the schedule of activities
+        procedures: Number of schedule rows (at least 25 for the SoA parser; form labels come first)
+        depth: Extra container levels around forms and protocol sections
+        noise: Probability of each kind of noise (metadata tables, instruction rows, split tables)
+        seed: Random seed; equal parameters and seed give identical documents
+
+    Returns:
+        (ecrf, protocol) documents
+    """
+    if visits < 3:
+        raise ValueError("visits must be at least 3")
+    rng = random.Random(seed)
+    ecrf = make_ecrf(forms, items, visits, depth, noise, rng)
+    protocol = make_protocol(forms, visits, procedures, depth, noise, rng)
+    return ecrf, protocol
+
+
+def write_study(out_dir: str, **params: Any) -> Tuple[str, str]:
+    """Generate a study (see generate_study) into out_dir; returns the eCRF and protocol paths."""
+    ecrf, protocol = generate_study(**params)
+    Path(out_dir).mkdir(parents=True, exist_ok=True)
+    ecrf_path = os.path.join(out_dir, "synthetic_ecrf.json")
+    protocol_path = os.path.join(out_dir, "synthetic_protocol.json")
+    for path, document in ((ecrf_path, ecrf), (protocol_path, protocol)):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(document, f, ensure_ascii=False)
+    return ecrf_path, protocol_path
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Generate a synthetic eCRF and protocol for scale testing")
+    parser.add_argument("--forms", type=int, default=50, help="Number of eCRF forms (default: 50)")
+    parser.add_argument("--items", type=int, default=12, help="Items per form (default: 12)")
+    parser.add_argument("--visits", type=int, default=20, help="Visits in the schedule of activities (default: 20)")
+    parser.add_argument("--procedures", type=int, default=60, help="Schedule of activities rows (default: 60)")
+    parser.add_argument("--depth", type=int, default=0, help="Extra container nesting levels (default: 0)")
+    parser.add_argument("--noise", type=float, default=0.1,
+                        help="Probability of metadata tables, instruction rows and split tables (default: 0.1)")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed (default: 0)")
+    parser.add_argument("--out-dir", default="./synthetic", help="Output directory (default: ./synthetic)")
+    args = parser.parse_args()
+
+    ecrf_path, protocol_path = write_study(args.out_dir, forms=args.forms, items=args.items, visits=args.visits,
+                                           procedures=args.procedures, depth=args.depth, noise=args.noise,
+                                           seed=args.seed)
+    print(f"✅ Synthetic eCRF written to: {ecrf_path}")
+    print(f"✅ Synthetic protocol written to: {protocol_path}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -20,22 +20,25 @@ import sys
 import json
 import logging
 import argparse
-from typing import Dict, Any, Optional, List
-from pathlib import Path
+from typing import Dict, Any, List, Optional
 import tempfile
 import shutil
-from openpyxl import load_workbook
-from openpyxl.worksheet.worksheet import Worksheet
-from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
-from openpyxl.utils import get_column_letter
-from openpyxl.cell.cell import MergedCell
-
-# Reuse existing modules for schedule grid pipeline
-from modules.form_extractor import extract_forms
-from modules.soa_parser import parse_soa
-from modules.common_matrix import merge_common_matrix
-from modules.event_grouping import group_events
-from modules.schedule_layout import generate_schedule_grid as build_schedule_grid_file
+import hashlib
+import signal
+import time
+
+# Import modular pipeline components
+from modules.pipeline import (DEFAULT_CONFIG_DIR, RESULT_STAGES, ConfigCache, IncrementalPipeline,
+                              ProgressCallback, PTDResult, generate_ptd, load_forms_engine, load_pipeline_configs,
+                              pipeline_sources)
+from modules.checkpoints import (STAGE_BY_NAME, STAGE_NAMES, CheckpointError, CheckpointRunner, CheckpointStore,
+                                 stage_range, write_result_intermediates)
+from modules.ptd_workbook import ensure_output_dir
+from modules.xlsx_writer import XLSX_BACKENDS
+from modules.service import DEFAULT_HOST, DEFAULT_PORT, JobError, serve
+from modules.watch import watch_paths
+from modules.instrumentation import (PROFILERS, counter_snapshot, enable_counters, enable_profiler,
+                                     format_counters)
 
 
 def load_json(file_path: str) -> Dict[str, Any]:
@@ -43,18 +46,6 @@ def load_json(file_path: str) -> Dict[str, Any]:
         return json.load(f)
 
 
-def load_config(config_path: str) -> Dict[str, Any]:
-    try:
-        with open(config_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        logging.warning(f"Config file not found: {config_path}; using defaults")
-        return {}
-    except json.JSONDecodeError as e:
-        logging.warning(f"Invalid JSON in config {config_path}: {e}; using defaults")
-        return {}
-
-
 def setup_logging(level: str = "INFO") -> None:
     logging.basicConfig(
         level=getattr(logging, level.upper()),
@@ -66,453 +57,364 @@ def setup_logging(level: str = "INFO") -> None:
     )
 
 
-def ensure_output_dir(output_path: str) -> None:
-    out_dir = os.path.dirname(output_path)
-    if out_dir:
-        Path(out_dir).mkdir(parents=True, exist_ok=True)
+## Removed: unused header renaming/ordering helper.
 
 
-def run_schedule_grid_pipeline(protocol_json: str, ecrf_json: str, final_output_xlsx: str, config_dir: str) -> str:
+def generate_ptd_workbook(
+    ecrf_json: str,
+    protocol_json: str,
+    template_xlsx: str,
+    output_path: str,
+    fast: bool = False,
+    splice: bool = False,
+    xlsx_backend: Optional[str] = None,
+    items_out: Optional[str] = None,
+    forms_cache: Optional[str] = None,
+    configs: Optional[Dict[str, Any]] = None,
+    progress: Optional[ProgressCallback] = None,
+    intermediates_dir: Optional[str] = None,
+) -> str:
     """
-    Reuse the existing 5-stage pipeline to produce the schedule grid Excel file directly
-    at final_output_xlsx. Returns the absolute path to the generated file.
+    Generate the combined PTD workbook: build the schedule grid and the study
+    specific forms sheets and put them into the template, saved at output_path.
+    configs supplies already-loaded schedule pipeline configs (see ConfigCache).
+    progress receives the pipeline's structured progress events.
+    intermediates_dir receives readable copies of the stage tables (--keep-intermediates).
+    Returns the path of the written workbook.
     """
-    config_files = {
-        'form_extractor': 'config_form_extractor.json',
-        'soa_parser': 'config_soa_parser.json',
-        'common_matrix': 'config_common_matrix.json',
-        'event_grouping': 'config_event_grouping.json',
-        'schedule_layout': 'config_schedule_layout.json'
-    }
-
-    configs: Dict[str, Any] = {}
-    for key, filename in config_files.items():
-        configs[key] = load_config(os.path.join(config_dir, filename))
-
-    temp_dir = tempfile.mkdtemp(prefix="ptd_intermediate_")
-    intermediates: List[str] = []
-    try:
-        forms_csv = os.path.join(temp_dir, "extracted_forms.csv")
-        extract_forms(ecrf_json=ecrf_json, output_csv=forms_csv, config=configs.get('form_extractor', {}))
-        intermediates.append(forms_csv)
+    result = generate_ptd(protocol_json, ecrf_json, template=template_xlsx, configs=configs, forms_cache=forms_cache,
+                          progress=progress)
+    if intermediates_dir:
+        write_result_intermediates(result, intermediates_dir)
+    if items_out:
+        result.write_item_table(items_out)
+    ensure_output_dir(output_path)
+    return result.write_xlsx(output_path, fast=fast, splice=splice, backend=xlsx_backend, progress=progress)
 
-        schedule_csv = os.path.join(temp_dir, "schedule.csv")
-        parse_soa(protocol_json=protocol_json, output_csv=schedule_csv, config=configs.get('soa_parser', {}))
-        intermediates.append(schedule_csv)
 
-        matrix_csv = os.path.join(temp_dir, "soa_matrix.csv")
-        merge_common_matrix(ecrf_csv=forms_csv, schedule_csv=schedule_csv, output_csv=matrix_csv, config=configs.get('common_matrix', {}))
-        intermediates.append(matrix_csv)
+def print_progress_event(event: Dict[str, Any]) -> None:
+    """--progress: write each progress event to stderr as one JSON line."""
+    print(json.dumps({"time": round(time.time(), 3), **event}), file=sys.stderr, flush=True)
 
-        visits_xlsx = os.path.join(temp_dir, "visits_with_groups.xlsx")
-        group_events(protocol_json=protocol_json, output_xlsx=visits_xlsx, config=configs.get('event_grouping', {}))
-        intermediates.append(visits_xlsx)
 
-        ensure_output_dir(final_output_xlsx)
-        build_schedule_grid_file(visits_xlsx=visits_xlsx, forms_csv=matrix_csv, output_xlsx=final_output_xlsx, config=configs.get('schedule_layout', {}))
+def add_instrumentation_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--counters", action="store_true",
+                        help="Count traversed nodes, regex evaluations, fuzzy comparisons and cells written per stage")
+    parser.add_argument("--profile", choices=PROFILERS, default=None,
+                        help="Profile each stage: cprofile (<stage>.pstats) or sampling (<stage>.collapsed stacks)")
+    parser.add_argument("--profile-dir", default="./output/profiles",
+                        help="--profile: directory for the per-stage profiles (default: ./output/profiles)")
 
-        return os.path.abspath(final_output_xlsx)
-    finally:
-        # Best-effort cleanup
-        for p in intermediates:
-            try:
-                if os.path.exists(p):
-                    os.remove(p)
-            except Exception:
-                pass
-        try:
-            shutil.rmtree(temp_dir)
-        except Exception:
-            pass
 
+def start_instrumentation(args: argparse.Namespace) -> None:
+    """--counters / --profile: switch on the opt-in instrumentation (off by default, at no cost)."""
+    if args.counters:
+        enable_counters()
+    if args.profile:
+        enable_profiler(args.profile, args.profile_dir)
 
-def generate_study_specific_forms_xlsx(ecrf_json: str) -> str:
-    """
-    Reuse logic from Final_study_specific_form.py by invoking its processing function to
-    produce an Excel file. Returns the path to the generated temp Excel.
-    """
-    # Import here to avoid executing module-level code unless needed
-    import importlib.util
 
-    module_path = os.path.join(os.path.dirname(__file__), 'Final_study_specific_form.py')
-    spec = importlib.util.spec_from_file_location("Final_study_specific_form", module_path)
-    if spec is None or spec.loader is None:
-        raise RuntimeError("Unable to load Final_study_specific_form.py")
-    mod = importlib.util.module_from_spec(spec)
-    spec.loader.exec_module(mod)
+def report_counters(args: argparse.Namespace) -> None:
+    if args.counters:
+        print("📊 Hot-path counters:")
+        print(format_counters(counter_snapshot()))
 
-    temp_dir = tempfile.mkdtemp(prefix="ptd_forms_")
-    output_xlsx = os.path.join(temp_dir, "study_specific_forms.xlsx")
-
-    # The script's API function writes the Excel; keep its computation logic intact
-    config_rules = os.path.join(os.path.dirname(__file__), 'config', 'config_study_specific_forms.json')
-    # Avoid hardcoded/unnecessary template path; rely on the module's internal template
-    mod.process_clinical_forms(ecrf_json, output_csv_path=output_xlsx, config_path=config_rules)
-    return output_xlsx
 
+def resolve_output_path(template_xlsx: str, out: Optional[str], inplace: bool = False) -> str:
+    """
+    Work out the workbook to write: the template itself for in-place runs,
+    otherwise out, forced to an .xlsx extension. Raises ValueError if neither is given.
+    """
+    if inplace:
+        output_path = template_xlsx
+        # Warn if --out was also provided but different
+        if out and os.path.abspath(out) != os.path.abspath(template_xlsx):
+            logging.warning("--inplace specified: ignoring --out and writing to template path")
+    else:
+        if not out:
+            raise ValueError("--out is required unless --inplace is specified")
+        output_path = out
 
-## Removed: unused header renaming/ordering helper.
+    # Normalize output path extension
+    if not output_path.lower().endswith(".xlsx"):
+        output_path = os.path.splitext(output_path)[0] + ".xlsx"
+    return output_path
 
 
-def _copy_worksheet_contents(src_ws: Worksheet, dest_ws: Worksheet) -> None:
-    """Copy values, styles, merged cells, and dimensions from src_ws to dest_ws."""
-    # Copy column widths
-    for col_letter, dim in src_ws.column_dimensions.items():
-        if getattr(dim, 'width', None):
-            dest_ws.column_dimensions[col_letter].width = dim.width
-
-    # Copy row heights
-    for idx, dim in src_ws.row_dimensions.items():
-        if getattr(dim, 'height', None):
-            dest_ws.row_dimensions[idx].height = dim.height
-
-    # Copy merged ranges first (structure)
-    for merged_range in src_ws.merged_cells.ranges:
-        dest_ws.merge_cells(str(merged_range))
-
-    # Copy cell contents and styles
-    for row in src_ws.iter_rows():
-        for cell in row:
-            # Skip non-top-left merged cells; the range has already been created
-            if isinstance(cell, MergedCell):
-                continue
-            dcell = dest_ws.cell(row=cell.row, column=cell.column, value=cell.value)
-            if cell.has_style:
-                if cell.font:
-                    dcell.font = Font(
-                        name=cell.font.name,
-                        size=cell.font.size,
-                        bold=cell.font.bold,
-                        italic=cell.font.italic,
-                        vertAlign=cell.font.vertAlign,
-                        underline=cell.font.underline,
-                        strike=cell.font.strike,
-                        color=cell.font.color,
-                    )
-                if cell.alignment:
-                    dcell.alignment = Alignment(
-                        horizontal=cell.alignment.horizontal,
-                        vertical=cell.alignment.vertical,
-                        text_rotation=cell.alignment.text_rotation,
-                        wrap_text=cell.alignment.wrap_text,
-                        shrink_to_fit=cell.alignment.shrink_to_fit,
-                        indent=cell.alignment.indent,
-                    )
-                if cell.fill and cell.fill.fill_type:
-                    dcell.fill = PatternFill(
-                        fill_type=cell.fill.fill_type,
-                        start_color=cell.fill.start_color,
-                        end_color=cell.fill.end_color,
-                    )
-                if cell.border:
-                    left = cell.border.left
-                    right = cell.border.right
-                    top = cell.border.top
-                    bottom = cell.border.bottom
-                    dcell.border = Border(
-                        left=Side(style=left.style, color=left.color),
-                        right=Side(style=right.style, color=right.color),
-                        top=Side(style=top.style, color=top.color),
-                        bottom=Side(style=bottom.style, color=bottom.color),
-                    )
-                if cell.number_format:
-                    dcell.number_format = cell.number_format
-
-
-def _copy_worksheet_values_only(src_ws: Worksheet, dest_ws: Worksheet) -> None:
+def make_service_job_runner(config_dir: str, cache_dir: str):
     """
-    Fast path: copy only cell values row-by-row using append.
-    Skips styles, merges, widths, heights for speed.
+    Build the job runner for --serve. Configs and the forms engine stay loaded
+    across jobs (configs are re-read when their files change), and each eCRF
+    gets a forms cache in cache_dir unless the job names one, so repeated jobs
+    only re-extract the forms that changed.
+
+    A job is a JSON object with the CLI's options: ecrf, protocol, template,
+    out or inplace, and optionally fast, splice, xlsx_backend, items_out and
+    forms_cache.
     """
-    for row in src_ws.iter_rows(values_only=True):
-        dest_ws.append(list(row))
-
-    # Preserve merged cell structure if available (ReadOnlyWorksheet may not expose it)
+    configs = ConfigCache(config_dir)
+    configs.get()
+    load_forms_engine()
+
+    def run_job(job: Dict[str, Any]) -> Dict[str, Any]:
+        for key in ("ecrf", "protocol", "template"):
+            if not isinstance(job.get(key), str):
+                raise JobError(f"Job is missing '{key}'")
+            if not os.path.exists(job[key]):
+                raise JobError(f"{key} not found: {job[key]}")
+        xlsx_backend = job.get("xlsx_backend")
+        if xlsx_backend is not None and xlsx_backend not in XLSX_BACKENDS:
+            raise JobError(f"Unknown xlsx_backend: {xlsx_backend}")
+        try:
+            output_path = resolve_output_path(job["template"], job.get("out"), bool(job.get("inplace")))
+        except ValueError as e:
+            raise JobError(str(e)) from e
+
+        forms_cache = job.get("forms_cache")
+        if not forms_cache:
+            ecrf_key = hashlib.sha1(os.path.abspath(job["ecrf"]).encode("utf-8")).hexdigest()[:16]
+            forms_cache = os.path.join(cache_dir, f"forms_{ecrf_key}.pkl")
+
+        final_path = generate_ptd_workbook(
+            ecrf_json=job["ecrf"],
+            protocol_json=job["protocol"],
+            template_xlsx=job["template"],
+            output_path=output_path,
+            fast=bool(job.get("fast")),
+            splice=bool(job.get("splice")),
+            xlsx_backend=xlsx_backend,
+            items_out=job.get("items_out"),
+            forms_cache=forms_cache,
+            configs=configs.get(),
+        )
+        return {"output": os.path.abspath(final_path)}
+
+    return run_job
+
+
+def run_service(host: str, port: int) -> int:
+    """Run the resident generation service until interrupted."""
+    cache_dir = tempfile.mkdtemp(prefix="ptd_service_")
     try:
-        merged_ranges = None
-        merged_container = getattr(src_ws, "merged_cells", None)
-        if merged_container is not None:
-            merged_ranges = getattr(merged_container, "ranges", None)
-        if not merged_ranges:
-            # Fallback for older openpyxl
-            merged_ranges = getattr(src_ws, "merged_cell_ranges", None)
-        if merged_ranges:
-            for merged_range in merged_ranges:
-                try:
-                    dest_ws.merge_cells(str(merged_range))
-                except Exception:
-                    pass
-    except Exception:
-        # If unavailable in read-only mode, skip merges for speed/simplicity
-        pass
-
-
-def _copy_header_styles(src_ws: Worksheet, dest_ws: Worksheet, max_header_rows: int) -> None:
-    """
-    Copy only styles (font, alignment, fill, border, number_format) for the first
-    max_header_rows to preserve header/group colouring while keeping operation fast.
-    """
-    if max_header_rows <= 0:
-        return
-    rows_to_copy = min(max_header_rows, src_ws.max_row)
-    for r in range(1, rows_to_copy + 1):
-        for cell in src_ws[r]:
-            try:
-                dcell = dest_ws.cell(row=cell.row, column=cell.column)
-                if cell.has_style:
-                    if cell.font:
-                        dcell.font = Font(
-                            name=cell.font.name,
-                            size=cell.font.size,
-                            bold=cell.font.bold,
-                            italic=cell.font.italic,
-                            vertAlign=cell.font.vertAlign,
-                            underline=cell.font.underline,
-                            strike=cell.font.strike,
-                            color=cell.font.color,
-                        )
-                    if cell.alignment:
-                        dcell.alignment = Alignment(
-                            horizontal=cell.alignment.horizontal,
-                            vertical=cell.alignment.vertical,
-                            text_rotation=cell.alignment.text_rotation,
-                            wrap_text=cell.alignment.wrap_text,
-                            shrink_to_fit=cell.alignment.shrink_to_fit,
-                            indent=cell.alignment.indent,
-                        )
-                    if cell.fill and cell.fill.fill_type:
-                        dcell.fill = PatternFill(
-                            fill_type=cell.fill.fill_type,
-                            start_color=cell.fill.start_color,
-                            end_color=cell.fill.end_color,
-                        )
-                    if cell.border:
-                        left = cell.border.left
-                        right = cell.border.right
-                        top = cell.border.top
-                        bottom = cell.border.bottom
-                        dcell.border = Border(
-                            left=Side(style=left.style, color=left.color),
-                            right=Side(style=right.style, color=right.color),
-                            top=Side(style=top.style, color=top.color),
-                            bottom=Side(style=bottom.style, color=bottom.color),
-                        )
-                    if cell.number_format:
-                        dcell.number_format = cell.number_format
-            except Exception:
-                # Best-effort; continue
-                pass
-
-
-def replace_sheets_in_template(
+        run_job = make_service_job_runner(DEFAULT_CONFIG_DIR, cache_dir)
+        serve(run_job, host=host, port=port)
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    return 0
+
+
+def run_watch(
+    ecrf_json: str,
+    protocol_json: str,
     template_xlsx: str,
-    schedule_xlsx: str,
-    forms_xlsx: str,
-    out_xlsx: str,
-    schedule_sheet_name: str = "Schedule Grid",
-    forms_sheet_name: str = "Study Specific Forms",
+    output_path: str,
+    debounce: float = 1.0,
     fast: bool = False,
-) -> str:
+    splice: bool = False,
+    xlsx_backend: Optional[str] = None,
+    items_out: Optional[str] = None,
+    forms_cache: Optional[str] = None,
+    progress: Optional[ProgressCallback] = None,
+) -> int:
     """
-    Load the template workbook, remove existing target sheets if present, copy
-    the generated schedule and forms worksheets (including styles, merges, and
-    dimensions) into the template, preserve all other sheets, and save to out_xlsx.
-    Returns the absolute path to the saved workbook.
+    Generate output_path, then regenerate it whenever the eCRF, the protocol, the
+    template or a config file changes (after debounce seconds of quiet), until
+    interrupted. Only the stages whose inputs changed are recomputed, and edited
+    eCRFs re-extract only their changed forms.
     """
-    ensure_output_dir(out_xlsx)
-
-    wb_template = load_workbook(template_xlsx)
-    # Load sources; for fast path we still load normally to allow header style copy
-    wb_schedule = load_workbook(schedule_xlsx)
-    wb_forms = load_workbook(forms_xlsx)
-
+    cache_dir = tempfile.mkdtemp(prefix="ptd_watch_")
+    pipeline = IncrementalPipeline(protocol_json, ecrf_json, template=template_xlsx, config_dir=DEFAULT_CONFIG_DIR,
+                                   forms_cache=forms_cache or os.path.join(cache_dir, "forms_cache.pkl"))
+
+    def regenerate(changed: set) -> None:
+        if changed:
+            logging.info(f"Changed: {', '.join(sorted(changed))}")
+        started = time.perf_counter()
+        try:
+            result = pipeline.run(progress)
+            if items_out:
+                result.write_item_table(items_out)
+            result.write_xlsx(output_path, fast=fast, splice=splice, backend=xlsx_backend, progress=progress)
+        except Exception as e:
+            # Typically an export still being written; the next change retries
+            logging.error(f"Regeneration failed: {type(e).__name__}: {e}")
+            return
+        logging.info(f"✅ {output_path} regenerated in {time.perf_counter() - started:.2f}s")
+
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+
+    # Stop cleanly on SIGTERM too, like --serve
+    signal.signal(signal.SIGTERM, stop)
     try:
-        # Determine insertion indices to preserve original order if sheets existed
-        schedule_index = None
-        forms_index = None
-        if schedule_sheet_name in wb_template.sheetnames:
-            schedule_index = wb_template.sheetnames.index(schedule_sheet_name)
-            wb_template.remove(wb_template[schedule_sheet_name])
-        if forms_sheet_name in wb_template.sheetnames:
-            forms_index = wb_template.sheetnames.index(forms_sheet_name)
-            wb_template.remove(wb_template[forms_sheet_name])
-
-        # Create destination sheets at recorded positions (or append if None)
-        if schedule_index is not None:
-            dest_schedule = wb_template.create_sheet(title=schedule_sheet_name, index=schedule_index)
-        else:
-            dest_schedule = wb_template.create_sheet(title=schedule_sheet_name)
-        if forms_index is not None:
-            dest_forms = wb_template.create_sheet(title=forms_sheet_name, index=forms_index)
-        else:
-            dest_forms = wb_template.create_sheet(title=forms_sheet_name)
-
-        # Source sheets (first worksheet in each generated file)
-        src_schedule: Worksheet = wb_schedule.worksheets[0]
-        src_forms: Worksheet = wb_forms.worksheets[0]
-
-        # Copy contents
-        if fast:
-            _copy_worksheet_values_only(src_schedule, dest_schedule)
-            _copy_worksheet_values_only(src_forms, dest_forms)
-            # Preserve header styles (keep column/group colouring)
-            _copy_header_styles(src_schedule, dest_schedule, max_header_rows=5)
-            _copy_header_styles(src_forms, dest_forms, max_header_rows=3)
-        else:
-            _copy_worksheet_contents(src_schedule, dest_schedule)
-            _copy_worksheet_contents(src_forms, dest_forms)
-
-        wb_template.save(out_xlsx)
-        return os.path.abspath(out_xlsx)
+        regenerate(set())
+        logging.info("Watching inputs, template and config for changes (Ctrl+C to stop)")
+        watch_paths([ecrf_json, protocol_json, template_xlsx, DEFAULT_CONFIG_DIR], regenerate, debounce=debounce)
+    except KeyboardInterrupt:
+        logging.info("Watch stopped")
     finally:
-        try:
-            wb_schedule.close()
-        except Exception:
-            pass
-        try:
-            wb_forms.close()
-        except Exception:
-            pass
-        try:
-            wb_template.close()
-        except Exception:
-            pass
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    return 0
 
 
-def auto_format_sheet(sheet: Worksheet, header_rows: int = 1, skip_fill_rows=None) -> None:
-    """Auto-fit columns, style headers (one or more rows), and apply borders.
+STAGE_COMMANDS = ("stages", "run") + tuple(STAGE_NAMES)
 
-    Preserves any existing header fills and avoids filling Row 1 beyond column D.
-    """
-    header_font = Font(bold=True)
-    center_align = Alignment(horizontal="center", vertical="center", wrap_text=True)
-    header_fill = PatternFill(start_color="D9E1F2", end_color="D9E1F2", fill_type="solid")
-    thin_border = Border(
-        left=Side(style="thin"), right=Side(style="thin"),
-        top=Side(style="thin"), bottom=Side(style="thin")
-    )
 
-    # Style header rows
-    header_rows = max(1, min(header_rows, sheet.max_row))
-    skip_fill_rows = skip_fill_rows or set()
-    for r in range(1, header_rows + 1):
-        for cell in sheet[r]:
-            cell.font = header_font
-            cell.alignment = center_align
-            # Preserve pre-existing fills (do not override group colors)
-            try:
-                fill_type = getattr(cell.fill, 'fill_type', None)
-            except Exception:
-                fill_type = None
-            # Do not apply header fill to Row 1 columns beyond D
-            col_idx = cell.column if hasattr(cell, 'column') else cell.col_idx
-            beyond_ctdm = (r == 1 and col_idx and col_idx > 4)
-            if not fill_type and r not in skip_fill_rows and not beyond_ctdm:
-                cell.fill = header_fill
-            cell.border = thin_border
-
-    # Style all data rows
-    for row in sheet.iter_rows(min_row=header_rows + 1, max_row=sheet.max_row, max_col=sheet.max_column):
-        for cell in row:
-            cell.alignment = Alignment(wrap_text=True, vertical="center")
-            cell.border = thin_border
-
-    # Auto-adjust column widths
-    for col in sheet.columns:
-        max_length = 0
-        first_cell = next(iter(col))
-        column_letter = get_column_letter(first_cell.column)
-        for cell in col:
-            try:
-                val_len = len(str(cell.value)) if cell.value is not None else 0
-                if val_len > max_length:
-                    max_length = val_len
-            except Exception:
-                pass
-        sheet.column_dimensions[column_letter].width = max(10, min(80, max_length + 3))
-
-
-def finalize_formatting(output_path: str, forms_sheet_name: str = "Study Specific Forms") -> None:
+def stage_main(argv: List[str]) -> int:
     """
-    Apply formatting only to the study-specific forms sheet. The schedule grid
-    formatting produced by its generator is preserved as-is.
+    Stage-level CLI: run one stage or a range of stages, checkpointing each
+    completed stage so later runs (or --resume after a failure) start from there.
     """
-    wb = load_workbook(output_path)
-    if forms_sheet_name in wb.sheetnames:
-        ws = wb[forms_sheet_name]
-        # Keep the 3 fixed header rows (Row 1 CTDM, Row 2 merged groups, Row 3 subheaders)
-        auto_format_sheet(ws, header_rows=3, skip_fill_rows={})
-    wb.save(output_path)
+    parser = argparse.ArgumentParser(
+        prog="generate_ptd.py",
+        description="Run PTD pipeline stages with checkpoints"
+    )
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--ecrf", required=False, help="Path to hierarchical_output_final_ecrf.json")
+    common.add_argument("--protocol", required=False, help="Path to hierarchical_output_final_protocol.json")
+    common.add_argument("--checkpoint-dir", default="./output/checkpoints",
+                        help="Directory holding the stage checkpoints (default: ./output/checkpoints)")
+    common.add_argument("--config-dir", default=DEFAULT_CONFIG_DIR, help="Directory containing configuration files")
+    common.add_argument("--keep-intermediates", action="store_true",
+                        help="Also write readable stage outputs (CSV/xlsx) into the checkpoint directory")
+    common.add_argument("--progress", action="store_true",
+                        help="Report structured progress events as JSON lines on stderr")
+    add_instrumentation_arguments(common)
+
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("stages", help="List the pipeline stages and their inputs")
+    run = commands.add_parser("run", parents=[common], help="Run a range of stages (default: all)")
+    run.add_argument("--from", dest="first", choices=STAGE_NAMES, help="First stage to run")
+    run.add_argument("--to", dest="last", choices=STAGE_NAMES, help="Last stage to run")
+    run.add_argument("--resume", action="store_true",
+                     help="Skip stages already checkpointed for the current inputs")
+    run.add_argument("--template", required=False, help="Template Excel for --out")
+    run.add_argument("--out", required=False, help="Also write the PTD workbook (needs every stage run or checkpointed)")
+    run.add_argument("--fast", action="store_true", help="--out: stream both sheets and splice them into the template (implies --splice); plain forms formatting")
+    run.add_argument("--splice", action="store_true", help="--out: replace the two sheets inside the template's package")
+    run.add_argument("--xlsx-backend", choices=XLSX_BACKENDS, default=None, help="--out: writer for the generated sheets")
+    for stage in STAGE_BY_NAME.values():
+        commands.add_parser(stage.name, parents=[common],
+                            help=f"Run only the {stage.name} stage (inputs: {', '.join(stage.inputs)})")
+    args = parser.parse_args(argv)
+
+    if args.command == "stages":
+        for stage in STAGE_BY_NAME.values():
+            print(f"{stage.name:<16} <- {', '.join(stage.inputs)}")
+        return 0
+
+    setup_logging("INFO")
+    if args.command == "run":
+        try:
+            stages = stage_range(args.first, args.last)
+        except ValueError as e:
+            parser.error(str(e))
+    else:
+        stages = [STAGE_BY_NAME[args.command]]
+
+    configs = load_pipeline_configs(args.config_dir)
+    progress = print_progress_event if args.progress else None
+    start_instrumentation(args)
+    sources = pipeline_sources(args.protocol, args.ecrf, configs, args.config_dir, progress=progress)
+    store = CheckpointStore(args.checkpoint_dir)
+    runner = CheckpointRunner(sources, store)
+    try:
+        ran = runner.run(stages, resume=getattr(args, "resume", False),
+                         intermediates_dir=args.checkpoint_dir if args.keep_intermediates else None,
+                         progress=progress)
+        logging.info(f"Stages run: {', '.join(ran) or 'none'}; checkpoints in {args.checkpoint_dir}")
+
+        if getattr(args, "out", None):
+            values = {name: runner.value(name) for name in RESULT_STAGES}
+            result = PTDResult.from_stage_values(values, runner.metrics, args.template, configs)
+            final_path = result.write_xlsx(resolve_output_path(args.template, args.out), fast=args.fast,
+                                           splice=args.splice, backend=args.xlsx_backend, progress=progress)
+            print(f"✅ Combined PTD file written successfully to: {final_path}")
+    except CheckpointError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 2
+    report_counters(args)
+    return 0
 
 
 def main() -> int:
+    if len(sys.argv) > 1 and sys.argv[1] in STAGE_COMMANDS:
+        return stage_main(sys.argv[1:])
+
     parser = argparse.ArgumentParser(
-        description="Generate PTD Excel with Schedule Grid and Study Specific Forms"
+        description="Generate PTD Excel with Schedule Grid and Study Specific Forms",
+        epilog=f"Stage commands: generate_ptd.py {{{','.join(STAGE_COMMANDS)}}} --help"
     )
-    parser.add_argument("--ecrf", required=True, help="Path to hierarchical_output_final_ecrf.json")
-    parser.add_argument("--protocol", required=True, help="Path to hierarchical_output_final_protocol.json")
-    parser.add_argument("--template", required=True, help="Path to template Excel (will be updated)")
+    parser.add_argument("--ecrf", required=False, help="Path to hierarchical_output_final_ecrf.json")
+    parser.add_argument("--protocol", required=False, help="Path to hierarchical_output_final_protocol.json")
+    parser.add_argument("--template", required=False, help="Path to template Excel (will be updated)")
     parser.add_argument("--out", required=False, help="Output Excel file path (e.g., ptd.xlsx). Omit when using --inplace")
     parser.add_argument("--inplace", action="store_true", help="Modify the template file in place (save over --template)")
-    parser.add_argument("--fast", action="store_true", help="Fast mode: values-only copy, skip extra formatting")
+    parser.add_argument("--fast", action="store_true", help="Fast mode: stream both sheets and splice them into the template (implies --splice and --xlsx-backend streaming); plain forms formatting")
+    parser.add_argument("--items-out", required=False, help="Also export the study forms item table (.parquet or .arrow)")
+    parser.add_argument("--splice", action="store_true",
+                        help="Replace the two sheets inside the template's xlsx package; other template parts stay byte-identical")
+    parser.add_argument("--xlsx-backend", choices=XLSX_BACKENDS, default=None,
+                        help="Writer for the generated sheets: openpyxl (in memory) or streaming (constant memory)")
+    parser.add_argument("--forms-cache", required=False, help="Per-form cache file; only forms changed since the last run are re-extracted")
+    parser.add_argument("--progress", action="store_true",
+                        help="Report structured progress events (stage start/end, forms and items done) as JSON lines on stderr")
+    parser.add_argument("--keep-intermediates", action="store_true",
+                        help="Also write the stage tables (extracted_forms.csv, schedule.csv, soa_matrix.csv, visits_with_groups.xlsx) next to the output")
+    parser.add_argument("--watch", action="store_true",
+                        help="Keep running and regenerate the output when the inputs, the template or config/ change")
+    parser.add_argument("--debounce", type=float, default=1.0,
+                        help="--watch: seconds the inputs must be unchanged before regenerating (default: 1.0)")
+    parser.add_argument("--serve", action="store_true",
+                        help="Run as a resident local service accepting generation jobs over HTTP (POST /generate)")
+    parser.add_argument("--host", default=DEFAULT_HOST, help=f"Service interface (default: {DEFAULT_HOST})")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"Service port (default: {DEFAULT_PORT})")
+    add_instrumentation_arguments(parser)
     args = parser.parse_args()
 
+    if not args.serve:
+        missing = [f"--{name}" for name in ("ecrf", "protocol", "template") if not getattr(args, name)]
+        if missing:
+            parser.error(f"the following arguments are required: {', '.join(missing)}")
+    if args.watch and args.inplace:
+        parser.error("--watch cannot write --inplace: the template is one of the watched inputs")
+
     setup_logging("INFO")
+    start_instrumentation(args)
 
-    # Determine output path (in-place or new file)
-    if args.inplace:
-        output_path = args.template
-        # Warn if --out was also provided but different
-        if args.out and os.path.abspath(args.out) != os.path.abspath(args.template):
-            logging.warning("--inplace specified: ignoring --out and writing to template path")
-    else:
-        if not args.out:
-            print("Error: --out is required unless --inplace is specified", file=sys.stderr)
-            return 2
-        output_path = args.out
+    if args.serve:
+        return run_service(args.host, args.port)
 
-    # Normalize output path extension and ensure folder
-    if not output_path.lower().endswith(".xlsx"):
-        output_path = os.path.splitext(output_path)[0] + ".xlsx"
+    # Determine output path (in-place or new file)
+    try:
+        output_path = resolve_output_path(args.template, args.out, args.inplace)
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 2
     ensure_output_dir(output_path)
 
-    # 1) Build schedule grid into a temp workbook
-    schedule_tmp_dir = tempfile.mkdtemp(prefix="ptd_schedule_")
-    schedule_tmp_xlsx = os.path.join(schedule_tmp_dir, "schedule_grid.xlsx")
-    schedule_path = run_schedule_grid_pipeline(
-        protocol_json=args.protocol,
-        ecrf_json=args.ecrf,
-        final_output_xlsx=schedule_tmp_xlsx,
-        config_dir=os.path.join(os.path.dirname(__file__), "config"),
-    )
-
-    # 2) Generate study specific forms to a temp file
-    forms_tmp_xlsx = generate_study_specific_forms_xlsx(args.ecrf)
+    progress = print_progress_event if args.progress else None
+    if args.watch:
+        return run_watch(args.ecrf, args.protocol, args.template, output_path, debounce=args.debounce,
+                         fast=args.fast, splice=args.splice, xlsx_backend=args.xlsx_backend,
+                         items_out=args.items_out, forms_cache=args.forms_cache, progress=progress)
 
-    # 3) Replace sheets in the provided template and save to output
-    final_path = replace_sheets_in_template(
+    final_path = generate_ptd_workbook(
+        ecrf_json=args.ecrf,
+        protocol_json=args.protocol,
         template_xlsx=args.template,
-        schedule_xlsx=schedule_path,
-        forms_xlsx=forms_tmp_xlsx,
-        out_xlsx=output_path,
+        output_path=output_path,
         fast=args.fast,
+        splice=args.splice,
+        xlsx_backend=args.xlsx_backend,
+        items_out=args.items_out,
+        forms_cache=args.forms_cache,
+        progress=progress,
+        intermediates_dir=(os.path.dirname(output_path) or ".") if args.keep_intermediates else None,
     )
 
-    # 4) Finalize formatting on forms sheet (skip in fast mode)
-    if not args.fast:
-        finalize_formatting(final_path)
-
-    # Cleanup temp dirs
-    try:
-        shutil.rmtree(schedule_tmp_dir)
-    except Exception:
-        pass
-    try:
-        shutil.rmtree(os.path.dirname(forms_tmp_xlsx))
-    except Exception:
-        pass
-
     print(f"✅ Combined PTD file written successfully to: {final_path}")
+    report_counters(args)
     return 0
 
 
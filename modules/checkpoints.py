@@ -0,0 +1,215 @@
+"""
+Checkpoints Module
+
+Stage checkpoints for the stage-level CLI. Each completed stage's value is
+pickled into a checkpoint directory under a key derived from everything the
+stage depends on (input file contents, stage configs and upstream stage keys),
+so a failed or interrupted run resumes from the last completed stage and a
+checkpoint is never reused after its inputs changed.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import pickle
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from .pipeline import PIPELINE_STAGES, ProgressCallback, Stage, run_stages
+
+# Bump when stage values change shape; older checkpoints are then ignored
+CHECKPOINT_VERSION = 1
+MANIFEST_FILE = "manifest.json"
+
+STAGE_NAMES = [stage.name for stage in PIPELINE_STAGES]
+STAGE_BY_NAME = {stage.name: stage for stage in PIPELINE_STAGES}
+
+# Source inputs whose file content is part of the checkpoint keys
+FILE_SOURCES = ("protocol", "ecrf", "forms_config")
+
+# Readable copies written with --keep-intermediates, in the legacy file formats
+INTERMEDIATE_FILES = {
+    "extract_forms": "extracted_forms.csv",
+    "parse_soa": "schedule.csv",
+    "common_matrix": "soa_matrix.csv",
+    "event_grouping": "visits_with_groups.xlsx",
+}
+
+
+class CheckpointError(RuntimeError):
+    """A stage's inputs are neither computed in this run nor checkpointed."""
+
+
+def file_digest(path: str) -> str:
+    """SHA-1 of a file's content."""
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class CheckpointStore:
+    """Pickled stage values in a directory, indexed by manifest.json (stage -> key)."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        Path(directory).mkdir(parents=True, exist_ok=True)
+        self._manifest = self._load_manifest()
+
+    def _manifest_path(self) -> str:
+        return os.path.join(self.directory, MANIFEST_FILE)
+
+    def _load_manifest(self) -> Dict[str, str]:
+        try:
+            with open(self._manifest_path(), "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except json.JSONDecodeError as e:
+            logging.warning(f"Ignoring unreadable checkpoint manifest: {e}")
+            return {}
+        if manifest.get("version") != CHECKPOINT_VERSION:
+            return {}
+        return manifest.get("stages", {})
+
+    def path(self, stage: str) -> str:
+        return os.path.join(self.directory, f"{stage}.pkl")
+
+    def has(self, stage: str, key: str) -> bool:
+        return self._manifest.get(stage) == key and os.path.exists(self.path(stage))
+
+    def load(self, stage: str, key: str) -> Any:
+        with open(self.path(stage), "rb") as f:
+            checkpoint = pickle.load(f)
+        if checkpoint.get("version") != CHECKPOINT_VERSION or checkpoint.get("key") != key:
+            raise CheckpointError(f"Checkpoint of stage '{stage}' is stale")
+        return checkpoint["value"]
+
+    def save(self, stage: str, key: str, value: Any) -> None:
+        """Write the stage's checkpoint, then record it in the manifest (both atomically replaced)."""
+        tmp_path = self.path(stage) + ".tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump({"version": CHECKPOINT_VERSION, "key": key, "value": value}, f,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.path(stage))
+
+        self._manifest[stage] = key
+        tmp_manifest = self._manifest_path() + ".tmp"
+        with open(tmp_manifest, "w", encoding="utf-8") as f:
+            json.dump({"version": CHECKPOINT_VERSION, "stages": self._manifest}, f, indent=2)
+        os.replace(tmp_manifest, self._manifest_path())
+
+
+def write_intermediate(stage: str, value: Any, directory: str) -> Optional[str]:
+    """Write a readable copy of a stage value (see INTERMEDIATE_FILES); returns its path, if any."""
+    filename = INTERMEDIATE_FILES.get(stage)
+    if filename is None:
+        return None
+    path = os.path.join(directory, filename)
+    if stage == "extract_forms":
+        # Same bytes as form_extractor.extract_forms (csv module: BOM, CRLF rows)
+        value.to_csv(path, index=False, encoding="utf-8-sig", lineterminator="\r\n")
+    elif stage == "parse_soa":
+        value.to_csv(path)
+    elif stage == "common_matrix":
+        value.to_csv(path, index=False)
+    else:
+        value.to_excel(path, index=False)
+    logging.info(f"Intermediate {stage} written to {path}")
+    return path
+
+
+def write_result_intermediates(result: Any, directory: str) -> List[str]:
+    """Write readable copies of a PTDResult's stage tables into directory."""
+    values = {
+        "extract_forms": result.forms,
+        "parse_soa": result.schedule,
+        "common_matrix": result.soa_matrix,
+        "event_grouping": result.visits,
+    }
+    Path(directory).mkdir(parents=True, exist_ok=True)
+    return [write_intermediate(stage, value, directory) for stage, value in values.items()]
+
+
+def stage_range(first: Optional[str] = None, last: Optional[str] = None) -> List[Stage]:
+    """Stages from first to last inclusive, in pipeline order (default: all)."""
+    start = STAGE_NAMES.index(first) if first else 0
+    end = STAGE_NAMES.index(last) if last else len(STAGE_NAMES) - 1
+    if start > end:
+        raise ValueError(f"Stage '{first}' comes after '{last}'")
+    return PIPELINE_STAGES[start:end + 1]
+
+
+class CheckpointRunner:
+    """
+    Runs pipeline stages against a CheckpointStore. Stages outside the run
+    are taken from their checkpoints, which must match the current inputs.
+    """
+
+    def __init__(self, sources: Dict[str, Any], store: CheckpointStore):
+        self.sources = sources
+        self.store = store
+        self.values: Dict[str, Any] = dict(sources)
+        self.metrics: Dict[str, Dict[str, Any]] = {}
+        self._keys: Dict[str, Optional[str]] = {}
+
+    def key(self, name: str) -> Optional[str]:
+        """Checkpoint key of a stage or source; None for sources that do not affect values."""
+        if name in self._keys:
+            return self._keys[name]
+        if name in STAGE_BY_NAME:
+            parts = [name] + [self.key(input_name) for input_name in STAGE_BY_NAME[name].inputs]
+        elif name in FILE_SOURCES:
+            path = self.sources.get(name)
+            if not path:
+                raise CheckpointError(f"--{name} is required to run or resume this stage")
+            parts = [name, file_digest(path)]
+        elif name.startswith("config:"):
+            parts = [name, json.dumps(self.sources[name], sort_keys=True, default=str)]
+        else:
+            self._keys[name] = None
+            return None
+        self._keys[name] = hashlib.sha1(json.dumps(parts).encode("utf-8")).hexdigest()
+        return self._keys[name]
+
+    def value(self, name: str) -> Any:
+        """A stage's value: computed in this run, or loaded from its checkpoint."""
+        if name not in self.values:
+            if not self.store.has(name, self.key(name)):
+                raise CheckpointError(f"No checkpoint of stage '{name}' for the current inputs in "
+                                      f"{self.store.directory}; run that stage first")
+            self.values[name] = self.store.load(name, self.key(name))
+            logging.info(f"Loaded checkpoint of stage '{name}'")
+        return self.values[name]
+
+    def run(self, stages: List[Stage], resume: bool = False, intermediates_dir: Optional[str] = None,
+            progress: Optional[ProgressCallback] = None) -> List[str]:
+        """
+        Run stages in order, checkpointing each one as soon as it completes.
+
+        Args:
+            stages: Stages to run (see stage_range)
+            resume: Skip stages that already have a checkpoint for the current inputs
+            intermediates_dir: Also write readable copies of the stage outputs there
+            progress: Callback receiving stage_start / stage_end events
+
+        Returns:
+            Names of the stages that ran (resumed stages excluded)
+        """
+        ran = []
+        for stage in stages:
+            if resume and self.store.has(stage.name, self.key(stage.name)):
+                self.metrics[stage.name] = {"seconds": 0.0, "resumed": True}
+                logging.info(f"Stage '{stage.name}' already checkpointed; skipping")
+                continue
+            for name in stage.inputs:
+                if name in STAGE_BY_NAME:
+                    self.value(name)
+            run_stages([stage], self.values, self.metrics, progress)
+            self.store.save(stage.name, self.key(stage.name), self.values[stage.name])
+            if intermediates_dir:
+                write_intermediate(stage.name, self.values[stage.name], intermediates_dir)
+            ran.append(stage.name)
+        return ran
@@ -18,15 +18,14 @@ def fuzzy_match(a: str, b: str, case_insensitive: bool = True) -> float:
     return SequenceMatcher(None, a, b).ratio()
 
 
-def generate_ordered_soa_matrix(ecrf_file: str, schedule_file: str, output_file: str, 
-                               config: Dict[str, Any] = None) -> pd.DataFrame:
+def build_ordered_soa_matrix(extracted: pd.DataFrame, schedule: pd.DataFrame,
+                             config: Dict[str, Any] = None) -> pd.DataFrame:
     """
-    Generate SoA matrix with per-visit ordering using fuzzy matching.
+    Build the SoA matrix with per-visit ordering using fuzzy matching.
     
     Args:
-        ecrf_file: Path to extracted forms CSV
-        schedule_file: Path to schedule CSV
-        output_file: Path to output CSV
+        extracted: Extracted forms table
+        schedule: Schedule table with a 'Procedure' column followed by visit columns
         config: Configuration dictionary
         
     Returns:
@@ -35,8 +34,6 @@ def generate_ordered_soa_matrix(ecrf_file: str, schedule_file: str, output_file:
     if config is None:
         config = {}
     
-    logging.info(f"Generating ordered SoA matrix from {ecrf_file} and {schedule_file}")
-    
     # Load configuration
     threshold = config.get('fuzzy_threshold', 0.5)
     include_unmapped = config.get('include_unmapped', False)
@@ -54,14 +51,6 @@ def generate_ordered_soa_matrix(ecrf_file: str, schedule_file: str, output_file:
     trigger_details_col = visit_mapping.get('trigger_details_column', 'Trigger Details')
     required_col = visit_mapping.get('required_column', 'Required')
     
-    # Load data
-    try:
-        extracted = pd.read_csv(ecrf_file)
-        schedule = pd.read_csv(schedule_file)
-    except Exception as e:
-        logging.error(f"Error loading input files: {e}")
-        raise
-    
     # Procedure order from schedule
     proc_order = list(schedule['Procedure'])
     
@@ -91,9 +80,9 @@ def generate_ordered_soa_matrix(ecrf_file: str, schedule_file: str, output_file:
     logging.info(f"Unmapped forms: {unmapped_forms}")
     
     # Sort extracted forms based on mapping
-    extracted['SortIndex'] = extracted[form_label_col].map(
+    extracted = extracted.assign(SortIndex=extracted[form_label_col].map(
         lambda x: form_order_map.get(x, {'index': 9999})['index']
-    )
+    ))
     ex_sorted = extracted.sort_values('SortIndex').reset_index(drop=True)
     
     # Visit order from schedule
@@ -150,6 +139,38 @@ def generate_ordered_soa_matrix(ecrf_file: str, schedule_file: str, output_file:
             else:
                 matrix_df.at[idx, visit] = ''
     
+    return matrix_df
+
+
+def generate_ordered_soa_matrix(ecrf_file: str, schedule_file: str, output_file: str, 
+                               config: Dict[str, Any] = None) -> pd.DataFrame:
+    """
+    Generate SoA matrix with per-visit ordering using fuzzy matching.
+    
+    Args:
+        ecrf_file: Path to extracted forms CSV
+        schedule_file: Path to schedule CSV
+        output_file: Path to output CSV
+        config: Configuration dictionary
+        
+    Returns:
+        DataFrame containing the ordered SoA matrix
+    """
+    if config is None:
+        config = {}
+    
+    logging.info(f"Generating ordered SoA matrix from {ecrf_file} and {schedule_file}")
+    
+    # Load data
+    try:
+        extracted = pd.read_csv(ecrf_file)
+        schedule = pd.read_csv(schedule_file)
+    except Exception as e:
+        logging.error(f"Error loading input files: {e}")
+        raise
+    
+    matrix_df = build_ordered_soa_matrix(extracted, schedule, config)
+    
     # Save to CSV
     matrix_df.to_csv(output_file, index=False)
     logging.info(f"SoA matrix saved to {output_file}")
@@ -5,11 +5,25 @@ Groups visits into event categories and creates visit windows with offset calcul
 from protocol JSON files.
 """
 
+import ast
 import json
 import re
 import logging
+import numpy as np
 import pandas as pd
-from typing import Dict, Any, List, Optional, Tuple
+from typing import Callable, Dict, Any, List, Optional, Tuple
+
+from .soa_tables import SoAModel, SoATable, load_soa_model
+from .text_index import TextIndex, iter_text_nodes, iter_texts
+
+# Node types allowed in the configured offset expression: arithmetic over
+# numeric constants and the study_week column
+_OFFSET_EXPRESSION_NODES = (
+    ast.Expression, ast.BinOp, ast.UnaryOp, ast.Constant, ast.Name, ast.Load,
+    ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow,
+    ast.UAdd, ast.USub,
+)
+_OFFSET_EXPRESSION_NAMES = ("study_week",)
 
 
 def load_json(path: str) -> Dict[str, Any]:
@@ -18,27 +32,22 @@ def load_json(path: str) -> Dict[str, Any]:
         return json.load(f)
 
 
-def find_all_soa_tables(node: Dict[str, Any], soa_tables: List[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
-    """Recursively find SOA tables in the JSON structure."""
-    if soa_tables is None:
-        soa_tables = []
-    
-    if isinstance(node, dict):
-        if node.get("name", "").startswith("Table") and "children" in node:
-            for row in node["children"]:
-                if "children" not in row or not row["children"]:
-                    continue
-                first_cell = row["children"][0]
-                if "children" in first_cell and first_cell["children"]:
-                    for p in first_cell["children"]:
-                        if p.get("text") and "Procedure" in p["text"]:
-                            soa_tables.append(node)
-                            break
-        for child in node.get("children", []):
-            find_all_soa_tables(child, soa_tables)
-    elif isinstance(node, list):
-        for item in node:
-            find_all_soa_tables(item, soa_tables)
+def find_all_soa_tables(soa_model: SoAModel, soa_keywords: List[str] = None) -> List[SoATable]:
+    """
+    Find SOA tables: tables with a row whose first cell mentions a procedure keyword.
+    
+    A table is listed once per such row, in document order.
+    """
+    if soa_keywords is None:
+        soa_keywords = ['Procedure']
+    
+    soa_tables = []
+    for table in soa_model.tables:
+        if "children" not in table.node:
+            continue
+        for row in table.direct_rows:
+            if row.lines and any(keyword in text for text in row.lines[0] for keyword in soa_keywords):
+                soa_tables.append(table)
     
     return soa_tables
 
@@ -71,43 +80,34 @@ def normalize_visit_name(v: str, config: Dict[str, Any]) -> Optional[str]:
     return base
 
 
-def extract_visits_and_weeks(tables: List[Dict[str, Any]], config: Dict[str, Any]) -> pd.DataFrame:
+def extract_visits_and_weeks(tables: List[SoATable], config: Dict[str, Any]) -> pd.DataFrame:
     """Extract visits and study weeks from SOA tables."""
     visit_names = []
     study_weeks = []
     
     table_detection = config.get('table_detection', {})
-    soa_keywords = table_detection.get('soa_keywords', ['Procedure'])
     visit_short_name_keywords = table_detection.get('visit_short_name_keywords', ['visit short name'])
     study_week_keywords = table_detection.get('study_week_keywords', ['study week'])
     
     for table in tables:
-        rows = table.get("children", [])
-        for row in rows:
-            if "children" not in row:
-                continue
-            first_cell = row["children"][0]
-            if not first_cell or "children" not in first_cell:
+        for row in table.direct_rows:
+            first_text = row.label.lower()
+            if not first_text:
                 continue
-            first_text = first_cell["children"][0].get("text", "").strip() if first_cell["children"] else ""
             
-            if any(keyword in first_text.lower() for keyword in visit_short_name_keywords):
-                for cell in row["children"][1:]:
-                    if "children" in cell:
-                        for p in cell["children"]:
-                            txt = p.get("text", "").strip()
-                            norm = normalize_visit_name(txt, config)
-                            if norm:  # only keep valid normalized names
-                                visit_names.append(norm)
-            elif any(keyword in first_text.lower() for keyword in study_week_keywords):
-                for cell in row["children"][1:]:
-                    if "children" in cell:
-                        for p in cell["children"]:
-                            txt = p.get("text", "").strip()
-                            try:
-                                study_weeks.append(int(''.join(filter(lambda x: x in '-0123456789', txt))))
-                            except:
-                                study_weeks.append(None)
+            if any(keyword in first_text for keyword in visit_short_name_keywords):
+                for cell_lines in row.lines[1:]:
+                    for txt in cell_lines:
+                        norm = normalize_visit_name(txt.strip(), config)
+                        if norm:  # only keep valid normalized names
+                            visit_names.append(norm)
+            elif any(keyword in first_text for keyword in study_week_keywords):
+                for cell_lines in row.lines[1:]:
+                    for txt in cell_lines:
+                        try:
+                            study_weeks.append(int(''.join(filter(lambda x: x in '-0123456789', txt.strip()))))
+                        except:
+                            study_weeks.append(None)
     
     # Align lengths after filtering
     min_len = min(len(visit_names), len(study_weeks))
@@ -119,84 +119,165 @@ def extract_visits_and_weeks(tables: List[Dict[str, Any]], config: Dict[str, Any
 
 
 def find_element_by_text(data: Dict[str, Any], text_to_find: str) -> Optional[Dict[str, Any]]:
-    """Recursively search the JSON for an element containing specific text."""
-    if isinstance(data, dict):
-        if text_to_find.lower() in data.get('text', '').lower():
-            return data
-        for child in data.get('children', []):
-            found = find_element_by_text(child, text_to_find)
-            if found:
-                return found
-    elif isinstance(data, list):
-        for item in data:
-            found = find_element_by_text(item, text_to_find)
-            if found:
-                return found
+    """Search the JSON (in document order) for the first element containing specific text."""
+    needle = text_to_find.lower()
+    for node, text in iter_text_nodes(data):
+        if needle in text.lower():
+            return node
     return None
 
 
-def extract_extension_week(doc: Dict[str, Any], config: Dict[str, Any]) -> int:
-    """Find the extension start week from the protocol document."""
+def extract_extension_week(doc: Dict[str, Any], config: Dict[str, Any],
+                           text_index: Optional[TextIndex] = None) -> int:
+    """
+    Find the extension start week from the protocol document.
+    
+    The search section's text nodes are scanned lazily and the scan stops at
+    the first pattern match.
+    
+    Args:
+        doc: Protocol document
+        config: Configuration dictionary
+        text_index: Shared text index of doc, reused for the section lookup when given
+        
+    Returns:
+        Extension start week, or infinity when it cannot be determined
+    """
     extension_config = config.get('extension_detection', {})
     search_section = extension_config.get('search_section', 'Study rationale')
     pattern = extension_config.get('pattern', r'(\d+)\s*weeks on treatment')
     case_insensitive = extension_config.get('case_insensitive', True)
     
-    rationale_section = find_element_by_text(doc, search_section)
+    if text_index is not None:
+        rationale_section = text_index.find(search_section)
+    else:
+        rationale_section = find_element_by_text(doc, search_section)
+    
     if rationale_section:
-        full_text = json.dumps(rationale_section)
-        flags = re.IGNORECASE if case_insensitive else 0
-        match = re.search(pattern, full_text, flags)
-        if match:
-            week = int(match.group(1))
-            logging.info(f"Found extension start at {week} weeks.")
-            return week
+        regex = re.compile(pattern, re.IGNORECASE if case_insensitive else 0)
+        texts = text_index.iter_texts(rationale_section) if text_index is not None else iter_texts(rationale_section)
+        for text in texts:
+            match = regex.search(text)
+            if match:
+                week = int(match.group(1))
+                logging.info(f"Found extension start at {week} weeks.")
+                return week
     
     logging.warning("Could not determine extension start week from JSON. Check 'Study rationale' section.")
     return float('inf')  # Return a very large number if not found
 
 
-def get_event_group(row: pd.Series, extension_start_week: int, config: Dict[str, Any]) -> str:
-    """Classify a visit into an Event Group based on configuration rules."""
-    visit_name = row['Visit Name']
-    study_week = row['Study Week']
-    
-    event_groups = config.get('event_groups', {})
-    
-    # Check hardcoded rules first
-    for group_name, group_config in event_groups.items():
-        visit_names = group_config.get('visit_names', [])
-        if visit_name in visit_names:
-            return group_config.get('group_name', group_name.title())
-    
-    # Apply logic-based rules for remaining visits
-    if study_week >= extension_start_week:
-        return 'Extension'
-    else:
-        return 'Main Study'
+def compile_event_group_lookup(config: Dict[str, Any]) -> Dict[str, str]:
+    """
+    Compile the configured event-group rules into a visit name -> group lookup.
 
+    Rules are checked in configuration order, so a visit listed under several
+    groups keeps the first one.
 
-def generate_visits_with_groups(input_protocol_json: str, output_xlsx: str, 
-                               config: Dict[str, Any] = None) -> pd.DataFrame:
-    """Generate visits with event groups, offsets and windows and save to Excel."""
+    Args:
+        config: Configuration dictionary
+
+    Returns:
+        Mapping of visit name to event group name
+    """
+    lookup = {}
+    for group_name, group_config in config.get('event_groups', {}).items():
+        group = group_config.get('group_name', group_name.title())
+        for visit_name in group_config.get('visit_names', []):
+            lookup.setdefault(visit_name, group)
+    return lookup
+
+
+def classify_event_groups(soa_df: pd.DataFrame, extension_start_week: int,
+                          config: Dict[str, Any]) -> pd.Series:
+    """
+    Classify every visit into an Event Group in one pass.
+
+    Visits named in the configured rules take their group from the compiled
+    lookup; the rest are split into Main Study / Extension by study week.
+
+    Args:
+        soa_df: DataFrame with 'Visit Name' and 'Study Week' columns
+        extension_start_week: First study week of the extension period
+        config: Configuration dictionary
+
+    Returns:
+        Series of event group names aligned with soa_df
+    """
+    named = soa_df['Visit Name'].map(compile_event_group_lookup(config))
+    weeks = pd.to_numeric(soa_df['Study Week'], errors='coerce').to_numpy(dtype=float)
+    # NaN weeks compare False, as in the row-wise rule
+    with np.errstate(invalid='ignore'):
+        in_extension = weeks >= extension_start_week
+    
+    groups = np.select(
+        [named.notna().to_numpy(), in_extension],
+        [named.to_numpy(dtype=object), 'Extension'],
+        default='Main Study',
+    )
+    return pd.Series(groups, index=soa_df.index)
+
+
+def compile_offset_expression(expression: str) -> Callable[[pd.Series], pd.Series]:
+    """
+    Compile the configured offset expression (e.g. "study_week * 7").
+
+    Only arithmetic over numeric constants and study_week is accepted; the
+    compiled expression is evaluated over the whole Study Week column.
+
+    Args:
+        expression: Offset expression from visit_windows.offset_calculation
+
+    Returns:
+        Function mapping a Study Week series to offset days
+    """
+    try:
+        tree = ast.parse(expression.strip(), mode='eval')
+    except SyntaxError as e:
+        raise ValueError(f"Invalid offset_calculation expression: {expression!r}") from e
+    
+    for node in ast.walk(tree):
+        if not isinstance(node, _OFFSET_EXPRESSION_NODES):
+            raise ValueError(
+                f"Unsupported element {type(node).__name__} in offset_calculation: {expression!r}"
+            )
+        if isinstance(node, ast.Name) and node.id not in _OFFSET_EXPRESSION_NAMES:
+            raise ValueError(f"Unknown name {node.id!r} in offset_calculation: {expression!r}")
+        if isinstance(node, ast.Constant) and not isinstance(node.value, (int, float)):
+            raise ValueError(f"Non-numeric constant in offset_calculation: {expression!r}")
+    
+    code = compile(tree, '<offset_calculation>', 'eval')
+    
+    def offset_days(study_week: pd.Series) -> pd.Series:
+        return eval(code, {'__builtins__': {}}, {'study_week': study_week})
+    
+    return offset_days
+
+
+def build_visits_with_groups(soa_model: SoAModel, config: Dict[str, Any] = None) -> pd.DataFrame:
+    """
+    Build the visits table with event groups, offsets and windows.
+    
+    Args:
+        soa_model: Table model of the protocol
+        config: Configuration dictionary
+        
+    Returns:
+        DataFrame with the configured output columns
+    """
     if config is None:
         config = {}
     
-    logging.info(f"Generating visits with groups from {input_protocol_json}")
-    
-    doc = load_json(input_protocol_json)
-    
-    soa_tables = find_all_soa_tables(doc)
+    soa_keywords = config.get('table_detection', {}).get('soa_keywords', ['Procedure'])
+    soa_tables = find_all_soa_tables(soa_model, soa_keywords)
     soa_df = extract_visits_and_weeks(soa_tables, config)
     
     # Keep first occurrence only (no duplicates)
     soa_df = soa_df.drop_duplicates(subset=['Visit Name']).reset_index(drop=True)
     
     # Add Event Group Column
-    extension_start_week = extract_extension_week(doc, config)
-    soa_df['Event Group'] = soa_df.apply(
-        lambda row: get_event_group(row, extension_start_week, config), axis=1
-    )
+    extension_start_week = extract_extension_week(soa_model.doc, config, soa_model.text_index)
+    soa_df['Event Group'] = classify_event_groups(soa_df, extension_start_week, config)
     
     # Calculate offset days and visit windows
     visit_windows = config.get('visit_windows', {})
@@ -205,18 +286,16 @@ def generate_visits_with_groups(input_protocol_json: str, output_xlsx: str,
     late_window = visit_windows.get('late_window', 3)
     offset_types = visit_windows.get('offset_types', {})
     
-    soa_df['Offset Days'] = soa_df['Study Week'] * 7
+    soa_df['Offset Days'] = compile_offset_expression(offset_calculation)(soa_df['Study Week'])
     soa_df['Visit Window Start'] = soa_df['Offset Days'] + early_window
     soa_df['Visit Window End'] = soa_df['Offset Days'] + late_window
     
-    # Add Offset Type
-    offset_types_list = []
-    for i, row in soa_df.iterrows():
-        if i == 0:
-            offset_types_list.append(offset_types.get('first_visit', 'Specific: V1 a'))
-        else:
-            offset_types_list.append(offset_types.get('other_visits', 'Previous'))
-    soa_df['Offset Type'] = offset_types_list
+    # Add Offset Type: the first visit is anchored, the rest follow the previous one
+    soa_df['Offset Type'] = np.where(
+        np.arange(len(soa_df)) == 0,
+        offset_types.get('first_visit', 'Specific: V1 a'),
+        offset_types.get('other_visits', 'Previous'),
+    )
     
     # Rename columns first
     column_mapping = {
@@ -233,7 +312,22 @@ def generate_visits_with_groups(input_protocol_json: str, output_xlsx: str,
     
     # Only select columns that exist
     available_columns = [col for col in output_columns if col in soa_df.columns]
-    final_df = soa_df[available_columns].copy()
+    return soa_df[available_columns].copy()
+
+
+def generate_visits_with_groups(input_protocol_json: str, output_xlsx: str, 
+                               config: Dict[str, Any] = None,
+                               soa_model: Optional[SoAModel] = None) -> pd.DataFrame:
+    """Generate visits with event groups, offsets and windows and save to Excel."""
+    if config is None:
+        config = {}
+    
+    logging.info(f"Generating visits with groups from {input_protocol_json}")
+    
+    if soa_model is None:
+        soa_model = load_soa_model(input_protocol_json)
+    
+    final_df = build_visits_with_groups(soa_model, config)
     
     # Save to Excel
     final_df.to_excel(output_xlsx, index=False)
@@ -242,7 +336,8 @@ def generate_visits_with_groups(input_protocol_json: str, output_xlsx: str,
     return final_df
 
 
-def group_events(protocol_json: str, output_xlsx: str, config: Dict[str, Any] = None) -> str:
+def group_events(protocol_json: str, output_xlsx: str, config: Dict[str, Any] = None,
+                 soa_model: Optional[SoAModel] = None) -> str:
     """
     Group events and create visit windows from protocol JSON.
     
@@ -250,6 +345,7 @@ def group_events(protocol_json: str, output_xlsx: str, config: Dict[str, Any] =
         protocol_json: Path to protocol JSON file
         output_xlsx: Path to output Excel file
         config: Configuration dictionary
+        soa_model: Table model of protocol_json, when the caller has already built one
         
     Returns:
         Path to output Excel file
@@ -260,7 +356,7 @@ def group_events(protocol_json: str, output_xlsx: str, config: Dict[str, Any] =
     logging.info(f"Grouping events from {protocol_json}")
     
     try:
-        final_df = generate_visits_with_groups(protocol_json, output_xlsx, config)
+        final_df = generate_visits_with_groups(protocol_json, output_xlsx, config, soa_model)
         return output_xlsx
     except Exception as e:
         logging.error(f"Error grouping events: {e}")
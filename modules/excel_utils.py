@@ -0,0 +1,136 @@
+"""
+Excel Utilities Module
+
+Shared helpers for the Excel writers (schedule grid layout, study specific
+forms and the combined PTD workbook).
+"""
+
+from copy import copy
+from typing import Any, Dict, Iterable, Optional, Sequence, Tuple
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Border, Font, NamedStyle, PatternFill
+from openpyxl.styles.borders import DEFAULT_BORDER
+from openpyxl.styles.fills import DEFAULT_EMPTY_FILL
+from openpyxl.styles.fonts import DEFAULT_FONT
+from openpyxl.utils import get_column_letter
+from openpyxl.worksheet.cell_range import CellRange
+
+
+class ColumnWidthTracker:
+    """
+    Track the maximum display length of each column while cells are written.
+
+    Writers call observe() / observe_row() with every value they write and
+    apply() once at the end, so auto-fit needs no extra pass over the sheet.
+    """
+
+    def __init__(self):
+        self.max_lengths: Dict[int, int] = {}
+        self.max_column = 0
+
+    def observe(self, column: int, value: Any) -> None:
+        """Record a value written to the given (1-based) column."""
+        if column > self.max_column:
+            self.max_column = column
+        if value is None:
+            return
+        length = len(str(value))
+        if length > self.max_lengths.get(column, 0):
+            self.max_lengths[column] = length
+
+    def observe_row(self, values: Iterable[Any], start_column: int = 1) -> None:
+        """Record a row of values written from start_column onwards."""
+        for column, value in enumerate(values, start=start_column):
+            self.observe(column, value)
+
+    def observe_column(self, column: int, values: Iterable[Any]) -> None:
+        """Record every value of one column at once (e.g. before streaming rows)."""
+        if column > self.max_column:
+            self.max_column = column
+        longest = max((len(str(value)) for value in values if value is not None), default=None)
+        if longest is not None and longest > self.max_lengths.get(column, 0):
+            self.max_lengths[column] = longest
+
+    def width(self, column: int, min_width: float = 10, max_width: Optional[float] = None,
+              padding: float = 2) -> float:
+        """Return the fitted width for a column."""
+        width = self.max_lengths.get(column, 0) + padding
+        if max_width is not None:
+            width = min(max_width, width)
+        return max(min_width, width)
+
+    def apply(self, ws, min_width: float = 10, max_width: Optional[float] = None,
+              padding: float = 2, max_column: Optional[int] = None) -> None:
+        """
+        Set column widths on a worksheet.
+
+        Args:
+            ws: Worksheet to update
+            min_width: Lower bound for every column
+            max_width: Optional upper bound
+            padding: Characters added to the longest value
+            max_column: Last column to size (defaults to the last observed column)
+        """
+        last_column = max_column if max_column is not None else self.max_column
+        for column in range(1, last_column + 1):
+            ws.column_dimensions[get_column_letter(column)].width = self.width(
+                column, min_width, max_width, padding
+            )
+
+
+# ------------------ cell-style templates and row emission ------------------
+
+def cell_style(name: str, font: Optional[Font] = None, alignment: Optional[Alignment] = None,
+               fill: Optional[PatternFill] = None, border: Optional[Border] = None,
+               number_format: Optional[str] = None) -> NamedStyle:
+    """
+    Build a named cell-style template.
+
+    Parts that are not given keep the workbook defaults, so a template that
+    only sets an alignment renders exactly like a cell that only had its
+    alignment assigned.
+    """
+    return NamedStyle(
+        name=name,
+        font=font or copy(DEFAULT_FONT),
+        alignment=alignment or Alignment(),
+        fill=fill or copy(DEFAULT_EMPTY_FILL),
+        border=border or copy(DEFAULT_BORDER),
+        number_format=number_format,
+    )
+
+
+def register_styles(wb, styles: Iterable[NamedStyle]) -> None:
+    """Register style templates with a workbook so cells can refer to them by name."""
+    existing = set(wb.named_styles)
+    for style in styles:
+        if style.name not in existing:
+            wb.add_named_style(style)
+            existing.add(style.name)
+
+
+def styled_cell(ws, value: Any, style: Optional[str] = None):
+    """Create a detached cell for ws.append() with a registered style template applied."""
+    cell = WriteOnlyCell(ws, value=value)
+    if style is not None:
+        cell.style = style
+    return cell
+
+
+def append_row(ws, entries: Sequence[Optional[Tuple[Any, Optional[str]]]]) -> None:
+    """
+    Append one row of (value, style name) entries; None leaves the cell unwritten.
+
+    Works for regular and write-only (streaming) worksheets alike.
+    """
+    ws.append([None if entry is None else styled_cell(ws, entry[0], entry[1]) for entry in entries])
+
+
+def merge_range(ws, start_row: int, start_column: int, end_row: int, end_column: int) -> None:
+    """Merge a cell range on a regular or write-only worksheet."""
+    if ws.parent.write_only:
+        ws.merged_cells.add(CellRange(min_col=start_column, min_row=start_row,
+                                      max_col=end_column, max_row=end_row))
+    else:
+        ws.merge_cells(start_row=start_row, start_column=start_column,
+                       end_row=end_row, end_column=end_column)
@@ -9,6 +9,8 @@ import json
 import csv
 import re
 import logging
+import numpy as np
+import pandas as pd
 from typing import Dict, List, Any, Optional, Set, Tuple
 
 
@@ -423,6 +425,35 @@ def extract_forms_with_corrections(data: Dict[str, Any], config: Dict[str, Any])
     return results
 
 
+def forms_output_columns(config: Dict[str, Any]) -> List[str]:
+    """Columns of the extracted forms table, in output order."""
+    return config.get('required_keys', [
+        "Form Label", "Form Name", "Source", "Visits", 
+        "Dynamic Trigger", "Trigger Details", "Required"
+    ])
+
+
+def build_forms_table(data: Dict[str, Any], config: Dict[str, Any] = None) -> pd.DataFrame:
+    """
+    Extract forms from a parsed eCRF document into a table.
+    
+    Empty values are NaN, as when the stage's CSV output is read back.
+    
+    Args:
+        data: Parsed eCRF JSON
+        config: Configuration dictionary
+        
+    Returns:
+        DataFrame with one row per form
+    """
+    if config is None:
+        config = {}
+    
+    extracted_forms = extract_forms_with_corrections(data, config)
+    df = pd.DataFrame(extracted_forms, columns=forms_output_columns(config))
+    return df.replace("", np.nan)
+
+
 def extract_forms(ecrf_json: str, output_csv: str, config: Dict[str, Any] = None) -> str:
     """
     Extract forms from eCRF JSON and save to CSV.
@@ -448,10 +479,7 @@ def extract_forms(ecrf_json: str, output_csv: str, config: Dict[str, Any] = None
         
         # Write to CSV
         with open(output_csv, 'w', newline='', encoding='utf-8-sig') as csvfile:
-            fieldnames = config.get('required_keys', [
-                "Form Label", "Form Name", "Source", "Visits", 
-                "Dynamic Trigger", "Trigger Details", "Required"
-            ])
+            fieldnames = forms_output_columns(config)
             writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
             writer.writeheader()
             for row in extracted_forms:
@@ -0,0 +1,344 @@
+"""
+Instrumentation Module
+
+Opt-in hot-path counters and per-stage profiler hooks, for finding out why a
+given study is slow.
+
+Counters: enable_counters() swaps counting wrappers into the pipeline modules
+(traversal functions, each module's `re` and module-level compiled patterns,
+the fuzzy matcher and the sheet writers), and disable_counters() puts the
+originals back. Nothing is wrapped
+while counters are off, so the disabled cost is zero. Counts are grouped as:
+- nodes_visited       per traversal function (calls of recursive walkers, items of lazy walks)
+- regex_evaluations   per pattern
+- fuzzy_comparisons   per matcher
+- cells_written       per writer
+
+Profiler: with enable_profiler(), each pipeline stage runs under cProfile
+(<stage>.pstats) or a sampling profiler (<stage>.collapsed, collapsed stacks
+for flamegraph.pl / speedscope). Disabled, a stage pays one None check.
+"""
+
+import cProfile
+import functools
+import importlib
+import logging
+import os
+import re
+import sys
+import threading
+import types
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+COUNTER_GROUPS = ("nodes_visited", "regex_evaluations", "fuzzy_comparisons", "cells_written")
+PROFILERS = ("cprofile", "sampling")
+DEFAULT_SAMPLE_INTERVAL = 0.005
+
+FORMS_ENGINE = "Final_study_specific_form"
+
+# Modules whose `re` (and module-level compiled patterns) are replaced by counting shims
+REGEX_MODULES = ("form_extractor", "soa_parser", "event_grouping", "schedule_layout", "sheet_splice", FORMS_ENGINE)
+
+# (module, function or Class.method, counter group, what one call counts)
+COUNTED_FUNCTIONS = [
+    ("text_index", "iter_text_nodes", "nodes_visited", "yields"),
+    ("text_index", "iter_texts", "nodes_visited", "yields"),
+    ("text_index", "TextIndex._build", "nodes_visited", "indexed"),
+    ("text_index", "TextIndex.iter_nodes", "nodes_visited", "yields"),
+    ("text_index", "TextIndex.iter_texts", "nodes_visited", "yields"),
+    ("form_extractor", "get_text", "nodes_visited", "calls"),
+    ("form_extractor", "deep_search_visits", "nodes_visited", "calls"),
+    ("form_extractor", "deep_search_triggers", "nodes_visited", "calls"),
+    (FORMS_ENGINE, "get_text", "nodes_visited", "calls"),
+    (FORMS_ENGINE, "find_nodes_by_name_pattern", "nodes_visited", "calls"),
+    ("common_matrix", "fuzzy_match", "fuzzy_comparisons", "calls"),
+    ("xlsx_writer", "SheetWriter.append", "cells_written", "row_entries"),
+    ("xlsx_writer", "SheetWriter.append_values", "cells_written", "row_values"),
+    ("ptd_workbook", "_copy_worksheet_contents", "cells_written", "destination_cells"),
+]
+
+_counts: Dict[str, Counter] = {group: Counter() for group in COUNTER_GROUPS}
+# (owner, attribute, original) of every installed wrapper, for disable_counters()
+_patches: List[Tuple[Any, str, Any]] = []
+_profiler: Optional[Dict[str, Any]] = None
+
+
+def _bump(group: str, key: str, amount: int = 1) -> None:
+    _counts[group][key] += amount
+
+
+def _pattern_key(pattern: Any) -> str:
+    if isinstance(pattern, re.Pattern):
+        pattern = pattern.pattern
+    return pattern if isinstance(pattern, str) else str(pattern)
+
+
+_REGEX_FUNCTIONS = ("search", "match", "fullmatch", "findall", "finditer", "sub", "subn", "split")
+
+
+class _CountingPattern:
+    """Compiled pattern whose matching methods count one evaluation per call."""
+
+    def __init__(self, pattern: re.Pattern):
+        self._pattern = pattern
+        self._key = _pattern_key(pattern)
+
+    def __getattr__(self, name: str) -> Any:
+        attribute = getattr(self._pattern, name)
+        if name in _REGEX_FUNCTIONS:
+            _bump("regex_evaluations", self._key)
+        return attribute
+
+
+class _CountingRe:
+    """Stand-in for a module's `re`: counts each evaluation by pattern, delegates everything else."""
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(re, name)
+
+    @staticmethod
+    def compile(pattern: Any, flags: int = 0) -> _CountingPattern:
+        if isinstance(pattern, _CountingPattern):
+            pattern = pattern._pattern
+        return _CountingPattern(re.compile(pattern, flags))
+
+
+def _counting_re_function(name: str) -> Callable[..., Any]:
+    function = getattr(re, name)
+
+    def counted(pattern: Any, *args: Any, **kwargs: Any) -> Any:
+        if isinstance(pattern, _CountingPattern):
+            pattern = pattern._pattern
+        _bump("regex_evaluations", _pattern_key(pattern))
+        return function(pattern, *args, **kwargs)
+
+    return staticmethod(counted)
+
+
+for _name in _REGEX_FUNCTIONS:
+    setattr(_CountingRe, _name, _counting_re_function(_name))
+
+
+def _counting_wrapper(function: Callable[..., Any], group: str, key: str, kind: str) -> Callable[..., Any]:
+    """Wrap function so each call adds to _counts[group][key] (see COUNTED_FUNCTIONS)."""
+    if kind == "yields":
+        @functools.wraps(function)
+        def counted(*args: Any, **kwargs: Any) -> Iterator[Any]:
+            for item in function(*args, **kwargs):
+                _counts[group][key] += 1
+                yield item
+    elif kind == "destination_cells":
+        @functools.wraps(function)
+        def counted(src_ws: Any, dest_ws: Any) -> Any:
+            # Count the destination's cell() calls that write a value, i.e. the cells
+            # actually written (merging looks up anchor cells through cell() too)
+            cell = dest_ws.cell
+
+            def counting_cell(*args: Any, **kwargs: Any) -> Any:
+                if "value" in kwargs or len(args) > 2:
+                    _counts[group][key] += 1
+                return cell(*args, **kwargs)
+
+            dest_ws.cell = counting_cell
+            try:
+                return function(src_ws, dest_ws)
+            finally:
+                del dest_ws.cell
+    elif kind == "row_values":
+        @functools.wraps(function)
+        def counted(writer: Any, values: Any) -> Any:
+            values = list(values)
+            _counts[group][key] += len(values)
+            return function(writer, values)
+    else:
+        @functools.wraps(function)
+        def counted(*args: Any, **kwargs: Any) -> Any:
+            result = function(*args, **kwargs)
+            if kind == "calls":
+                amount = 1
+            elif kind == "indexed":
+                amount = len(args[0])
+            else:
+                # row_entries
+                amount = sum(1 for entry in args[1] if entry is not None)
+            _counts[group][key] += amount
+            return result
+    return counted
+
+
+def _module(name: str) -> Any:
+    if name == FORMS_ENGINE:
+        from .pipeline import load_forms_engine
+        return load_forms_engine()
+    return importlib.import_module(f".{name}", __package__)
+
+
+def _patch(owner: Any, attribute: str, replacement: Any) -> None:
+    _patches.append((owner, attribute, owner.__dict__[attribute]))
+    setattr(owner, attribute, replacement)
+
+
+def counters_enabled() -> bool:
+    return bool(_patches)
+
+
+def enable_counters() -> None:
+    """Install the counting wrappers (see COUNTED_FUNCTIONS and REGEX_MODULES)."""
+    if _patches:
+        return
+    modules = {name: _module(name) for name in
+               {name for name, _, _, _ in COUNTED_FUNCTIONS} | set(REGEX_MODULES)}
+    for module_name, attribute, group, kind in COUNTED_FUNCTIONS:
+        owner = modules[module_name]
+        if "." in attribute:
+            class_name, attribute = attribute.split(".")
+            owner = getattr(owner, class_name)
+            key = f"{module_name}.{class_name}.{attribute}"
+        else:
+            key = f"{module_name}.{attribute}"
+        original = owner.__dict__[attribute]
+        wrapper = _counting_wrapper(original, group, key, kind)
+        _patch(owner, attribute, wrapper)
+        # Modules that imported the function by name hold their own reference
+        if isinstance(owner, types.ModuleType):
+            for module in modules.values():
+                for name, value in list(vars(module).items()):
+                    if value is original and module is not owner:
+                        _patch(module, name, wrapper)
+    shim = _CountingRe()
+    for module_name in REGEX_MODULES:
+        module = modules[module_name]
+        _patch(module, "re", shim)
+        # Patterns compiled at import time (e.g. sheet_splice's per-cell patterns)
+        for name, value in list(vars(module).items()):
+            if isinstance(value, re.Pattern):
+                _patch(module, name, _CountingPattern(value))
+    logging.info("Hot-path counters enabled")
+
+
+def disable_counters() -> None:
+    """Restore the original functions; the counts are kept until reset_counters()."""
+    while _patches:
+        owner, attribute, original = _patches.pop()
+        setattr(owner, attribute, original)
+
+
+def reset_counters() -> None:
+    for counts in _counts.values():
+        counts.clear()
+
+
+def counter_snapshot() -> Dict[str, Dict[str, int]]:
+    """Current counts by group and key."""
+    return {group: dict(counts) for group, counts in _counts.items()}
+
+
+def counters_since(before: Dict[str, Dict[str, int]]) -> Dict[str, Dict[str, int]]:
+    """Counts added since an earlier counter_snapshot(), leaving out empty groups."""
+    delta = {}
+    for group, counts in _counts.items():
+        changed = {key: count - before.get(group, {}).get(key, 0) for key, count in counts.items()
+                   if count != before.get(group, {}).get(key, 0)}
+        if changed:
+            delta[group] = dict(sorted(changed.items(), key=lambda item: -item[1]))
+    return delta
+
+
+def format_counters(counters: Dict[str, Dict[str, int]], top: int = 10) -> str:
+    """Readable report of the largest counts in each group."""
+    lines = []
+    for group in COUNTER_GROUPS:
+        counts = counters.get(group, {})
+        if not counts:
+            continue
+        lines.append(f"{group}: {sum(counts.values())}")
+        for key, count in sorted(counts.items(), key=lambda item: -item[1])[:top]:
+            label = key if len(key) <= 70 else key[:67] + "..."
+            lines.append(f"  {count:>12}  {label}")
+        if len(counts) > top:
+            lines.append(f"  {'':>12}  ... {len(counts) - top} more")
+    return "\n".join(lines)
+
+
+class _StackSampler(threading.Thread):
+    """Samples one thread's Python stack every interval seconds into collapsed-stack counts."""
+
+    def __init__(self, thread_id: int, interval: float):
+        super().__init__(name="ptd-stack-sampler", daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self._stopped = threading.Event()
+
+    def run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            frames = []
+            while frame is not None:
+                code = frame.f_code
+                frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if frames:
+                self.stacks[";".join(reversed(frames))] += 1
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self.join()
+
+
+def enable_profiler(kind: str, directory: str, interval: float = DEFAULT_SAMPLE_INTERVAL) -> None:
+    """
+    Profile every following pipeline stage.
+
+    Args:
+        kind: "cprofile" (deterministic, <stage>.pstats) or "sampling" (<stage>.collapsed)
+        directory: Where the per-stage profiles are written
+        interval: Sampling interval in seconds (sampling only)
+    """
+    global _profiler
+    if kind not in PROFILERS:
+        raise ValueError(f"Unknown profiler '{kind}' (choose from {', '.join(PROFILERS)})")
+    Path(directory).mkdir(parents=True, exist_ok=True)
+    _profiler = {"kind": kind, "directory": directory, "interval": interval, "active": False}
+
+
+def disable_profiler() -> None:
+    global _profiler
+    _profiler = None
+
+
+@contextmanager
+def profile_stage(name: str) -> Iterator[None]:
+    """Profile the block as stage name when a profiler is enabled (nested stages are not profiled separately)."""
+    settings = _profiler
+    if settings is None or settings["active"]:
+        yield
+        return
+    settings["active"] = True
+    try:
+        if settings["kind"] == "cprofile":
+            profile = cProfile.Profile()
+            profile.enable()
+            try:
+                yield
+            finally:
+                profile.disable()
+                path = os.path.join(settings["directory"], f"{name}.pstats")
+                profile.dump_stats(path)
+        else:
+            sampler = _StackSampler(threading.get_ident(), settings["interval"])
+            sampler.start()
+            try:
+                yield
+            finally:
+                sampler.stop()
+                path = os.path.join(settings["directory"], f"{name}.collapsed")
+                with open(path, "w", encoding="utf-8") as f:
+                    for stack, count in sampler.stacks.most_common():
+                        f.write(f"{stack} {count}\n")
+        logging.info(f"Profile of stage '{name}' written to {path}")
+    finally:
+        settings["active"] = False
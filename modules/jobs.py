@@ -0,0 +1,266 @@
+"""
+Jobs Module
+
+Asynchronous PTD job runner. Each job runs the pipeline (generate_ptd and the
+workbook write) in an executor worker, by default a separate process: the
+stages are CPU-bound and share module-level state. At most max_concurrency jobs
+run at a time, and every job reports structured progress events back to the
+event loop.
+
+Events are dicts with "job", "time" and "event":
+- queued / started                     job lifecycle
+- stage_start / stage_end              per pipeline stage ("stage", timings and counts)
+- forms / items_written                "done" out of "total" forms built / item rows written
+- done / failed / cancelled            terminal; "output" / "error"
+"""
+
+import asyncio
+import itertools
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from .pipeline import generate_ptd
+
+TERMINAL_EVENTS = ("done", "failed", "cancelled")
+
+
+class JobCancelled(Exception):
+    """Raised when a job is cancelled, inside the worker and by Job.result()."""
+
+
+def run_ptd_job(job: Dict[str, Any], progress=None) -> Dict[str, Any]:
+    """
+    Run one PTD job synchronously.
+
+    Args:
+        job: Dict with protocol, ecrf and out, and optionally template, config_dir,
+             forms_cache, items_out, fast, splice and xlsx_backend
+        progress: Callback receiving the pipeline's progress events
+
+    Returns:
+        Dict with the written "output" path and the per-stage "metrics"
+    """
+    result = generate_ptd(job["protocol"], job["ecrf"], template=job.get("template"),
+                          config_dir=job.get("config_dir"), forms_cache=job.get("forms_cache"),
+                          progress=progress)
+    if job.get("items_out"):
+        result.write_item_table(job["items_out"])
+    output = result.write_xlsx(job["out"], fast=bool(job.get("fast")), splice=bool(job.get("splice")),
+                               backend=job.get("xlsx_backend"), progress=progress)
+    return {"output": os.path.abspath(output), "metrics": result.metrics}
+
+
+def _run_in_worker(job_id: int, job: Dict[str, Any], events, cancelled) -> Dict[str, Any]:
+    """Executor entry point: run the job, forwarding events and stopping once cancelled is set."""
+    def progress(event: Dict[str, Any]) -> None:
+        # Progress reports double as cancellation checkpoints
+        if cancelled.is_set():
+            raise JobCancelled(f"Job {job_id} cancelled")
+        events.put({"job": job_id, "time": time.time(), **event})
+
+    return run_ptd_job(job, progress)
+
+
+class Job:
+    """
+    Handle of a submitted job.
+
+    Attributes:
+        id: Job number within its runner
+        spec: The job dict
+        status: queued, running, done, failed or cancelled
+        history: Every event reported so far
+    """
+
+    def __init__(self, job_id: int, spec: Dict[str, Any], cancelled):
+        self.id = job_id
+        self.spec = spec
+        self.status = "queued"
+        self.history: List[Dict[str, Any]] = []
+        self._cancelled = cancelled
+        self._events: asyncio.Queue = asyncio.Queue()
+        self._finished = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._result: Optional[Dict[str, Any]] = None
+        self._error: Optional[BaseException] = None
+
+    def cancel(self) -> None:
+        """Cancel the job: queued jobs never start, running ones stop at their next progress report."""
+        if self.status in TERMINAL_EVENTS:
+            return
+        self._cancelled.set()
+        if self.status == "queued" and self._task is not None:
+            self._task.cancel()
+
+    async def events(self) -> AsyncIterator[Dict[str, Any]]:
+        """Yield the job's events as they arrive, ending after the terminal event."""
+        while True:
+            event = await self._events.get()
+            yield event
+            if event["event"] in TERMINAL_EVENTS:
+                return
+
+    async def result(self) -> Dict[str, Any]:
+        """
+        Wait for the job to finish.
+
+        Returns:
+            Dict with the written "output" path and the per-stage "metrics"
+
+        Raises:
+            JobCancelled if the job was cancelled, or the job's own exception if it failed
+        """
+        await self._finished.wait()
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+    def _dispatch(self, event: Dict[str, Any]) -> None:
+        self.history.append(event)
+        self._events.put_nowait(event)
+        if event["event"] in TERMINAL_EVENTS:
+            self._finished.set()
+
+
+class AsyncJobRunner:
+    """
+    Runs PTD jobs concurrently on an executor, at most max_concurrency at once.
+
+    Use as an async context manager:
+
+        async with AsyncJobRunner(max_concurrency=2) as runner:
+            job = runner.submit({"protocol": ..., "ecrf": ..., "template": ..., "out": ...})
+            async for event in job.events():
+                ...
+            result = await job.result()
+    """
+
+    def __init__(self, max_concurrency: int = 2, executor: Optional[Executor] = None):
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency must be at least 1")
+        self.max_concurrency = max_concurrency
+        self._executor = executor
+        self._own_executor = executor is None
+        self._manager = None
+        self._queue = None
+        self._relay: Optional[threading.Thread] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._jobs: Dict[int, Job] = {}
+        self._ids = itertools.count(1)
+
+    async def __aenter__(self) -> "AsyncJobRunner":
+        self.start()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    def start(self) -> None:
+        """Start the executor and the event relay; called by async with."""
+        if self._loop is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_concurrency)
+        # Workers report through a manager queue; one thread hands events to the loop in order
+        self._manager = multiprocessing.Manager()
+        self._queue = self._manager.Queue()
+        self._relay = threading.Thread(target=self._relay_events, name="ptd-job-events", daemon=True)
+        self._relay.start()
+
+    def submit(self, job: Dict[str, Any]) -> Job:
+        """
+        Queue a job; it starts once fewer than max_concurrency jobs are running.
+
+        Args:
+            job: Dict with protocol, ecrf and out, and optionally template, config_dir,
+                 forms_cache, items_out, fast, splice and xlsx_backend
+
+        Returns:
+            Job handle for its events, result and cancellation
+        """
+        if self._loop is None:
+            raise RuntimeError("AsyncJobRunner is not started")
+        for key in ("protocol", "ecrf", "out"):
+            if not job.get(key):
+                raise ValueError(f"Job is missing '{key}'")
+        handle = Job(next(self._ids), dict(job), self._manager.Event())
+        self._jobs[handle.id] = handle
+        self._report(handle, {"event": "queued"})
+        handle._task = self._loop.create_task(self._run(handle))
+        handle._task.add_done_callback(lambda task: self._task_done(handle, task))
+        return handle
+
+    async def close(self) -> None:
+        """Cancel unfinished jobs, wait for running ones to stop and shut the executor down."""
+        if self._loop is None:
+            return
+        for job in self._jobs.values():
+            job.cancel()
+        tasks = [job._task for job in self._jobs.values() if job._task is not None]
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await asyncio.gather(*(job._finished.wait() for job in self._jobs.values()))
+        self._queue.put(None)
+        await self._loop.run_in_executor(None, self._relay.join)
+        if self._own_executor:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        self._manager.shutdown()
+        self._loop = None
+
+    async def _run(self, job: Job) -> None:
+        try:
+            async with self._semaphore:
+                job.status = "running"
+                self._report(job, {"event": "started"})
+                future = self._loop.run_in_executor(self._executor, _run_in_worker,
+                                                    job.id, job.spec, self._queue, job._cancelled)
+                try:
+                    result = await asyncio.shield(future)
+                except asyncio.CancelledError:
+                    # Keep the slot until the worker has actually stopped
+                    job._cancelled.set()
+                    await asyncio.wait([future])
+                    raise
+        except (asyncio.CancelledError, JobCancelled):
+            self._cancelled(job)
+        except Exception as e:
+            job.status = "failed"
+            job._error = e
+            logging.error(f"PTD job {job.id} failed: {type(e).__name__}: {e}")
+            self._report(job, {"event": "failed", "error": f"{type(e).__name__}: {e}"})
+        else:
+            job.status = "done"
+            job._result = result
+            logging.info(f"PTD job {job.id} written to {result['output']}")
+            self._report(job, {"event": "done", "output": result["output"]})
+
+    def _task_done(self, job: Job, task: asyncio.Task) -> None:
+        # A task cancelled before its first step never enters _run's handlers
+        if task.cancelled() and job.status not in TERMINAL_EVENTS:
+            self._cancelled(job)
+
+    def _cancelled(self, job: Job) -> None:
+        job.status = "cancelled"
+        job._error = JobCancelled(f"Job {job.id} cancelled")
+        self._report(job, {"event": "cancelled"})
+
+    def _report(self, job: Job, event: Dict[str, Any]) -> None:
+        # Through the same queue as worker events, so each job's events stay in order
+        self._queue.put({"job": job.id, "time": time.time(), **event})
+
+    def _relay_events(self) -> None:
+        while True:
+            event = self._queue.get()
+            if event is None:
+                return
+            job = self._jobs.get(event["job"])
+            if job is not None:
+                self._loop.call_soon_threadsafe(job._dispatch, event)
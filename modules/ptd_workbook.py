@@ -0,0 +1,160 @@
+"""
+PTD Workbook Module
+
+Puts the generated Schedule Grid and Study Specific Forms sheets into the
+PTD template workbook: a full copy with styles, merges and dimensions, or
+(fast) the generated sheets spliced into the template package as written.
+"""
+
+import os
+from pathlib import Path
+from openpyxl import load_workbook
+from openpyxl.worksheet.worksheet import Worksheet
+from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
+from openpyxl.cell.cell import MergedCell
+
+from .sheet_splice import splice_sheets
+
+
+def ensure_output_dir(output_path: str) -> None:
+    out_dir = os.path.dirname(output_path)
+    if out_dir:
+        Path(out_dir).mkdir(parents=True, exist_ok=True)
+
+
+def _copy_worksheet_contents(src_ws: Worksheet, dest_ws: Worksheet) -> None:
+    """Copy values, styles, merged cells, dimensions and freeze panes from src_ws to dest_ws."""
+    # Copy column widths
+    for col_letter, dim in src_ws.column_dimensions.items():
+        if getattr(dim, 'width', None):
+            dest_ws.column_dimensions[col_letter].width = dim.width
+
+    # Copy row heights
+    for idx, dim in src_ws.row_dimensions.items():
+        if getattr(dim, 'height', None):
+            dest_ws.row_dimensions[idx].height = dim.height
+
+    dest_ws.freeze_panes = src_ws.freeze_panes
+
+    # Copy merged ranges first (structure)
+    for merged_range in src_ws.merged_cells.ranges:
+        dest_ws.merge_cells(str(merged_range))
+
+    # Copy cell contents and styles
+    for row in src_ws.iter_rows():
+        for cell in row:
+            # Skip non-top-left merged cells; the range has already been created
+            if isinstance(cell, MergedCell):
+                continue
+            dcell = dest_ws.cell(row=cell.row, column=cell.column, value=cell.value)
+            if cell.has_style:
+                if cell.font:
+                    dcell.font = Font(
+                        name=cell.font.name,
+                        size=cell.font.size,
+                        bold=cell.font.bold,
+                        italic=cell.font.italic,
+                        vertAlign=cell.font.vertAlign,
+                        underline=cell.font.underline,
+                        strike=cell.font.strike,
+                        color=cell.font.color,
+                    )
+                if cell.alignment:
+                    dcell.alignment = Alignment(
+                        horizontal=cell.alignment.horizontal,
+                        vertical=cell.alignment.vertical,
+                        text_rotation=cell.alignment.text_rotation,
+                        wrap_text=cell.alignment.wrap_text,
+                        shrink_to_fit=cell.alignment.shrink_to_fit,
+                        indent=cell.alignment.indent,
+                    )
+                if cell.fill and cell.fill.fill_type:
+                    dcell.fill = PatternFill(
+                        fill_type=cell.fill.fill_type,
+                        start_color=cell.fill.start_color,
+                        end_color=cell.fill.end_color,
+                    )
+                if cell.border:
+                    left = cell.border.left
+                    right = cell.border.right
+                    top = cell.border.top
+                    bottom = cell.border.bottom
+                    dcell.border = Border(
+                        left=Side(style=left.style, color=left.color),
+                        right=Side(style=right.style, color=right.color),
+                        top=Side(style=top.style, color=top.color),
+                        bottom=Side(style=bottom.style, color=bottom.color),
+                    )
+                if cell.number_format:
+                    dcell.number_format = cell.number_format
+
+
+def replace_sheets_in_template(
+    template_xlsx: str,
+    schedule_xlsx: str,
+    forms_xlsx: str,
+    out_xlsx: str,
+    schedule_sheet_name: str = "Schedule Grid",
+    forms_sheet_name: str = "Study Specific Forms",
+    fast: bool = False,
+) -> str:
+    """
+    Load the template workbook, remove existing target sheets if present, copy
+    the generated schedule and forms worksheets (including styles, merges, and
+    dimensions) into the template, preserve all other sheets, and save to out_xlsx.
+    Returns the absolute path to the saved workbook.
+
+    With fast=True nothing is loaded: the generated sheets are spliced into the
+    template package as written (write them with the streaming backend to keep
+    memory bounded end to end).
+    """
+    ensure_output_dir(out_xlsx)
+
+    if fast:
+        return splice_sheets(template_xlsx, {schedule_sheet_name: schedule_xlsx,
+                                             forms_sheet_name: forms_xlsx}, out_xlsx)
+
+    wb_template = load_workbook(template_xlsx)
+    wb_schedule = load_workbook(schedule_xlsx)
+    wb_forms = load_workbook(forms_xlsx)
+
+    try:
+        # Record both template positions before removing anything, so the
+        # replaced sheets keep the template order (as --splice does)
+        positions = {name: wb_template.sheetnames.index(name)
+                     for name in (schedule_sheet_name, forms_sheet_name) if name in wb_template.sheetnames}
+        for name in positions:
+            wb_template.remove(wb_template[name])
+
+        # Re-create the sheets at their recorded positions, lowest first; new sheets are appended
+        dest = {}
+        for name, index in sorted(positions.items(), key=lambda item: item[1]):
+            dest[name] = wb_template.create_sheet(title=name, index=index)
+        for name in (schedule_sheet_name, forms_sheet_name):
+            if name not in dest:
+                dest[name] = wb_template.create_sheet(title=name)
+        dest_schedule, dest_forms = dest[schedule_sheet_name], dest[forms_sheet_name]
+
+        # Source sheets (first worksheet in each generated file)
+        src_schedule: Worksheet = wb_schedule.worksheets[0]
+        src_forms: Worksheet = wb_forms.worksheets[0]
+
+        # Copy contents
+        _copy_worksheet_contents(src_schedule, dest_schedule)
+        _copy_worksheet_contents(src_forms, dest_forms)
+
+        wb_template.save(out_xlsx)
+        return os.path.abspath(out_xlsx)
+    finally:
+        try:
+            wb_schedule.close()
+        except Exception:
+            pass
+        try:
+            wb_forms.close()
+        except Exception:
+            pass
+        try:
+            wb_template.close()
+        except Exception:
+            pass
@@ -8,12 +8,14 @@ creating a comprehensive Excel output for clinical trial planning.
 import re
 import logging
 import pandas as pd
+import numpy as np
 import math
 import os
-from openpyxl import Workbook
-from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
-from openpyxl.utils import get_column_letter
-from typing import Dict, Any, List, Optional
+from openpyxl.styles import Font, Alignment, PatternFill, Border, Side, NamedStyle
+from typing import Dict, Any, List, Optional, Tuple
+
+from .excel_utils import ColumnWidthTracker, cell_style
+from .xlsx_writer import SheetLayout
 
 
 def make_event_name(group: str, label: str, idx: int, config: Dict[str, Any]) -> str:
@@ -46,22 +48,72 @@ def make_event_name(group: str, label: str, idx: int, config: Dict[str, Any]) ->
     return f"V{idx + 1}"
 
 
-def build_schedule_layout(visit_schedule_xlsx: str, forms_csv: str, output_xlsx: str, 
-                         config: Dict[str, Any] = None) -> str:
-    """Build the final PTD schedule grid Excel layout and save to output_xlsx."""
-    if config is None:
-        config = {}
+def _cell_values(column: pd.Series) -> List[Any]:
+    """
+    Convert a column to cell values: missing values become "" and floats
+    that hold whole numbers become ints.
+    """
+    values = column.to_numpy(dtype=object, copy=True)
+    missing = column.isna().to_numpy(dtype=bool)
+    if column.dtype.kind == "f":
+        floats = column.to_numpy(dtype=float)
+        whole = np.trunc(floats)
+        with np.errstate(invalid="ignore"):
+            integral = ~missing & (np.abs(floats - whole)
+                                   <= 1e-9 * np.maximum(np.abs(floats), np.abs(whole)))
+        values[integral] = whole[integral].astype(np.int64).astype(object)
+    elif column.dtype == object:
+        for i, value in enumerate(values):
+            if isinstance(value, float) and not missing[i] and math.isclose(value, int(value)):
+                values[i] = int(value)
+    values[missing] = ""
+    return values.tolist()
+
+
+def _layout_styles() -> List[NamedStyle]:
+    """Cell-style templates used by the schedule grid layout."""
+    bold = Font(bold=True)
+    center = Alignment(horizontal="center", vertical="center", wrap_text=True)
+    left_align = Alignment(horizontal="left", vertical="center", wrap_text=True)
+    thin = Side(border_style="thin", color="000000")
+    border = Border(left=thin, right=thin, top=thin, bottom=thin)
+    header_fill = PatternFill(start_color="D9E1F2", end_color="D9E1F2", fill_type="solid")
+    grey_fill = PatternFill(start_color="E7E6E6", end_color="E7E6E6", fill_type="solid")
     
-    logging.info(f"Building schedule layout from {visit_schedule_xlsx} and {forms_csv}")
+    return [
+        cell_style("ptd_header", font=bold, alignment=center, fill=header_fill, border=border),
+        cell_style("ptd_header_blank", fill=header_fill, border=border),
+        cell_style("ptd_section", font=bold, alignment=center, fill=grey_fill, border=border),
+        cell_style("ptd_section_label", font=bold, alignment=left_align, fill=grey_fill, border=border),
+        cell_style("ptd_grid", alignment=center, border=border),
+        cell_style("ptd_border", border=border),
+        cell_style("ptd_left", alignment=left_align),
+        cell_style("ptd_center", alignment=center),
+    ]
+
+
+def layout_schedule_grid(df_visits: pd.DataFrame, df_forms: pd.DataFrame,
+                         config: Dict[str, Any] = None) -> SheetLayout:
+    """
+    Lay out the PTD schedule grid from the visits-with-groups and forms matrix tables.
     
-    try:
-        df_visits = pd.read_excel(visit_schedule_xlsx, sheet_name=0)
-        df_forms = pd.read_csv(forms_csv)
-    except Exception as e:
-        logging.error(f"Error loading input files: {e}")
-        raise
+    Cells are rendered from precomputed style templates a row at a time into a
+    SheetLayout; nothing is written until the layout is saved.
     
-    # Normalize column names
+    Args:
+        df_visits: Visits with event groups and windows (event grouping output)
+        df_forms: Ordered SoA forms matrix (common matrix output)
+        config: Configuration dictionary
+        
+    Returns:
+        SheetLayout of the "Final PTD" sheet
+    """
+    if config is None:
+        config = {}
+    
+    # Normalize column names (on copies; the inputs are left as they are)
+    df_visits = df_visits.copy(deep=False)
+    df_forms = df_forms.copy(deep=False)
     df_visits.columns = [c.strip() for c in df_visits.columns]
     df_forms.columns = [c.strip() for c in df_forms.columns]
     
@@ -90,62 +142,70 @@ def build_schedule_layout(visit_schedule_xlsx: str, forms_csv: str, output_xlsx:
         'Additional Programming Instructions'
     ])
     
-    # ------------------ workbook setup ------------------
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Final PTD"
+    # ------------------ layout ------------------
+    col_after_source = len(left_columns) + 1   # Event Group/Label/Name column after Source
+    col_rtsm = col_after_source + 1
+    col_start_visits = col_rtsm + 1            # Visits start after RTSM
+    col_extra = col_start_visits + n_visits
     
-    # Styles
-    bold = Font(bold=True)
-    center = Alignment(horizontal="center", vertical="center", wrap_text=True)
-    left_align = Alignment(horizontal="left", vertical="center", wrap_text=True)
-    thin = Side(border_style="thin", color="000000")
-    border = Border(left=thin, right=thin, top=thin, bottom=thin)
-    header_fill = PatternFill(start_color="D9E1F2", end_color="D9E1F2", fill_type="solid")
-    grey_fill = PatternFill(start_color="E7E6E6", end_color="E7E6E6", fill_type="solid")
+    dynamic_rows = [
+        "Visit Dynamics (If Y, then Event should appear based on triggering criteria)",
+        "Triggering: Event",
+        "Triggering: Form",
+        "Triggering: Item = Response (if specific response expected, else leave to accept any entered result)"
+    ]
+    event_window_rows = [
+        "Assign Visit Window",
+        "Offset Type (Previous Event, Specific Event, or None)",
+        "Offset Days (Planned Visit Date, as calculated from Offset Event)",
+        "Day Range - Early",
+        "Day Range - Late"
+    ]
+    sections = [("Visit Dynamic Properties", dynamic_rows),
+                ("Event Window Configuration", event_window_rows)]
+    forms_start_row = 4 + sum(1 + len(attrs) for _, attrs in sections)
+    
+    # ------------------ sheet setup ------------------
+    layout = SheetLayout("Final PTD", _layout_styles())
+    
+    # Rows are rendered as lists of (value, style) entries first; None leaves
+    # a cell unwritten. Column widths are tracked as rows are rendered.
+    widths = ColumnWidthTracker()
+    rows: List[List[Optional[Tuple[Any, Optional[str]]]]] = []
+    merges: List[Tuple[int, int, int, int]] = []
+    
+    def emit(entries: List[Optional[Tuple[Any, Optional[str]]]]) -> None:
+        for column, entry in enumerate(entries, start=1):
+            if entry is not None:
+                widths.observe(column, entry[0])
+        rows.append(entries)
+    
+    def place(entries: Dict[int, Tuple[Any, Optional[str]]]) -> List[Optional[Tuple[Any, Optional[str]]]]:
+        return [entries.get(column) for column in range(1, max(entries) + 1)]
     
     # ------------------ HEADER ------------------
-    # Left columns
-    for i, lbl in enumerate(left_columns):
-        for row in range(1, 4):
-            cell = ws.cell(row=row, column=i + 1, value=lbl if row == 2 else None)
-            cell.font = bold
-            cell.alignment = center
-            cell.fill = header_fill
-            cell.border = border
-    
-    # Insert Event Group/Label/Name column after Source
-    col_after_source = len(left_columns) + 1
-    
-    ws.cell(row=1, column=col_after_source, value="Event Group:").font = bold
-    ws.cell(row=1, column=col_after_source).alignment = center
-    ws.cell(row=1, column=col_after_source).fill = header_fill
-    ws.cell(row=1, column=col_after_source).border = border
-    
-    ws.cell(row=2, column=col_after_source, value="Event Label:").font = bold
-    ws.cell(row=2, column=col_after_source).alignment = center
-    ws.cell(row=2, column=col_after_source).fill = header_fill
-    ws.cell(row=2, column=col_after_source).border = border
-    
-    ws.cell(row=3, column=col_after_source, value="Event Name:").font = bold
-    ws.cell(row=3, column=col_after_source).alignment = center
-    ws.cell(row=3, column=col_after_source).fill = header_fill
-    ws.cell(row=3, column=col_after_source).border = border
-    
-    # RTSM column
-    col_rtsm = col_after_source + 1
-    for r in (1, 2, 3):
-        ws.cell(row=r, column=col_rtsm, value="RTSM").font = bold
-        ws.cell(row=r, column=col_rtsm).alignment = center
-        ws.cell(row=r, column=col_rtsm).fill = header_fill
-        ws.cell(row=r, column=col_rtsm).border = border
+    # Row 1: Event Group (merged per run of visits in the same group)
+    group_cells: List[Tuple[Any, Optional[str]]] = []
+    cur_group, group_start = None, None
+    for j, g in enumerate(visit_groups + [None]):
+        if j < n_visits and cur_group is None:
+            cur_group, group_start = g, j
+        if group_start is not None and (j == n_visits or g != cur_group):
+            merges.append((1, col_start_visits + group_start, 1, col_start_visits + j - 1))
+            group_cells.append((cur_group, "ptd_header"))
+            group_cells.extend([(None, "ptd_border")] * (j - group_start - 1))
+            cur_group, group_start = g, j
+        if j == n_visits:
+            break
     
-    # Visits start after RTSM
-    col_start_visits = col_rtsm + 1
+    emit([(None, "ptd_header")] * len(left_columns)
+         + [("Event Group:", "ptd_header"), ("RTSM", "ptd_header")]
+         + group_cells
+         + [("", "ptd_header_blank")] * len(extra_headers))
     
     # Row 2: Event Label (full names from xl)
-    for j, vlabel in enumerate(visit_labels):
-        c = col_start_visits + j
+    event_labels = []
+    for j in range(n_visits):
         if event_names[j] == "SCRN":
             event_label = "Screening"
         elif event_names[j] == "RAND":
@@ -154,205 +214,175 @@ def build_schedule_layout(visit_schedule_xlsx: str, forms_csv: str, output_xlsx:
             event_label = f"Visit {event_names[j][1:]}"
         elif "P" in event_names[j]:
             event_label = f"Phone Visit {event_names[j][1:]}"
-        ws.cell(row=2, column=c, value=event_label).font = bold
-        ws.cell(row=2, column=c).alignment = center
-        ws.cell(row=2, column=c).fill = header_fill
-        ws.cell(row=2, column=c).border = border
+        event_labels.append(event_label)
+    emit([(lbl, "ptd_header") for lbl in left_columns]
+         + [("Event Label:", "ptd_header"), ("RTSM", "ptd_header")]
+         + [(lbl, "ptd_header") for lbl in event_labels]
+         + [(h, "ptd_header") for h in extra_headers])
     
     # Row 3: Event Name (short codes)
-    for j, ename in enumerate(event_names):
-        c = col_start_visits + j
-        ws.cell(row=3, column=c, value=ename).font = bold
-        ws.cell(row=3, column=c).alignment = center
-        ws.cell(row=3, column=c).fill = header_fill
-        ws.cell(row=3, column=c).border = border
-    
-    # Row 1: Event Group (merged)
-    cur_group, group_start_col = None, None
-    for j, g in enumerate(visit_groups):
-        c = col_start_visits + j
-        if cur_group is None:
-            cur_group, group_start_col = g, c
-        if g != cur_group:
-            ws.merge_cells(start_row=1, start_column=group_start_col, end_row=1, end_column=c - 1)
-            ws.cell(row=1, column=group_start_col, value=cur_group).font = bold
-            ws.cell(row=1, column=group_start_col).alignment = center
-            ws.cell(row=1, column=group_start_col).fill = header_fill
-            for cc in range(group_start_col, c):
-                ws.cell(row=1, column=cc).border = border
-            cur_group, group_start_col = g, c
-    if group_start_col is not None:
-        ws.merge_cells(start_row=1, start_column=group_start_col, end_row=1, end_column=col_start_visits + n_visits - 1)
-        ws.cell(row=1, column=group_start_col, value=cur_group).font = bold
-        ws.cell(row=1, column=group_start_col).alignment = center
-        ws.cell(row=1, column=group_start_col).fill = header_fill
-        for cc in range(group_start_col, col_start_visits + n_visits):
-            ws.cell(row=1, column=cc).border = border
-    
-    # ------------------ Extra headers ------------------
-    for idx, h in enumerate(extra_headers):
-        c = col_start_visits + n_visits + idx
-        ws.cell(row=1, column=c, value="").fill = header_fill
-        ws.cell(row=1, column=c).border = border
-        cell = ws.cell(row=2, column=c, value=h)
-        cell.font = bold
-        cell.alignment = center
-        cell.fill = header_fill
-        cell.border = border
-        ws.cell(row=3, column=c, value="").fill = header_fill
-        ws.cell(row=3, column=c).border = border
+    emit([(None, "ptd_header")] * len(left_columns)
+         + [("Event Name:", "ptd_header"), ("RTSM", "ptd_header")]
+         + [(ename, "ptd_header") for ename in event_names]
+         + [("", "ptd_header_blank")] * len(extra_headers))
     
     # ------------------ BLOCKS: Visit Dynamics + Event Window ------------------
-    cur_row = 4
-    dynamic_rows = [
-        "Visit Dynamics (If Y, then Event should appear based on triggering criteria)",
-        "Triggering: Event",
-        "Triggering: Form",
-        "Triggering: Item = Response (if specific response expected, else leave to accept any entered result)"
-    ]
-    event_window_rows = [
-        "Assign Visit Window",
-        "Offset Type (Previous Event, Specific Event, or None)",
-        "Offset Days (Planned Visit Date, as calculated from Offset Event)",
-        "Day Range - Early",
-        "Day Range - Late"
-    ]
-    sections = [("Visit Dynamic Properties", dynamic_rows),
-                ("Event Window Configuration", event_window_rows)]
+    # Per-visit attribute values are derived once from the visit columns; the
+    # rows below only index these lists.
+    groups_lower = pd.Series(visit_groups, dtype=object).str.lower()
+    ends_study = (groups_lower.str.contains("end of treatment", regex=False)
+                  | groups_lower.str.contains("end of study", regex=False)).to_numpy(dtype=bool)
+    dynamic_flags = np.where((np.arange(n_visits) >= rand_idx) & ~ends_study, "Y", "").tolist()
+    
+    trigger_events = []
+    for j, ename in enumerate(event_names):
+        if ename == "RAND":
+            trigger_events.append("SCRN")
+        elif ename.startswith("V") and j > 0:
+            trigger_events.append(event_names[j - 1])
+        elif ename.lower() == "follow-up":
+            trigger_events.append("EOT")
+        else:
+            trigger_events.append("")
     
+    # The row stops at the first post-randomisation visit; later cells stay unwritten
+    trigger_forms = []
+    for j, ename in enumerate(event_names):
+        if ename == "RAND":
+            trigger_forms.append("ELIGIBILITY_CRITERIA")
+        elif j > rand_idx and "V" in visit_labels[j]:
+            break
+        else:
+            trigger_forms.append("")
+    
+    def window_values(column: str) -> List[Any]:
+        if column not in df_visits.columns:
+            return [""] * n_visits
+        return _cell_values(df_visits[column])
+    
+    attr_values = {
+        dynamic_rows[0]: dynamic_flags,
+        dynamic_rows[1]: trigger_events,
+        dynamic_rows[2]: trigger_forms,
+        dynamic_rows[3]: [""] * n_visits,
+        event_window_rows[0]: ["Y"] * n_visits,
+        event_window_rows[1]: window_values("Offset Type"),
+        event_window_rows[2]: window_values("Offset Days"),
+        event_window_rows[3]: window_values("Day Range - Early"),
+        event_window_rows[4]: window_values("Day Range - Late"),
+    }
+    
+    cur_row = 4
     for section_title, attrs in sections:
-        ws.merge_cells(start_row=cur_row, start_column=1, end_row=cur_row, end_column=len(left_columns))
-        st_cell = ws.cell(row=cur_row, column=1, value=section_title)
-        st_cell.font = bold
-        st_cell.alignment = center
-        st_cell.fill = grey_fill
-        st_cell.border = border
+        merges.append((cur_row, 1, cur_row, len(left_columns)))
+        emit([(section_title, "ptd_section")])
         cur_row += 1
         
         for attr in attrs:
-            ws.merge_cells(start_row=cur_row, start_column=1, end_row=cur_row, end_column=len(left_columns))
-            lbl_cell = ws.cell(row=cur_row, column=1, value=attr)
-            lbl_cell.font = bold
-            lbl_cell.alignment = left_align
-            lbl_cell.fill = grey_fill
-            lbl_cell.border = border
-            
-            for j in range(n_visits):
-                c = col_start_visits + j
-                mapped_value = ""
-                
-                if attr.startswith("Visit Dynamics"):
-                    eg = str(visit_groups[j]).lower()
-                    if j >= rand_idx and ("end of treatment" not in eg and "end of study" not in eg):
-                        mapped_value = "Y"
-                
-                elif attr.startswith("Triggering: Event"):
-                    if event_names[j] == "RAND":
-                        mapped_value = "SCRN"
-                    elif event_names[j].startswith("V") and j > 0:
-                        mapped_value = event_names[j - 1]
-                    elif event_names[j].lower() == "follow-up":
-                        mapped_value = "EOT"
-                
-                elif attr.startswith("Triggering: Form"):
-                    mapped_value = ""
-                    if event_names[j] == "RAND":
-                        mapped_value = "ELIGIBILITY_CRITERIA"
-                    elif j > rand_idx:
-                        if "V" in visit_labels[j]:
-                            if mapped_value == "":
-                                mapped_value = "RANDOMISATION"
-                                break
-                    else:
-                        mapped_value = ""
-                
-                elif attr.startswith("Assign Visit Window"):
-                    mapped_value = "Y"
-                
-                elif attr.startswith("Offset Type") and "Offset Type" in df_visits.columns:
-                    mapped_value = df_visits.iloc[j].get("Offset Type", "")
-                elif attr.startswith("Offset Days") and "Offset Days" in df_visits.columns:
-                    mapped_value = df_visits.iloc[j].get("Offset Days", "")
-                elif attr.startswith("Day Range - Early") and "Day Range - Early" in df_visits.columns:
-                    mapped_value = df_visits.iloc[j].get("Day Range - Early", "")
-                elif attr.startswith("Day Range - Late") and "Day Range - Late" in df_visits.columns:
-                    mapped_value = df_visits.iloc[j].get("Day Range - Late", "")
-                
-                if pd.isna(mapped_value):
-                    mapped_value = ""
-                if isinstance(mapped_value, float) and math.isclose(mapped_value, int(mapped_value)):
-                    mapped_value = int(mapped_value)
-                
-                ws.cell(row=cur_row, column=c, value=mapped_value).alignment = center
-                ws.cell(row=cur_row, column=c).border = border
-            
-            ws.cell(row=cur_row, column=col_rtsm, value="").border = border
+            merges.append((cur_row, 1, cur_row, len(left_columns)))
+            emit([(attr, "ptd_section_label")]
+                 + [None] * (col_rtsm - 2)
+                 + [("", "ptd_border")]
+                 + [(value, "ptd_grid") for value in attr_values[attr]])
             cur_row += 1
     
     # ------------------ FORMS TABLE ------------------
-    forms_start_row = cur_row
-    df_forms_filtered = df_forms.copy()
-    row_cursor = forms_start_row
-    
     # RTSM row
-    ws.cell(row=row_cursor, column=1, value="RTSM").alignment = left_align
-    ws.cell(row=row_cursor, column=2, value="RTSM").alignment = left_align
-    ws.cell(row=row_cursor, column=3, value="Library").alignment = left_align
-    ws.cell(row=row_cursor, column=col_rtsm, value="X").alignment = center
+    rtsm_row = {1: ("RTSM", "ptd_left"), 2: ("RTSM", "ptd_left"), 3: ("Library", "ptd_left"),
+                col_rtsm: ("X", "ptd_center")}
     for idx in range(len(extra_headers)):
-        ws.cell(row=row_cursor, column=col_start_visits + n_visits + idx, value="").alignment = center
-    row_cursor += 1
-    
-    # Forms from CSV
-    for _, r in df_forms_filtered.iterrows():
-        ws.cell(row=row_cursor, column=1, value=r.get('Form Label', '')).alignment = left_align
-        ws.cell(row=row_cursor, column=2, value=r.get('Form Name', '')).alignment = left_align
-        ws.cell(row=row_cursor, column=3, value=r.get('Source', '')).alignment = left_align
-        ws.cell(row=row_cursor, column=col_rtsm, value="").alignment = center
-        
-        for j, vlabel in enumerate(visit_labels):
-            c = col_start_visits + j
-            val = ""
-            if vlabel in r.index:
-                val = r[vlabel]
-            else:
-                en = event_names[j]
-                if en in r.index:
-                    val = r[en]
-            if pd.isna(val):
-                val = ""
-            if isinstance(val, float) and math.isclose(val, int(val)):
-                val = int(val)
-            ws.cell(row=row_cursor, column=c, value=val).alignment = center
-        
-        extra_vals = {
-            "Is Form Dynamic?": r.get("Is Form Dynamic?", "") or r.get("Is Form Dynamic", "") or r.get("IsDynamic", ""),
-            "Form Dynamic Criteria": r.get("Form Dynamic Criteria", "") or r.get("Form Dynamic Criteria ", "")
-        }
-        for idx, colname in enumerate(extra_headers):
-            c = col_start_visits + n_visits + idx
-            ws.cell(row=row_cursor, column=c, value=extra_vals.get(colname, "")).alignment = center
-        row_cursor += 1
-    
-    # ------------------ formatting ------------------
-    for col_idx in range(1, ws.max_column + 1):
-        col_letter = get_column_letter(col_idx)
-        max_len = 0
-        for cell in ws[col_letter]:
-            if cell.value is not None:
-                lv = str(cell.value)
-                max_len = max(max_len, len(lv))
-        ws.column_dimensions[col_letter].width = max(10, max_len + 2)
-    
-    ws.freeze_panes = ws.cell(row=forms_start_row, column=col_rtsm)
-    
-    wb.save(output_xlsx)
+        rtsm_row[col_extra + idx] = ("", "ptd_center")
+    emit(place(rtsm_row))
+    
+    # Forms from CSV: each visit is resolved once to a CSV column position
+    # (visit label first, then event name); values are normalised per column
+    # and rows are rendered from a plain 2D array.
+    n_forms = len(df_forms)
+    form_columns = list(df_forms.columns)
+    
+    def column_position(name: str) -> Optional[int]:
+        return form_columns.index(name) if name in form_columns else None
+    
+    def raw_values(name: str) -> List[Any]:
+        if name not in form_columns:
+            return [""] * n_forms
+        return df_forms[name].tolist()
+    
+    normalised: Dict[int, List[Any]] = {}
+    visit_matrix = np.full((n_forms, n_visits), "", dtype=object)
+    for j, vlabel in enumerate(visit_labels):
+        pos = column_position(vlabel)
+        if pos is None:
+            pos = column_position(event_names[j])
+        if pos is None:
+            continue
+        if pos not in normalised:
+            normalised[pos] = _cell_values(df_forms.iloc[:, pos])
+        visit_matrix[:, j] = normalised[pos]
+    
+    extra_sources = {
+        "Is Form Dynamic?": [a or b or c for a, b, c in zip(raw_values("Is Form Dynamic?"),
+                                                            raw_values("Is Form Dynamic"),
+                                                            raw_values("IsDynamic"))],
+        "Form Dynamic Criteria": [a or b for a, b in zip(raw_values("Form Dynamic Criteria"),
+                                                         raw_values("Form Dynamic Criteria "))],
+    }
+    extra_matrix = np.full((n_forms, len(extra_headers)), "", dtype=object)
+    for idx, colname in enumerate(extra_headers):
+        if colname in extra_sources:
+            extra_matrix[:, idx] = extra_sources[colname]
+    
+    blank_center = ("", "ptd_center")
+    lead_width = max(col_rtsm, 3)
+    for label, name, source, visit_values, extra_values in zip(
+            raw_values('Form Label'), raw_values('Form Name'), raw_values('Source'),
+            visit_matrix.tolist(), extra_matrix.tolist()):
+        lead = [None] * lead_width
+        lead[0], lead[1], lead[2] = (label, "ptd_left"), (name, "ptd_left"), (source, "ptd_left")
+        lead[col_rtsm - 1] = blank_center
+        emit(lead
+             + [(val, "ptd_center") for val in visit_values]
+             + [(val, "ptd_center") for val in extra_values])
+    
+    # ------------------ layout ------------------
+    layout.set_widths(widths, min_width=10, padding=2)
+    layout.freeze(forms_start_row, col_rtsm)
+    for merge in merges:
+        layout.merge(*merge)
+    for entries in rows:
+        layout.append(entries)
+    return layout
+
+
+def build_schedule_layout(visit_schedule_xlsx: str, forms_csv: str, output_xlsx: str, 
+                         config: Dict[str, Any] = None, backend: Optional[str] = None) -> str:
+    """
+    Build the final PTD schedule grid Excel layout and save to output_xlsx.
+    
+    The layout is written through a SheetWriter. The xlsx backend comes from the
+    argument or "xlsx_backend" in config; "streaming" keeps memory flat for
+    grids with many visits and forms.
+    """
+    if config is None:
+        config = {}
+    
+    logging.info(f"Building schedule layout from {visit_schedule_xlsx} and {forms_csv}")
+    
+    try:
+        df_visits = pd.read_excel(visit_schedule_xlsx, sheet_name=0)
+        df_forms = pd.read_csv(forms_csv)
+    except Exception as e:
+        logging.error(f"Error loading input files: {e}")
+        raise
+    
+    layout = layout_schedule_grid(df_visits, df_forms, config)
+    layout.save(output_xlsx, backend=backend or config.get('xlsx_backend', 'openpyxl'))
     logging.info(f"Schedule grid saved to {output_xlsx}")
     return output_xlsx
 
 
 def generate_schedule_grid(visits_xlsx: str, forms_csv: str, output_xlsx: str, 
-                          config: Dict[str, Any] = None) -> str:
+                          config: Dict[str, Any] = None, backend: Optional[str] = None) -> str:
     """
     Generate the final schedule grid from visit groups and forms data.
     
@@ -361,6 +391,7 @@ def generate_schedule_grid(visits_xlsx: str, forms_csv: str, output_xlsx: str,
         forms_csv: Path to forms matrix CSV file
         output_xlsx: Path to output Excel file
         config: Configuration dictionary
+        backend: xlsx backend, "openpyxl" or "streaming" (defaults to config "xlsx_backend")
         
     Returns:
         Path to output Excel file
@@ -371,7 +402,7 @@ def generate_schedule_grid(visits_xlsx: str, forms_csv: str, output_xlsx: str,
     logging.info(f"Generating schedule grid from {visits_xlsx} and {forms_csv}")
     
     try:
-        output_path = build_schedule_layout(visits_xlsx, forms_csv, output_xlsx, config)
+        output_path = build_schedule_layout(visits_xlsx, forms_csv, output_xlsx, config, backend)
         return output_path
     except Exception as e:
         logging.error(f"Error generating schedule grid: {e}")
@@ -0,0 +1,133 @@
+"""
+Service Module
+
+Local JSON-over-HTTP job server for a resident PTD generator. The process that
+starts it keeps its imports, configs and engines warm; each request only runs
+the generation job itself.
+
+Endpoints:
+- GET  /health    service status and job counters
+- POST /generate  run one generation job described by a JSON object
+"""
+
+import json
+import logging
+import signal
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict
+
+JobRunner = Callable[[Dict[str, Any]], Dict[str, Any]]
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+
+class JobError(ValueError):
+    """Invalid job request; reported to the client as HTTP 400."""
+
+
+def make_server(run_job: JobRunner, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT) -> ThreadingHTTPServer:
+    """
+    Create the job server (not yet serving).
+
+    Requests are handled on their own threads so /health stays responsive,
+    but jobs run one at a time: the pipeline stages share module-level state.
+
+    Args:
+        run_job: Callable running one job dict and returning a JSON-serialisable result
+        host: Interface to bind (local only by default)
+        port: TCP port (0 picks a free one)
+
+    Returns:
+        ThreadingHTTPServer ready for serve_forever()
+    """
+    job_lock = threading.Lock()
+    stats = {"jobs": 0, "failed": 0, "started": time.time()}
+
+    class JobHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/health":
+                self._reply(404, {"error": f"Unknown endpoint: {self.path}"})
+                return
+            self._reply(200, {
+                "status": "ok",
+                "busy": job_lock.locked(),
+                "jobs": stats["jobs"],
+                "failed": stats["failed"],
+                "uptime": round(time.time() - stats["started"], 1),
+            })
+
+        def do_POST(self):
+            if self.path != "/generate":
+                self._reply(404, {"error": f"Unknown endpoint: {self.path}"})
+                return
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                job = json.loads(self.rfile.read(length) or b"{}")
+            except ValueError as e:
+                self._reply(400, {"error": f"Invalid JSON body: {e}"})
+                return
+            if not isinstance(job, dict):
+                self._reply(400, {"error": "Job must be a JSON object"})
+                return
+
+            with job_lock:
+                started = time.perf_counter()
+                try:
+                    result = run_job(job)
+                except JobError as e:
+                    stats["failed"] += 1
+                    self._reply(400, {"error": str(e)})
+                    return
+                except Exception as e:
+                    stats["failed"] += 1
+                    logging.exception(f"Service job failed: {e}")
+                    self._reply(500, {"error": f"{type(e).__name__}: {e}"})
+                    return
+                stats["jobs"] += 1
+                elapsed = time.perf_counter() - started
+
+            logging.info(f"Service job completed in {elapsed:.3f}s")
+            self._reply(200, {"status": "ok", "seconds": round(elapsed, 3), **result})
+
+        def log_message(self, format, *args):
+            logging.debug(f"service: {self.address_string()} {format % args}")
+
+        def _reply(self, status: int, payload: Dict[str, Any]) -> None:
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return ThreadingHTTPServer((host, port), JobHandler)
+
+
+def serve(run_job: JobRunner, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT) -> None:
+    """
+    Serve generation jobs until interrupted (Ctrl+C or SIGTERM).
+
+    Args:
+        run_job: Callable running one job dict and returning a JSON-serialisable result
+        host: Interface to bind
+        port: TCP port
+    """
+    server = make_server(run_job, host, port)
+    bound_host, bound_port = server.server_address[:2]
+    logging.info(f"PTD service listening on http://{bound_host}:{bound_port}")
+
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+
+    # Stop cleanly on SIGTERM too (process managers, background shells)
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGTERM, stop)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logging.info("PTD service stopping")
+    finally:
+        server.server_close()
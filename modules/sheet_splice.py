@@ -0,0 +1,577 @@
+"""
+Sheet Splice Module
+
+Replace worksheets of a template workbook directly inside its OOXML (zip)
+package. Only the replaced sheet parts, workbook.xml (when a sheet is
+added), the workbook relationships, [Content_Types].xml, styles.xml and
+sharedStrings.xml are rewritten; every other part of the template is copied
+through byte-identical, so template-only features survive and large
+templates cost almost nothing to update.
+
+Template parts are patched by inserting text rather than re-serialising the
+whole document, which keeps namespace declarations (mc:Ignorable prefixes)
+and element order exactly as the authoring application wrote them.
+"""
+
+import os
+import re
+import copy
+import time
+import shutil
+import logging
+import posixpath
+import zipfile
+import xml.etree.ElementTree as ET
+from typing import Any, Dict, List, Optional, Tuple
+from xml.sax.saxutils import quoteattr
+
+MAIN_NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+REL_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+PKG_REL_NS = "http://schemas.openxmlformats.org/package/2006/relationships"
+
+REL_WORKSHEET = REL_NS + "/worksheet"
+REL_STYLES = REL_NS + "/styles"
+REL_SHARED_STRINGS = REL_NS + "/sharedStrings"
+REL_CALC_CHAIN = REL_NS + "/calcChain"
+
+CT_WORKSHEET = "application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"
+CT_SHARED_STRINGS = "application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml"
+
+FIRST_CUSTOM_NUMFMT_ID = 164
+
+# Serialise generated sheets with the conventional prefixes
+ET.register_namespace("r", REL_NS)
+ET.register_namespace("mc", "http://schemas.openxmlformats.org/markup-compatibility/2006")
+ET.register_namespace("x14ac", "http://schemas.microsoft.com/office/spreadsheetml/2009/9/ac")
+
+
+def _q(tag: str) -> str:
+    return f"{{{MAIN_NS}}}{tag}"
+
+
+def _canonical(element: ET.Element) -> str:
+    """Canonical XML of an element, used to de-duplicate styles and strings."""
+    return ET.canonicalize(ET.tostring(element, encoding="unicode"))
+
+
+def _resolve_target(source_part: str, target: str) -> str:
+    """Resolve a relationship target against the part that owns the relationship."""
+    if target.startswith("/"):
+        return target.lstrip("/")
+    return posixpath.normpath(posixpath.join(posixpath.dirname(source_part), target))
+
+
+def _rels_part(part: str) -> str:
+    folder, name = posixpath.split(part)
+    return posixpath.join(folder, "_rels", name + ".rels")
+
+
+def _read_rels(package: zipfile.ZipFile, part: str) -> List[Dict[str, str]]:
+    """Return the relationships of a part as dicts with Id, Type and resolved Target."""
+    rels_name = _rels_part(part)
+    if rels_name not in package.namelist():
+        return []
+    root = ET.fromstring(package.read(rels_name))
+    rels = []
+    for rel in root.findall(f"{{{PKG_REL_NS}}}Relationship"):
+        rels.append({
+            "Id": rel.get("Id"),
+            "Type": rel.get("Type"),
+            "Target": _resolve_target(part, rel.get("Target", "")),
+            "TargetMode": rel.get("TargetMode", ""),
+        })
+    return rels
+
+
+def _workbook_part(package: zipfile.ZipFile) -> str:
+    for rel in _read_rels(package, ""):
+        if rel["Type"].endswith("/officeDocument"):
+            return rel["Target"]
+    return "xl/workbook.xml"
+
+
+def _part_by_type(rels: List[Dict[str, str]], rel_type: str) -> Optional[str]:
+    for rel in rels:
+        if rel["Type"] == rel_type:
+            return rel["Target"]
+    return None
+
+
+def _root_prefix(xml: str, local_name: str) -> str:
+    """Namespace prefix (including the colon) used on a document's root element."""
+    m = re.search(r"<([A-Za-z_][\w.-]*:)?" + local_name + r"[\s>/]", xml)
+    return (m.group(1) or "") if m else ""
+
+
+def _ns_prefix(xml: str, namespace: str) -> Optional[str]:
+    """Prefix bound to a namespace on the root element, "" for the default namespace."""
+    for m in re.finditer(r'xmlns(?::([\w.-]+))?="([^"]*)"', xml):
+        if m.group(2) == namespace:
+            return m.group(1) or ""
+    return None
+
+
+def _use_prefix(element: ET.Element, prefix: str) -> ET.Element:
+    """Rename SpreadsheetML elements (in place) to prefix + local name for serialisation."""
+    qualifier = f"{{{MAIN_NS}}}"
+    for node in element.iter():
+        if isinstance(node.tag, str) and node.tag.startswith(qualifier):
+            node.tag = prefix + node.tag[len(qualifier):]
+    return element
+
+
+def _fragment(element: ET.Element, prefix: str) -> str:
+    """Serialise an element for insertion into a template part that uses prefix for SpreadsheetML."""
+    return ET.tostring(_use_prefix(copy.deepcopy(element), prefix), encoding="unicode")
+
+
+def _append_to_section(xml: str, prefix: str, tag: str, fragments: List[str], total: int,
+                       insert_after: Optional[str] = None) -> str:
+    """
+    Append child fragments to a section element (e.g. <fonts>) and set its count.
+
+    If the section is missing it is created right after the opening tag named
+    by insert_after (or not at all when insert_after is None and nothing is added).
+    """
+    if not fragments:
+        return xml
+    name = prefix + tag
+    opening = re.search(r"<" + re.escape(name) + r"(\s[^>]*?)?(/?)>", xml)
+    if opening is None:
+        anchor = re.search(r"<" + re.escape(prefix + insert_after) + r"(\s[^>]*?)?>", xml)
+        if anchor is None:
+            raise ValueError(f"Cannot place <{name}> in styles part")
+        block = f'<{name} count="{total}">' + "".join(fragments) + f"</{name}>"
+        return xml[:anchor.end()] + block + xml[anchor.end():]
+
+    attrs = opening.group(1) or ""
+    if re.search(r'\scount="\d*"', attrs):
+        attrs = re.sub(r'\scount="\d*"', f' count="{total}"', attrs)
+    else:
+        attrs += f' count="{total}"'
+    if opening.group(2):  # self-closing section
+        block = f"<{name}{attrs}>" + "".join(fragments) + f"</{name}>"
+        return xml[:opening.start()] + block + xml[opening.end():]
+    closing = xml.index(f"</{name}>", opening.end())
+    return (xml[:opening.start()] + f"<{name}{attrs}>" + xml[opening.end():closing]
+            + "".join(fragments) + xml[closing:])
+
+
+class _StyleMerger:
+    """Copy cell formats from generated workbooks into the template's styles part."""
+
+    SECTIONS = (("numFmts", "numFmt"), ("fonts", "font"), ("fills", "fill"),
+                ("borders", "border"), ("cellXfs", "xf"))
+
+    def __init__(self, styles_xml: str):
+        self.xml = styles_xml
+        self.prefix = _root_prefix(styles_xml, "styleSheet")
+        root = ET.fromstring(styles_xml)
+        self.index: Dict[str, Dict[str, int]] = {}
+        self.counts: Dict[str, int] = {}
+        self.added: Dict[str, List[str]] = {}
+        for section, child in self.SECTIONS:
+            parent = root.find(_q(section))
+            children = parent.findall(_q(child)) if parent is not None else []
+            self.counts[section] = len(children)
+            self.added[section] = []
+            if section == "numFmts":
+                self.index[section] = {c.get("formatCode"): int(c.get("numFmtId")) for c in children}
+            else:
+                self.index[section] = {}
+                for i, c in enumerate(children):
+                    self.index[section].setdefault(_canonical(c), i)
+        custom_ids = list(self.index["numFmts"].values())
+        self.next_numfmt_id = max(custom_ids + [FIRST_CUSTOM_NUMFMT_ID - 1]) + 1
+
+    def _add(self, section: str, element: ET.Element) -> int:
+        key = _canonical(element)
+        position = self.index[section].get(key)
+        if position is None:
+            position = self.counts[section] + len(self.added[section])
+            self.index[section][key] = position
+            self.added[section].append(_fragment(element, self.prefix))
+        return position
+
+    def _numfmt(self, num_fmt_id: int, source_formats: Dict[int, str]) -> int:
+        if num_fmt_id < FIRST_CUSTOM_NUMFMT_ID or num_fmt_id not in source_formats:
+            return num_fmt_id
+        code = source_formats[num_fmt_id]
+        if code not in self.index["numFmts"]:
+            new_id = self.next_numfmt_id
+            self.next_numfmt_id += 1
+            self.index["numFmts"][code] = new_id
+            element = ET.Element(_q("numFmt"), {"numFmtId": str(new_id), "formatCode": code})
+            self.added["numFmts"].append(_fragment(element, self.prefix))
+        return self.index["numFmts"][code]
+
+    def merge(self, source_styles_xml: bytes) -> Dict[int, int]:
+        """Append a generated workbook's cell formats; returns source xf index -> template xf index."""
+        root = ET.fromstring(source_styles_xml)
+
+        def children(section: str, child: str) -> List[ET.Element]:
+            parent = root.find(_q(section))
+            return parent.findall(_q(child)) if parent is not None else []
+
+        source_formats = {int(f.get("numFmtId")): f.get("formatCode") for f in children("numFmts", "numFmt")}
+        fonts = children("fonts", "font")
+        fills = children("fills", "fill")
+        borders = children("borders", "border")
+
+        mapping: Dict[int, int] = {}
+        for i, xf in enumerate(children("cellXfs", "xf")):
+            new_xf = ET.Element(_q("xf"), dict(xf.attrib))
+            new_xf.extend(list(xf))
+            new_xf.set("numFmtId", str(self._numfmt(int(xf.get("numFmtId", 0)), source_formats)))
+            for attr, section, items in (("fontId", "fonts", fonts), ("fillId", "fills", fills),
+                                         ("borderId", "borders", borders)):
+                source_id = int(xf.get(attr, 0))
+                if source_id < len(items):
+                    new_xf.set(attr, str(self._add(section, items[source_id])))
+            # Named (cell) styles of the generated workbook do not exist in the template
+            new_xf.set("xfId", "0")
+            mapping[i] = self._add("cellXfs", new_xf)
+        return mapping
+
+    def render(self) -> str:
+        xml = self.xml
+        for section, _ in self.SECTIONS:
+            added = self.added[section]
+            total = (len(self.index["numFmts"]) if section == "numFmts"
+                     else self.counts[section] + len(added))
+            xml = _append_to_section(xml, self.prefix, section, added, total,
+                                     insert_after="styleSheet" if section == "numFmts" else None)
+        return xml
+
+
+class _SharedStrings:
+    """Append strings used by generated sheets to the template's shared string table."""
+
+    def __init__(self, sst_xml: Optional[str]):
+        self.created = sst_xml is None
+        if sst_xml is None:
+            sst_xml = f'<sst xmlns="{MAIN_NS}" count="0" uniqueCount="0"></sst>'
+        self.xml = sst_xml
+        self.prefix = _root_prefix(sst_xml, "sst")
+        root = ET.fromstring(sst_xml)
+        items = root.findall(_q("si"))
+        self.count = int(root.get("count", len(items)))
+        self.unique = len(items)
+        self.index: Dict[str, int] = {}
+        for i, si in enumerate(items):
+            self.index.setdefault(_canonical(si), i)
+        self.added: List[str] = []
+        self.references = 0
+
+    def add(self, si: ET.Element) -> int:
+        self.references += 1
+        key = _canonical(si)
+        position = self.index.get(key)
+        if position is None:
+            position = self.unique + len(self.added)
+            self.index[key] = position
+            self.added.append(_fragment(si, self.prefix))
+        return position
+
+    def render(self) -> str:
+        name = self.prefix + "sst"
+        opening = re.search(r"<" + re.escape(name) + r"(\s[^>]*?)?(/?)>", self.xml)
+        attrs = opening.group(1) or ""
+        for attr, value in (("count", self.count + self.references),
+                            ("uniqueCount", self.unique + len(self.added))):
+            if re.search(r"\s" + attr + r'="\d*"', attrs):
+                attrs = re.sub(r"\s" + attr + r'="\d*"', f' {attr}="{value}"', attrs)
+            else:
+                attrs += f' {attr}="{value}"'
+        if opening.group(2):
+            return (self.xml[:opening.start()] + f"<{name}{attrs}>" + "".join(self.added)
+                    + f"</{name}>" + self.xml[opening.end():])
+        closing = self.xml.rindex(f"</{name}>")
+        return (self.xml[:opening.start()] + f"<{name}{attrs}>" + self.xml[opening.end():closing]
+                + "".join(self.added) + self.xml[closing:])
+
+
+def _first_sheet_part(package: zipfile.ZipFile) -> Tuple[str, List[Dict[str, str]]]:
+    """Return (first worksheet part, workbook relationships) of a workbook package."""
+    workbook_part = _workbook_part(package)
+    rels = _read_rels(package, workbook_part)
+    rel_targets = {rel["Id"]: rel["Target"] for rel in rels}
+    workbook = ET.fromstring(package.read(workbook_part))
+    first_sheet = workbook.find(f"{_q('sheets')}/{_q('sheet')}")
+    if first_sheet is None:
+        raise ValueError(f"No worksheet found in {package.filename}")
+    return rel_targets[first_sheet.get(f"{{{REL_NS}}}id")], rels
+
+
+def _named_sheet_part(package: zipfile.ZipFile, sheet_name: str) -> str:
+    """Return the worksheet part of the sheet called sheet_name."""
+    workbook_part = _workbook_part(package)
+    rel_targets = {rel["Id"]: rel["Target"] for rel in _read_rels(package, workbook_part)}
+    workbook = ET.fromstring(package.read(workbook_part))
+    for sheet in workbook.iterfind(f"{_q('sheets')}/{_q('sheet')}"):
+        if sheet.get("name") == sheet_name:
+            return rel_targets[sheet.get(f"{{{REL_NS}}}id")]
+    raise KeyError(f"No worksheet named '{sheet_name}' in {package.filename}")
+
+
+def _sheet_part(package: zipfile.ZipFile, sheet_name: Optional[str]) -> str:
+    if sheet_name is None:
+        return _first_sheet_part(package)[0]
+    return _named_sheet_part(package, sheet_name)
+
+
+def read_merged_ranges(xlsx_path: str, sheet_name: Optional[str] = None) -> List[str]:
+    """
+    Return the merged ranges (e.g. "A1:C1") of a worksheet (default: the first).
+
+    The sheet XML is scanned incrementally, so this also works for sheets
+    opened in read-only mode, which do not expose merged cells.
+    """
+    ranges = []
+    with zipfile.ZipFile(xlsx_path) as package:
+        with package.open(_sheet_part(package, sheet_name)) as stream:
+            for _, element in ET.iterparse(stream):
+                if element.tag == _q("mergeCell"):
+                    ranges.append(element.get("ref"))
+                elif element.tag == _q("row"):
+                    element.clear()
+    return ranges
+
+
+def read_sheet_settings(xlsx_path: str, sheet_name: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Return the sheet-level settings of a worksheet (default: the first), which
+    read-only mode does not expose, scanning the sheet XML incrementally.
+
+    Returns:
+        Dict with "freeze_panes" (top-left cell of the frozen pane, or None),
+        "column_widths" ({column index: width}) and "row_heights" ({row: height})
+    """
+    settings: Dict[str, Any] = {"freeze_panes": None, "column_widths": {}, "row_heights": {}}
+    with zipfile.ZipFile(xlsx_path) as package:
+        with package.open(_sheet_part(package, sheet_name)) as stream:
+            for _, element in ET.iterparse(stream):
+                if element.tag == _q("row"):
+                    if element.get("ht") is not None:
+                        settings["row_heights"][int(element.get("r"))] = float(element.get("ht"))
+                    element.clear()
+                elif element.tag == _q("col") and element.get("width") is not None:
+                    for column in range(int(element.get("min")), int(element.get("max")) + 1):
+                        settings["column_widths"][column] = float(element.get("width"))
+                elif element.tag == _q("pane") and element.get("state") in ("frozen", "frozenSplit"):
+                    settings["freeze_panes"] = element.get("topLeftCell")
+    return settings
+
+
+# Generated sheet XML is remapped with a handful of patterns, chunk by chunk
+_CELL = re.compile(r"<((?:[\w.-]+:)?c)\b([^>]*?)(/>|>(.*?)</\1>)", re.S)
+_ROW = re.compile(r"<(?:[\w.-]+:)?row\b[^>]*>")
+_COL = re.compile(r"<(?:[\w.-]+:)?col\b[^>]*>")
+_SHEET_VIEW = re.compile(r"<(?:[\w.-]+:)?sheetView\b[^>]*>")
+_STYLE_ATTR = re.compile(r'(\s(?:s|style)=")(\d+)(")')
+_VALUE = re.compile(r"(<(?:[\w.-]+:)?v>)(\d+)(</)")
+_ROW_END = re.compile(rb"</(?:[\w.-]+:)?row>")
+_CHUNK_SIZE = 1 << 20
+
+
+def _sheet_transform(style_map: Dict[int, int], strings: List[ET.Element], shared: "_SharedStrings"):
+    """Build a text transform remapping style and shared-string indices onto the template."""
+
+    def restyle(tag: str) -> str:
+        return _STYLE_ATTR.sub(lambda m: f"{m.group(1)}{style_map.get(int(m.group(2)), 0)}{m.group(3)}", tag)
+
+    def cell(m: re.Match) -> str:
+        attrs = restyle(m.group(2))
+        body = m.group(3)
+        if m.group(4) is not None and re.search(r'\st="s"', attrs):
+            body = _VALUE.sub(lambda v: f"{v.group(1)}{shared.add(strings[int(v.group(2))])}{v.group(3)}", body)
+        return f"<{m.group(1)}{attrs}{body}"
+
+    def transform(text: str) -> str:
+        text = _SHEET_VIEW.sub(lambda m: re.sub(r'\stabSelected="[^"]*"', "", m.group(0)), text)
+        text = _COL.sub(lambda m: restyle(m.group(0)), text)
+        text = _ROW.sub(lambda m: restyle(m.group(0)), text)
+        return _CELL.sub(cell, text)
+
+    return transform
+
+
+def _stream_sheet(source: zipfile.ZipFile, sheet_part: str, out: zipfile.ZipFile,
+                  info: zipfile.ZipInfo, transform) -> None:
+    """Copy a sheet part into the output package, transforming whole rows at a time."""
+    with source.open(sheet_part) as src, out.open(info, "w") as dst:
+        pending = b""
+        while True:
+            block = src.read(_CHUNK_SIZE)
+            pending += block
+            if block:
+                last = None
+                for last in _ROW_END.finditer(pending):
+                    pass
+                if last is None:
+                    continue
+                cut = last.end()
+            else:
+                cut = len(pending)
+            dst.write(transform(pending[:cut].decode("utf-8")).encode("utf-8"))
+            pending = pending[cut:]
+            if not block:
+                break
+
+
+def _new_info(name: str, like: Optional[zipfile.ZipInfo] = None) -> zipfile.ZipInfo:
+    info = zipfile.ZipInfo(name, date_time=like.date_time if like else time.localtime()[:6])
+    info.compress_type = zipfile.ZIP_DEFLATED
+    return info
+
+
+def splice_sheets(template_xlsx: str, replacements: Dict[str, str], out_xlsx: str) -> str:
+    """
+    Replace (or add) worksheets of a template workbook at the package level.
+
+    Sheet parts are streamed row by row and all other parts are copied
+    through as streams, so memory use does not grow with sheet size.
+
+    Args:
+        template_xlsx: Template workbook path
+        replacements: Sheet name in the template -> generated workbook whose
+            first worksheet becomes that sheet
+        out_xlsx: Output workbook path (may equal template_xlsx)
+
+    Returns:
+        Absolute path to the saved workbook
+    """
+    sources = {name: zipfile.ZipFile(path) for name, path in replacements.items()}
+    try:
+        with zipfile.ZipFile(template_xlsx) as template:
+            infos = template.infolist()
+            names = set(template.namelist())
+            parts: Dict[str, bytes] = {}
+            dropped = set()
+
+            workbook_part = _workbook_part(template)
+            workbook_rels_part = _rels_part(workbook_part)
+            workbook_xml = template.read(workbook_part).decode("utf-8")
+            rels_xml = template.read(workbook_rels_part).decode("utf-8")
+            types_xml = template.read("[Content_Types].xml").decode("utf-8")
+            rels = _read_rels(template, workbook_part)
+            rel_targets = {rel["Id"]: rel["Target"] for rel in rels}
+
+            styles_part = _part_by_type(rels, REL_STYLES)
+            if styles_part is None:
+                raise ValueError(f"Template {template_xlsx} has no styles part")
+            styles = _StyleMerger(template.read(styles_part).decode("utf-8"))
+            sst_part = _part_by_type(rels, REL_SHARED_STRINGS)
+            shared = _SharedStrings(template.read(sst_part).decode("utf-8") if sst_part else None)
+
+            workbook_root = ET.fromstring(workbook_xml)
+            existing = {}
+            for sheet in workbook_root.iter(_q("sheet")):
+                existing[sheet.get("name")] = rel_targets.get(sheet.get(f"{{{REL_NS}}}id"))
+            sheet_ids = [int(s.get("sheetId")) for s in workbook_root.iter(_q("sheet"))]
+            rel_ids = [int(m) for m in re.findall(r'Id="rId(\d+)"', rels_xml)]
+            main_prefix = _root_prefix(workbook_xml, "workbook")
+            rel_prefix = _ns_prefix(workbook_xml, REL_NS)
+            rels_prefix = _root_prefix(rels_xml, "Relationships")
+            types_prefix = _root_prefix(types_xml, "Types")
+
+            # Target part -> (source package, source sheet part, text transform)
+            sheets: Dict[str, Tuple[zipfile.ZipFile, str, object]] = {}
+            uses_shared = False
+            for sheet_name, source in sources.items():
+                source_part, source_rels = _first_sheet_part(source)
+                if _read_rels(source, source_part):
+                    raise ValueError(f"Sheet in {source.filename} has related parts (drawings, comments, ...) "
+                                     "and cannot be spliced")
+                source_styles = _part_by_type(source_rels, REL_STYLES)
+                style_map = styles.merge(source.read(source_styles)) if source_styles else {}
+                source_sst = _part_by_type(source_rels, REL_SHARED_STRINGS)
+                strings = ET.fromstring(source.read(source_sst)).findall(_q("si")) if source_sst else []
+                uses_shared = uses_shared or bool(strings)
+
+                part = existing.get(sheet_name)
+                if part is not None:
+                    # Related parts of the old sheet (drawings, comments, ...) no longer apply
+                    dropped.add(_rels_part(part))
+                else:
+                    number = 1
+                    while f"xl/worksheets/sheet{number}.xml" in names or f"xl/worksheets/sheet{number}.xml" in sheets:
+                        number += 1
+                    part = f"xl/worksheets/sheet{number}.xml"
+                    sheet_id = max(sheet_ids + [0]) + 1
+                    sheet_ids.append(sheet_id)
+                    rel_id = f"rId{max(rel_ids + [0]) + 1}"
+                    rel_ids.append(int(rel_id[3:]))
+                    if rel_prefix is None:
+                        raise ValueError("Template workbook.xml does not declare the relationships namespace")
+                    r_attr = f"{rel_prefix}:id" if rel_prefix else "id"
+                    sheet_xml = (f"<{main_prefix}sheet name={quoteattr(sheet_name)} sheetId=\"{sheet_id}\" "
+                                 f"{r_attr}=\"{rel_id}\"/>")
+                    closing = workbook_xml.index(f"</{main_prefix}sheets>")
+                    workbook_xml = workbook_xml[:closing] + sheet_xml + workbook_xml[closing:]
+                    target = "/" + part
+                    closing = rels_xml.rindex(f"</{rels_prefix}Relationships>")
+                    rels_xml = (rels_xml[:closing]
+                                + f'<{rels_prefix}Relationship Id="{rel_id}" Type="{REL_WORKSHEET}" Target="{target}"/>'
+                                + rels_xml[closing:])
+                    closing = types_xml.rindex(f"</{types_prefix}Types>")
+                    types_xml = (types_xml[:closing]
+                                 + f'<{types_prefix}Override PartName="{target}" ContentType="{CT_WORKSHEET}"/>'
+                                 + types_xml[closing:])
+                sheets[part] = (source, source_part, _sheet_transform(style_map, strings, shared))
+                logging.info(f"Splicing '{sheet_name}' from {source.filename} into {part}")
+
+            # The calculation chain references cells of the replaced sheets; Excel rebuilds it
+            calc_chain = _part_by_type(rels, REL_CALC_CHAIN)
+            if calc_chain is not None:
+                dropped.add(calc_chain)
+                rels_xml = re.sub(r"<" + re.escape(rels_prefix) + r"Relationship\b[^>]*calcChain[^>]*/>", "", rels_xml)
+                types_xml = re.sub(r"<" + re.escape(types_prefix) + r"Override\b[^>]*calcChain[^>]*/>", "", types_xml)
+
+            # Shared strings are only known once the sheets have been streamed;
+            # register the part now in case the template has none yet
+            if uses_shared and shared.created:
+                sst_part = posixpath.join(posixpath.dirname(workbook_part), "sharedStrings.xml")
+                rel_id = f"rId{max(rel_ids + [0]) + 1}"
+                closing = rels_xml.rindex(f"</{rels_prefix}Relationships>")
+                rels_xml = (rels_xml[:closing]
+                            + f'<{rels_prefix}Relationship Id="{rel_id}" Type="{REL_SHARED_STRINGS}" Target="/{sst_part}"/>'
+                            + rels_xml[closing:])
+                closing = types_xml.rindex(f"</{types_prefix}Types>")
+                types_xml = (types_xml[:closing]
+                             + f'<{types_prefix}Override PartName="/{sst_part}" ContentType="{CT_SHARED_STRINGS}"/>'
+                             + types_xml[closing:])
+
+            parts[styles_part] = styles.render().encode("utf-8")
+            parts[workbook_part] = workbook_xml.encode("utf-8")
+            parts[workbook_rels_part] = rels_xml.encode("utf-8")
+            parts["[Content_Types].xml"] = types_xml.encode("utf-8")
+
+            # Write to a temporary file first so out_xlsx may be the template itself
+            tmp_path = out_xlsx + ".tmp"
+            with zipfile.ZipFile(tmp_path, "w", zipfile.ZIP_DEFLATED) as out:
+                sst_info = None
+                for info in infos:
+                    if info.filename in dropped:
+                        continue
+                    if uses_shared and info.filename == sst_part:
+                        sst_info = info
+                    elif info.filename in sheets:
+                        source, source_part, transform = sheets.pop(info.filename)
+                        _stream_sheet(source, source_part, out, _new_info(info.filename, info), transform)
+                    elif info.filename in parts:
+                        out.writestr(info, parts.pop(info.filename), compress_type=zipfile.ZIP_DEFLATED)
+                    else:
+                        with template.open(info) as src, out.open(info, "w") as dst:
+                            shutil.copyfileobj(src, dst)
+                for part, (source, source_part, transform) in sheets.items():
+                    _stream_sheet(source, source_part, out, _new_info(part), transform)
+                if uses_shared:
+                    out.writestr(sst_info or _new_info(sst_part), shared.render().encode("utf-8"),
+                                 compress_type=zipfile.ZIP_DEFLATED)
+    finally:
+        for source in sources.values():
+            source.close()
+
+    os.replace(tmp_path, out_xlsx)
+    return os.path.abspath(out_xlsx)
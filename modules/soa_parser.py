@@ -9,7 +9,9 @@ import json
 import re
 import logging
 import pandas as pd
-from typing import Dict, List, Any, Optional, Set, Tuple
+from typing import Dict, List, Any, Optional, Set, Tuple, Union
+
+from .soa_tables import SoAModel, SoARow, SoATable, load_soa_model
 
 
 def load_json(file_path: str) -> Dict[str, Any]:
@@ -18,42 +20,6 @@ def load_json(file_path: str) -> Dict[str, Any]:
         return json.load(f)
 
 
-def get_node_text(node: Dict[str, Any]) -> str:
-    """Extract text from a node and its children."""
-    if not node:
-        return ""
-    text = node.get("text", "") or ""
-    for child in node.get("children", []):
-        text += " " + get_node_text(child)
-    return text.replace('\n', ' ').replace('\r', ' ').strip()
-
-
-def find_nodes_by_name(root: Dict[str, Any], name_prefix: str) -> List[Dict[str, Any]]:
-    """Find all nodes with names starting with the given prefix."""
-    found = []
-    
-    def walk(node: Any):
-        if isinstance(node, dict):
-            if node.get("name", "").startswith(name_prefix):
-                found.append(node)
-            for child in node.get("children", []):
-                walk(child)
-        elif isinstance(node, list):
-            for item in node:
-                walk(item)
-    
-    walk(root)
-    return found
-
-
-def flatten_row(row: Dict[str, Any]) -> List[str]:
-    """Flatten a table row into a list of text values."""
-    texts = []
-    for cell in row.get("children", []):
-        texts.append(get_node_text(cell))
-    return texts
-
-
 def cell_has_marker(text: str, markers: List[str]) -> bool:
     """Check if cell text contains any of the configured markers."""
     if not isinstance(text, str):
@@ -176,8 +142,12 @@ def find_schedule_end(all_rows: List[List[str]], column_to_visit: Dict[int, str]
     return len(all_rows)
 
 
-def merge_broken_tables(tables: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-    """Merge tables that may have been split during parsing."""
+def merge_broken_tables(tables: List[SoATable]) -> List[List[SoARow]]:
+    """
+    Merge tables that may have been split during parsing.
+    
+    Returns the rows of each merged table; the protocol document is not modified.
+    """
     if not tables:
         return []
     
@@ -185,32 +155,29 @@ def merge_broken_tables(tables: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     buffer = None
     
     for table in tables:
-        rows = find_nodes_by_name(table, "TR")
-        table_content = [flatten_row(row) for row in rows]
+        rows = list(table.rows)
         
         has_visits = False
-        for row in table_content:
-            visit_count = sum(1 for cell in row if extract_complete_visit_identifier(str(cell), [r'\b(?:V|P)\d+[A-Za-z]*\b']))
+        for row in rows:
+            visit_count = sum(1 for cell in row.texts if extract_complete_visit_identifier(cell, [r'\b(?:V|P)\d+[A-Za-z]*\b']))
             if visit_count >= 2:
                 has_visits = True
                 break
         
         if buffer is None:
-            buffer = table
+            buffer = rows
             buffer_has_visits = has_visits
             continue
         
         if not has_visits:
-            buffer["children"].extend(rows)
+            buffer.extend(rows)
         else:
             if buffer_has_visits:
                 merged.append(buffer)
-                buffer = table
+                buffer = rows
                 buffer_has_visits = True
             else:
-                buf_rows = find_nodes_by_name(buffer, "TR")
-                table["children"] = buf_rows + table.get("children", [])
-                buffer = table
+                buffer = buffer + rows
                 buffer_has_visits = True
     
     if buffer is not None:
@@ -219,45 +186,39 @@ def merge_broken_tables(tables: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     return merged
 
 
-def find_all_schedule_tables(root: Dict[str, Any], config: Dict[str, Any]) -> List[Dict[str, Any]]:
-    """Find all tables that contain schedule information."""
-    tables = find_nodes_by_name(root, "Table")
-    merged_tables = merge_broken_tables(tables)
+def find_all_schedule_tables(soa_model: SoAModel, config: Dict[str, Any]) -> List[List[SoARow]]:
+    """Find all tables that contain schedule information and return their rows."""
+    merged_tables = merge_broken_tables(soa_model.tables)
     
     visit_patterns = config.get('visit_patterns', [])
     min_visit_count = config.get('min_visit_count', 3)
     
     schedule_tables = []
-    for table in merged_tables:
-        rows = find_nodes_by_name(table, "TR")
-        table_content = [flatten_row(row) for row in rows]
-        
+    for rows in merged_tables:
         has_visit_patterns = False
-        for row in table_content:
-            visit_count = sum(1 for cell in row if extract_complete_visit_identifier(str(cell), visit_patterns))
+        for row in rows:
+            visit_count = sum(1 for cell in row.texts if extract_complete_visit_identifier(cell, visit_patterns))
             if visit_count >= min_visit_count:
                 has_visit_patterns = True
                 break
         
         if has_visit_patterns:
-            schedule_tables.append(table)
+            schedule_tables.append(rows)
     
     return schedule_tables
 
 
-def parse_protocol_schedule(protocol_data: Dict[str, Any], config: Dict[str, Any]) -> Tuple[Optional[Dict[str, List[str]]], Optional[List[str]], Optional[List[str]]]:
-    """Parse the protocol schedule and extract visit-procedure mappings."""
+def parse_protocol_schedule(protocol_data: Union[Dict[str, Any], SoAModel], config: Dict[str, Any]) -> Tuple[Optional[Dict[str, List[str]]], Optional[List[str]], Optional[List[str]]]:
+    """Parse the protocol schedule (document or its SoAModel) and extract visit-procedure mappings."""
     schedule = {}
-    tables = find_all_schedule_tables(protocol_data, config)
+    soa_model = protocol_data if isinstance(protocol_data, SoAModel) else SoAModel(protocol_data)
+    tables = find_all_schedule_tables(soa_model, config)
     
     if not tables:
         logging.error("No schedule tables found")
         return None, None, None
     
-    all_rows = []
-    for table in tables:
-        rows = find_nodes_by_name(table, "TR")
-        all_rows.extend([flatten_row(row) for row in rows])
+    all_rows = [row.texts for rows in tables for row in rows]
     
     visit_row = detect_visit_header_row(all_rows, config)
     
@@ -338,13 +299,9 @@ def parse_protocol_schedule(protocol_data: Dict[str, Any], config: Dict[str, Any
     return schedule, visit_order, procedure_order
 
 
-def save_schedule_to_csv(schedule: Dict[str, List[str]], visit_order: List[str], 
-                        procedure_order: List[str], output_path: str) -> None:
-    """Save the schedule to CSV format."""
-    if not schedule:
-        logging.error("Schedule is empty, not saving CSV.")
-        return
-    
+def build_schedule_table(schedule: Dict[str, List[str]], visit_order: List[str], 
+                         procedure_order: List[str]) -> pd.DataFrame:
+    """Build the procedure x visit schedule table ('X' where scheduled), indexed by Procedure."""
     df = pd.DataFrame(index=procedure_order, columns=visit_order)
     df = df.fillna('')
     
@@ -354,13 +311,45 @@ def save_schedule_to_csv(schedule: Dict[str, List[str]], visit_order: List[str],
                 df.loc[proc, visit] = 'X'
     
     df.index.name = "Procedure"
+    return df
+
+
+def parse_schedule_table(soa_model: SoAModel, config: Dict[str, Any] = None) -> pd.DataFrame:
+    """
+    Parse the schedule of activities into a procedure x visit table.
+    
+    Args:
+        soa_model: Table model of the protocol
+        config: Configuration dictionary
+        
+    Returns:
+        Schedule table indexed by Procedure
+    """
+    if config is None:
+        config = {}
+    
+    schedule, visit_order, procedure_order = parse_protocol_schedule(soa_model, config)
+    if not schedule:
+        raise ValueError("Failed to parse schedule from protocol JSON")
+    return build_schedule_table(schedule, visit_order, procedure_order)
+
+
+def save_schedule_to_csv(schedule: Dict[str, List[str]], visit_order: List[str], 
+                        procedure_order: List[str], output_path: str) -> None:
+    """Save the schedule to CSV format."""
+    if not schedule:
+        logging.error("Schedule is empty, not saving CSV.")
+        return
+    
+    df = build_schedule_table(schedule, visit_order, procedure_order)
     df.to_csv(output_path)
     logging.info(f"Schedule saved to '{output_path}'")
     logging.info(f"Total procedures: {len(procedure_order)}")
     logging.info(f"Total visits: {len(visit_order)}")
 
 
-def parse_soa(protocol_json: str, output_csv: str, config: Dict[str, Any] = None) -> str:
+def parse_soa(protocol_json: str, output_csv: str, config: Dict[str, Any] = None,
+              soa_model: Optional[SoAModel] = None) -> str:
     """
     Parse schedule of activities from protocol JSON and save to CSV.
     
@@ -368,6 +357,7 @@ def parse_soa(protocol_json: str, output_csv: str, config: Dict[str, Any] = None
         protocol_json: Path to protocol JSON file
         output_csv: Path to output CSV file
         config: Configuration dictionary
+        soa_model: Table model of protocol_json, when the caller has already built one
         
     Returns:
         Path to output CSV file
@@ -378,8 +368,9 @@ def parse_soa(protocol_json: str, output_csv: str, config: Dict[str, Any] = None
     logging.info(f"Parsing SoA from {protocol_json}")
     
     try:
-        protocol_data = load_json(protocol_json)
-        schedule, visit_order, procedure_order = parse_protocol_schedule(protocol_data, config)
+        if soa_model is None:
+            soa_model = load_soa_model(protocol_json)
+        schedule, visit_order, procedure_order = parse_protocol_schedule(soa_model, config)
         
         if schedule:
             save_schedule_to_csv(schedule, visit_order, procedure_order, output_csv)
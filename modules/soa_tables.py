@@ -0,0 +1,113 @@
+"""
+SoA Tables Module
+
+Shared model of the tables in a protocol JSON document. The protocol is walked
+once; every table row is decoded once into normalised cell texts, and both the
+SoA parser and event grouping read their schedule tables from this model.
+"""
+
+import json
+from typing import Any, Dict, Iterable, List, Optional
+
+from .text_index import TextIndex
+
+
+def get_node_text(node: Dict[str, Any]) -> str:
+    """Extract text from a node and its children."""
+    if not node:
+        return ""
+    text = node.get("text", "") or ""
+    for child in node.get("children", []):
+        text += " " + get_node_text(child)
+    return text.replace('\n', ' ').replace('\r', ' ').strip()
+
+
+class SoARow:
+    """
+    One decoded table row.
+
+    texts holds each cell's full text (nested text joined, whitespace
+    normalised); lines holds each cell's paragraph texts as written.
+    """
+
+    __slots__ = ("node", "texts", "lines")
+
+    def __init__(self, node: Dict[str, Any]):
+        self.node = node
+        cells = [cell for cell in node.get("children", []) if isinstance(cell, dict)]
+        self.texts: List[str] = [get_node_text(cell) for cell in cells]
+        self.lines: List[List[str]] = [
+            [(paragraph.get("text", "") or "") for paragraph in cell.get("children", [])
+             if isinstance(paragraph, dict)]
+            for cell in cells
+        ]
+
+    @property
+    def label(self) -> str:
+        """First paragraph of the first cell, stripped (the row's label column)."""
+        if not self.lines or not self.lines[0]:
+            return ""
+        return self.lines[0][0].strip()
+
+
+class SoATable:
+    """
+    One table node of the protocol.
+
+    rows are the table's TR rows in document order (including rows of nested
+    tables); direct_rows are the table node's immediate children.
+    """
+
+    __slots__ = ("node", "rows", "direct_rows")
+
+    def __init__(self, node: Dict[str, Any], rows: List[SoARow], direct_rows: List[SoARow]):
+        self.node = node
+        self.rows = rows
+        self.direct_rows = direct_rows
+
+
+class SoAModel:
+    """
+    Tables of a protocol document, located and decoded once.
+
+    The model also carries the document's TextIndex so later lookups (e.g. the
+    extension week search) reuse the same walk.
+    """
+
+    def __init__(self, doc: Any, text_index: Optional[TextIndex] = None):
+        self.doc = doc
+        self.text_index = text_index if text_index is not None else TextIndex(doc)
+        decoded: Dict[int, SoARow] = {}
+
+        def decode(rows: Iterable[Any]) -> List[SoARow]:
+            result = []
+            for row in rows:
+                if not isinstance(row, dict):
+                    continue
+                key = id(row)
+                if key not in decoded:
+                    decoded[key] = SoARow(row)
+                result.append(decoded[key])
+            return result
+
+        self.tables: List[SoATable] = []
+        for node in self.text_index.iter_nodes():
+            if not node.get("name", "").startswith("Table"):
+                continue
+            tr_nodes = (found for found in self.text_index.iter_nodes(node)
+                        if found.get("name", "").startswith("TR"))
+            self.tables.append(SoATable(node, decode(tr_nodes), decode(node.get("children", []))))
+
+
+def load_soa_model(protocol_json: str) -> SoAModel:
+    """
+    Load a protocol JSON file and build its table model.
+
+    Args:
+        protocol_json: Path to protocol JSON file
+
+    Returns:
+        SoAModel of the protocol
+    """
+    with open(protocol_json, "r", encoding="utf-8") as f:
+        return SoAModel(json.load(f))
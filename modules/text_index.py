@@ -0,0 +1,128 @@
+"""
+Text Index Module
+
+Lazy text-node traversal and a reusable text index over hierarchical
+protocol / eCRF JSON documents (nested dicts with "text" and "children").
+"""
+
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# Stack marker closing the subtree of the most recently opened node
+_CLOSE = object()
+
+
+def iter_text_nodes(root: Any) -> Iterator[Tuple[Dict[str, Any], str]]:
+    """
+    Walk a JSON document in document order, yielding each node with its text.
+
+    The walk is lazy, so callers that stop at the first hit never visit the
+    rest of the document.
+
+    Args:
+        root: Document node (dict) or list of nodes
+
+    Returns:
+        Iterator of (node, text) pairs; nodes without text yield ""
+    """
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, dict):
+            yield node, node.get("text", "") or ""
+            stack.extend(reversed(node.get("children", [])))
+        elif isinstance(node, list):
+            stack.extend(reversed(node))
+
+
+def iter_texts(root: Any) -> Iterator[str]:
+    """Lazily yield the non-empty texts under a node, in document order."""
+    for _, text in iter_text_nodes(root):
+        if text:
+            yield text
+
+
+class TextIndex:
+    """
+    Document-order index of every node's text, built once per document.
+
+    Texts are lower-cased once at build time, so repeated lookups against the
+    same document do not re-walk or re-lower the tree, and each node's subtree
+    is a contiguous slice of the index.
+    """
+
+    def __init__(self, root: Any):
+        self._nodes: List[Dict[str, Any]] = []
+        self._texts: List[str] = []
+        self._lower: List[str] = []
+        self._ends: List[int] = []
+        self._position: Dict[int, int] = {}
+        self._build(root)
+
+    def _build(self, root: Any) -> None:
+        # Iterative pre-order walk; _CLOSE is pushed beneath each node's
+        # children and records where its subtree ends
+        stack: List[Any] = [root]
+        open_nodes: List[int] = []
+        while stack:
+            node = stack.pop()
+            if node is _CLOSE:
+                self._ends[open_nodes.pop()] = len(self._nodes)
+                continue
+            if isinstance(node, list):
+                stack.extend(reversed(node))
+                continue
+            if not isinstance(node, dict):
+                continue
+            text = node.get("text", "") or ""
+            position = len(self._nodes)
+            self._position[id(node)] = position
+            self._nodes.append(node)
+            self._texts.append(text)
+            self._lower.append(text.lower())
+            self._ends.append(position + 1)
+            open_nodes.append(position)
+            stack.append(_CLOSE)
+            stack.extend(reversed(node.get("children", [])))
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # Positions are keyed by node id(), which does not survive pickling
+        state = self.__dict__.copy()
+        del state["_position"]
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self._position = {id(node): position for position, node in enumerate(self._nodes)}
+
+    def __len__(self) -> int:
+        return len(self._nodes)
+
+    def find(self, text: str) -> Optional[Dict[str, Any]]:
+        """Return the first node whose text contains text (case-insensitive)."""
+        needle = text.lower()
+        for position, lower in enumerate(self._lower):
+            if needle in lower:
+                return self._nodes[position]
+        return None
+
+    def iter_nodes(self, node: Optional[Dict[str, Any]] = None) -> Iterator[Dict[str, Any]]:
+        """Yield the nodes of the document (or of node's subtree) in document order."""
+        if node is None:
+            yield from self._nodes
+            return
+        position = self._position.get(id(node))
+        if position is None or self._nodes[position] is not node:
+            yield from (found for found, _ in iter_text_nodes(node))
+            return
+        yield from self._nodes[position:self._ends[position]]
+
+    def iter_texts(self, node: Dict[str, Any]) -> Iterator[str]:
+        """Lazily yield the non-empty texts under node, in document order."""
+        position = self._position.get(id(node))
+        if position is None or self._nodes[position] is not node:
+            # Not part of the indexed document
+            yield from iter_texts(node)
+            return
+        for index in range(position, self._ends[position]):
+            if self._texts[index]:
+                yield self._texts[index]
@@ -0,0 +1,73 @@
+"""
+Watch Module
+
+Polling file watcher for --watch. Files and directories are polled for
+mtime/size changes; a change is reported once the watched paths have been
+quiet for the debounce interval, so an editor's burst of saves (or an export
+still being written) triggers one regeneration.
+"""
+
+import logging
+import os
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+Snapshot = Dict[str, Tuple[int, int]]
+
+
+def snapshot_paths(paths: Iterable[str]) -> Snapshot:
+    """
+    Take the mtime/size of each watched file; directories contribute every file
+    directly inside them. Missing paths are left out (and so show up as changed).
+    """
+    stamps: Snapshot = {}
+    for path in paths:
+        if os.path.isdir(path):
+            entries = [os.path.join(path, name) for name in sorted(os.listdir(path))]
+        else:
+            entries = [path]
+        for entry in entries:
+            try:
+                stat = os.stat(entry)
+            except FileNotFoundError:
+                continue
+            if os.path.isfile(entry):
+                stamps[entry] = (stat.st_mtime_ns, stat.st_size)
+    return stamps
+
+
+def changed_paths(before: Snapshot, after: Snapshot) -> Set[str]:
+    """Paths added, removed or modified between two snapshots."""
+    return {path for path in before.keys() | after.keys() if before.get(path) != after.get(path)}
+
+
+def watch_paths(paths: List[str], on_change: Callable[[Set[str]], None], interval: float = 0.5,
+                debounce: float = 1.0, should_stop: Optional[Callable[[], bool]] = None) -> None:
+    """
+    Poll paths and call on_change(changed) after each settled burst of changes.
+
+    Args:
+        paths: Files and directories to watch
+        on_change: Called with the set of changed files once they have been
+                   unchanged for debounce seconds
+        interval: Polling interval in seconds
+        debounce: Quiet period required before on_change is called
+        should_stop: Polled between checks; watching ends when it returns True
+    """
+    last = snapshot_paths(paths)
+    pending: Set[str] = set()
+    settled_at = 0.0
+    while not (should_stop and should_stop()):
+        time.sleep(interval)
+        current = snapshot_paths(paths)
+        changed = changed_paths(last, current)
+        if changed:
+            # Restart the quiet period on every further change
+            pending |= changed
+            last = current
+            settled_at = time.monotonic() + debounce
+            logging.debug(f"Change detected: {', '.join(sorted(changed))}")
+            continue
+        if pending and time.monotonic() >= settled_at:
+            batch, pending = pending, set()
+            on_change(batch)
@@ -0,0 +1,228 @@
+"""
+Workbook Compare Module
+
+Cell-by-cell comparison of two PTD workbooks, used to prove that an optimised
+output path (--fast, --splice, the streaming writer, the forms cache, ...)
+produces the same PTD as the reference path. Sheets are read with openpyxl's
+read-only (streaming) reader and merged ranges are scanned from the sheet
+XML, so memory stays flat however large the workbooks are.
+
+Strictness levels (every level also checks the workbooks' sheet order):
+- values   cell values only ("" and empty cells are equal)
+- merges   values and merged ranges
+- styles   values, merged ranges, cell formatting (font, fill, border,
+           alignment, number format) and sheet settings (freeze panes, column
+           widths, row heights); styled empty cells count too, except those
+           covered by a merged range, which renders from its top-left cell
+"""
+
+import logging
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+from openpyxl import load_workbook
+from openpyxl.cell.read_only import EmptyCell
+from openpyxl.utils import get_column_letter, range_boundaries
+
+from .sheet_splice import read_merged_ranges, read_sheet_settings
+
+LEVELS = ("values", "merges", "styles")
+DEFAULT_SHEETS = ("Schedule Grid", "Study Specific Forms")
+DEFAULT_MAX_DIFFS = 20
+# counts / differences key for workbook-level differences (sheet order)
+WORKBOOK = "(workbook)"
+
+
+def _color(color: Any) -> Optional[str]:
+    if color is None:
+        return None
+    # rgb, indexed or theme colour
+    return f"{color.type}:{color.value}" + (f"/tint:{color.tint}" if color.tint else "")
+
+
+def _style_signature(cell: Any) -> Tuple:
+    """The formatting of a read-only cell, comparable across workbooks."""
+    font, fill, border, alignment = cell.font, cell.fill, cell.border, cell.alignment
+    return (
+        ("font", font.name, font.sz, font.b, font.i, font.u, _color(font.color)),
+        ("fill", fill.fill_type, _color(fill.fgColor) if fill.fill_type else None),
+        ("border",) + tuple(getattr(border, side).style for side in ("left", "right", "top", "bottom")),
+        ("alignment", alignment.horizontal, alignment.vertical, bool(alignment.wrap_text)),
+        ("number_format", cell.number_format),
+    )
+
+
+def covered_cells(merged_ranges: List[str]) -> Set[Tuple[int, int]]:
+    """(row, column) of every cell inside a merged range except its top-left cell."""
+    covered = set()
+    for ref in merged_ranges:
+        min_col, min_row, max_col, max_row = range_boundaries(ref)
+        covered.update((row, column) for row in range(min_row, max_row + 1)
+                       for column in range(min_col, max_col + 1))
+        covered.discard((min_row, min_col))
+    return covered
+
+
+def iter_sheet_cells(worksheet: Any, styles: bool = False,
+                     skip: Optional[Set[Tuple[int, int]]] = None) -> Iterator[Tuple[int, int, Any, Optional[Tuple]]]:
+    """
+    Yield (row, column, value, style) for the non-empty cells of a read-only
+    worksheet in row-major order. With styles, styled empty cells are included
+    and style is the cell's formatting signature; otherwise it is None.
+    Empty cells at the (row, column) positions in skip are left out.
+    """
+    signatures: Dict[int, Tuple] = {}
+    skip = skip or set()
+    # Declared dimensions may be stale; read every row actually present
+    worksheet.reset_dimensions()
+    for row in worksheet.iter_rows():
+        for cell in row:
+            if isinstance(cell, EmptyCell):
+                continue
+            value = None if cell.value == "" else cell.value
+            if value is None and not (styles and cell.has_style and (cell.row, cell.column) not in skip):
+                continue
+            signature = None
+            if styles:
+                signature = signatures.get(cell._style_id)
+                if signature is None:
+                    signature = signatures[cell._style_id] = _style_signature(cell)
+            yield cell.row, cell.column, value, signature
+
+
+def _coordinate(row: int, column: int) -> str:
+    return f"{get_column_letter(column)}{row}"
+
+
+def _compare_cells(reference: Any, candidate: Any, sheet: str, styles: bool,
+                   skip: Set[Tuple[int, int]]) -> Iterator[Dict[str, Any]]:
+    """Merge-join two row-major cell streams, yielding one difference per mismatching cell."""
+    expected_cells = iter_sheet_cells(reference, styles, skip)
+    actual_cells = iter_sheet_cells(candidate, styles, skip)
+    expected = next(expected_cells, None)
+    actual = next(actual_cells, None)
+    while expected is not None or actual is not None:
+        # A cell present on one side only: a value, or (styles level) a styled empty cell
+        if actual is None or (expected is not None and expected[:2] < actual[:2]):
+            yield {"sheet": sheet, "cell": _coordinate(*expected[:2]),
+                   "kind": "value" if expected[2] is not None else "style",
+                   "expected": expected[2] if expected[2] is not None else expected[3], "actual": None}
+            expected = next(expected_cells, None)
+        elif expected is None or actual[:2] < expected[:2]:
+            yield {"sheet": sheet, "cell": _coordinate(*actual[:2]),
+                   "kind": "value" if actual[2] is not None else "style",
+                   "expected": None, "actual": actual[2] if actual[2] is not None else actual[3]}
+            actual = next(actual_cells, None)
+        else:
+            cell = _coordinate(*expected[:2])
+            if expected[2] != actual[2]:
+                yield {"sheet": sheet, "cell": cell, "kind": "value", "expected": expected[2], "actual": actual[2]}
+            elif expected[3] != actual[3]:
+                yield {"sheet": sheet, "cell": cell, "kind": "style", "expected": expected[3], "actual": actual[3]}
+            expected = next(expected_cells, None)
+            actual = next(actual_cells, None)
+
+
+def _compare_merges(expected: Set[str], actual: Set[str], sheet: str) -> Iterator[Dict[str, Any]]:
+    for ref in sorted(expected - actual):
+        yield {"sheet": sheet, "cell": ref, "kind": "merge", "expected": ref, "actual": None}
+    for ref in sorted(actual - expected):
+        yield {"sheet": sheet, "cell": ref, "kind": "merge", "expected": None, "actual": ref}
+
+
+def _size(value: Optional[float]) -> Optional[float]:
+    # Widths and heights are floats serialised by different writers
+    return round(value, 4) if value is not None else None
+
+
+def _compare_settings(expected: Dict[str, Any], actual: Dict[str, Any], sheet: str) -> Iterator[Dict[str, Any]]:
+    """Differences in freeze panes, column widths and row heights (see read_sheet_settings)."""
+    if expected["freeze_panes"] != actual["freeze_panes"]:
+        yield {"sheet": sheet, "cell": None, "kind": "freeze_panes",
+               "expected": expected["freeze_panes"], "actual": actual["freeze_panes"]}
+    for key, kind, label in (("column_widths", "column_width", get_column_letter), ("row_heights", "row_height", str)):
+        for index in sorted(set(expected[key]) | set(actual[key])):
+            expected_size, actual_size = _size(expected[key].get(index)), _size(actual[key].get(index))
+            if expected_size != actual_size:
+                yield {"sheet": sheet, "cell": label(index), "kind": kind,
+                       "expected": expected_size, "actual": actual_size}
+
+
+def compare_workbooks(reference_xlsx: str, candidate_xlsx: str, sheets: Tuple[str, ...] = DEFAULT_SHEETS,
+                      level: str = "values", max_diffs: int = DEFAULT_MAX_DIFFS) -> Dict[str, Any]:
+    """
+    Compare sheets of two workbooks cell by cell, and the workbooks' sheet order.
+
+    Args:
+        reference_xlsx: Workbook from the reference path
+        candidate_xlsx: Workbook to check against it
+        sheets: Sheet names to compare
+        level: Strictness: "values", "merges" or "styles" (see LEVELS)
+        max_diffs: Number of differences to report; all differences are counted
+
+    Returns:
+        Dict with "equal", "level", per-sheet difference "counts" (sheet order
+        differences under WORKBOOK) and the first max_diffs "differences"
+        (dicts with sheet, cell, kind, expected, actual)
+    """
+    if level not in LEVELS:
+        raise ValueError(f"Unknown comparison level '{level}' (choose from {', '.join(LEVELS)})")
+
+    counts: Dict[str, int] = {}
+    differences: List[Dict[str, Any]] = []
+
+    def record(difference: Dict[str, Any]) -> None:
+        counts[difference["sheet"]] += 1
+        if len(differences) < max_diffs:
+            differences.append(difference)
+
+    wb_reference = load_workbook(reference_xlsx, read_only=True)
+    wb_candidate = load_workbook(candidate_xlsx, read_only=True)
+    try:
+        counts[WORKBOOK] = 0
+        if wb_reference.sheetnames != wb_candidate.sheetnames:
+            record({"sheet": WORKBOOK, "cell": None, "kind": "sheet_order",
+                    "expected": wb_reference.sheetnames, "actual": wb_candidate.sheetnames})
+        for sheet in sheets:
+            counts[sheet] = 0
+            missing = [path for path, wb in ((reference_xlsx, wb_reference), (candidate_xlsx, wb_candidate))
+                       if sheet not in wb.sheetnames]
+            if missing:
+                for path in missing:
+                    record({"sheet": sheet, "cell": None, "kind": "sheet", "expected": sheet,
+                            "actual": f"missing from {path}"})
+                continue
+            skip: Set[Tuple[int, int]] = set()
+            if level != "values":
+                expected_merges = set(read_merged_ranges(reference_xlsx, sheet))
+                actual_merges = set(read_merged_ranges(candidate_xlsx, sheet))
+                # Covered on both sides: hidden either way; otherwise the merge difference is reported
+                skip = covered_cells(sorted(expected_merges)) & covered_cells(sorted(actual_merges))
+            for difference in _compare_cells(wb_reference[sheet], wb_candidate[sheet], sheet, level == "styles", skip):
+                record(difference)
+            if level != "values":
+                for difference in _compare_merges(expected_merges, actual_merges, sheet):
+                    record(difference)
+            if level == "styles":
+                for difference in _compare_settings(read_sheet_settings(reference_xlsx, sheet),
+                                                    read_sheet_settings(candidate_xlsx, sheet), sheet):
+                    record(difference)
+    finally:
+        wb_reference.close()
+        wb_candidate.close()
+
+    total = sum(counts.values())
+    logging.info(f"Compared {candidate_xlsx} with {reference_xlsx} ({level}): {total} differences")
+    return {"equal": total == 0, "level": level, "counts": counts, "differences": differences}
+
+
+def format_differences(result: Dict[str, Any]) -> str:
+    """Readable report of a compare_workbooks result."""
+    lines = [f"{sheet}: {count} difference(s)" for sheet, count in result["counts"].items()]
+    for difference in result["differences"]:
+        location = f"{difference['sheet']}!{difference['cell']}" if difference["cell"] else difference["sheet"]
+        lines.append(f"  {location} [{difference['kind']}] expected {difference['expected']!r}, "
+                     f"got {difference['actual']!r}")
+    shown, total = len(result["differences"]), sum(result["counts"].values())
+    if total > shown:
+        lines.append(f"  ... {total - shown} more")
+    return "\n".join(lines)
@@ -0,0 +1,155 @@
+"""
+XLSX Writer Module
+
+Row-oriented writer for the generated worksheets (schedule grid and study
+specific forms). Two backends produce the same cells, merges, fills,
+borders, column widths, row heights and freeze panes:
+
+- "openpyxl": the regular in-memory openpyxl workbook (default)
+- "streaming": an openpyxl write-only workbook; rows are serialised as they
+  are appended, so memory stays constant however large the sheet grows
+
+SheetLayout holds the same content in memory (rows, merges and sheet
+settings) until it is explicitly saved through a SheetWriter.
+"""
+
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+from openpyxl import Workbook
+from openpyxl.styles import NamedStyle
+from openpyxl.utils import get_column_letter
+
+from .excel_utils import ColumnWidthTracker, append_row, merge_range, register_styles
+
+XLSX_BACKENDS = ("openpyxl", "streaming")
+
+
+class SheetWriter:
+    """
+    Write a single-sheet workbook row by row from (value, style name) entries.
+
+    Sheet-level settings (column widths, row heights, freeze panes) must be
+    set before the first row is appended: the streaming backend writes them
+    ahead of the rows. Merges may be added at any time and are applied once
+    all rows are in place.
+    """
+
+    def __init__(self, title: str, styles: Iterable[NamedStyle] = (), backend: str = "openpyxl"):
+        if backend not in XLSX_BACKENDS:
+            raise ValueError(f"Unknown xlsx backend: {backend} (expected one of {', '.join(XLSX_BACKENDS)})")
+        self.backend = backend
+        self.wb = Workbook(write_only=(backend == "streaming"))
+        if backend == "streaming":
+            self.ws = self.wb.create_sheet(title)
+        else:
+            self.ws = self.wb.active
+            self.ws.title = title
+        register_styles(self.wb, styles)
+        self.rows_written = 0
+        self._merges: List[Tuple[int, int, int, int]] = []
+
+    def add_styles(self, styles: Iterable[NamedStyle]) -> None:
+        """Register further style templates (e.g. ones derived while copying a sheet)."""
+        register_styles(self.wb, styles)
+
+    def set_widths(self, widths: ColumnWidthTracker, min_width: float = 10,
+                   max_width: Optional[float] = None, padding: float = 2,
+                   max_column: Optional[int] = None) -> None:
+        """Apply fitted column widths from a tracker."""
+        self._check_not_started("column widths")
+        widths.apply(self.ws, min_width=min_width, max_width=max_width,
+                     padding=padding, max_column=max_column)
+
+    def set_row_height(self, row: int, height: float) -> None:
+        """Set the height of a (1-based) row."""
+        if row <= self.rows_written:
+            raise RuntimeError(f"Row {row} has already been written")
+        self.ws.row_dimensions[row].height = height
+
+    def freeze(self, row: int, column: int) -> None:
+        """Freeze panes above row and left of column."""
+        self._check_not_started("freeze panes")
+        self.ws.freeze_panes = f"{get_column_letter(column)}{row}"
+
+    def merge(self, start_row: int, start_column: int, end_row: int, end_column: int) -> None:
+        """Merge a cell range; the value and style of its top-left cell apply to the range."""
+        self._merges.append((start_row, start_column, end_row, end_column))
+
+    def append(self, entries: Sequence[Optional[Tuple[Any, Optional[str]]]]) -> None:
+        """Append one row of (value, style name) entries; None leaves a cell unwritten."""
+        append_row(self.ws, entries)
+        self.rows_written += 1
+
+    def append_values(self, values: Iterable[Any]) -> None:
+        """Append one row of plain, unstyled values."""
+        self.ws.append(list(values))
+        self.rows_written += 1
+
+    def save(self, output_path: str) -> str:
+        """Apply pending merges and save the workbook."""
+        for merge in self._merges:
+            merge_range(self.ws, *merge)
+        self._merges = []
+        self.wb.save(output_path)
+        return output_path
+
+    def _check_not_started(self, what: str) -> None:
+        if self.rows_written:
+            raise RuntimeError(f"Set {what} before appending rows")
+
+
+class SheetLayout:
+    """
+    In-memory sheet model: rows of (value, style name) entries plus merges,
+    column widths, row heights and freeze panes. Nothing is written until
+    save(), which replays the layout through a SheetWriter.
+    """
+
+    def __init__(self, title: str, styles: Iterable[NamedStyle] = ()):
+        self.title = title
+        self.styles: List[NamedStyle] = list(styles)
+        self.rows: List[Sequence[Optional[Tuple[Any, Optional[str]]]]] = []
+        self.merges: List[Tuple[int, int, int, int]] = []
+        self.row_heights: Dict[int, float] = {}
+        self.freeze_at: Optional[Tuple[int, int]] = None
+        self.widths: Optional[ColumnWidthTracker] = None
+        self.width_options: Dict[str, Any] = {}
+
+    def set_widths(self, widths: ColumnWidthTracker, **options: Any) -> None:
+        """Fit column widths from a tracker (options as for SheetWriter.set_widths)."""
+        self.widths = widths
+        self.width_options = options
+
+    def set_row_height(self, row: int, height: float) -> None:
+        """Set the height of a (1-based) row."""
+        self.row_heights[row] = height
+
+    def freeze(self, row: int, column: int) -> None:
+        """Freeze panes above row and left of column."""
+        self.freeze_at = (row, column)
+
+    def merge(self, start_row: int, start_column: int, end_row: int, end_column: int) -> None:
+        """Merge a cell range."""
+        self.merges.append((start_row, start_column, end_row, end_column))
+
+    def append(self, entries: Sequence[Optional[Tuple[Any, Optional[str]]]]) -> None:
+        """Append one row of (value, style name) entries; None leaves a cell unwritten."""
+        self.rows.append(entries)
+
+    def values(self) -> List[List[Any]]:
+        """Cell values row by row (None where no cell is written)."""
+        return [[entry[0] if entry is not None else None for entry in entries] for entries in self.rows]
+
+    def save(self, output_path: str, backend: str = "openpyxl") -> str:
+        """Write the layout as a single-sheet workbook with the given backend."""
+        writer = SheetWriter(self.title, self.styles, backend=backend)
+        if self.widths is not None:
+            writer.set_widths(self.widths, **self.width_options)
+        for row, height in sorted(self.row_heights.items()):
+            writer.set_row_height(row, height)
+        if self.freeze_at is not None:
+            writer.freeze(*self.freeze_at)
+        for merge in self.merges:
+            writer.merge(*merge)
+        for entries in self.rows:
+            writer.append(entries)
+        return writer.save(output_path)